@@ -0,0 +1,75 @@
+import re
+import unicodedata
+from typing import Callable, Dict, List, Tuple
+
+# Unicode math symbols students paste in, mapped to their plain ASCII form
+MATH_SYMBOLS = {
+    "×": "*",
+    "·": "*",
+    "∗": "*",
+    "÷": "/",
+    "−": "-",
+    "–": "-",
+    "—": "-",
+    "≤": "<=",
+    "≥": ">=",
+    "≠": "!=",
+}
+
+# Normalized answers that mean the student did not attempt the question
+NON_ANSWERS = {
+    "", "-", "?", "??", "???",
+    "idk", "i dont know", "i don't know", "dont know", "don't know", "i do not know",
+    "no idea", "not sure", "i'm not sure", "im not sure", "no clue", "pass", "skip",
+}
+
+def normalize_answer(answer_text: str) -> str:
+    """
+    Normalize a short answer so trivially different spellings compare equal.
+
+    Lowercases, collapses whitespace, drops surrounding quotes and trailing
+    punctuation, and canonicalizes simple math formatting (e.g. "(13!) ** 4"
+    and "13!^4" both become "13!^4"; "O(n log n)" becomes "o(n log n)").
+    """
+    text = unicodedata.normalize("NFKC", answer_text or "").lower()
+    for symbol, replacement in MATH_SYMBOLS.items():
+        text = text.replace(symbol, replacement)
+    text = text.replace("**", "^")
+
+    # collapse whitespace, then drop it around operators and brackets
+    text = re.sub(r"\s+", " ", text).strip()
+    text = re.sub(r"\s*([\^*/+=<>()\[\]{},-])\s*", r"\1", text)
+
+    # remove redundant parentheses around a single token, e.g. (13!)^4 -> 13!^4
+    text = re.sub(r"(?<![\w)])\(([\w.]+!?)\)", r"\1", text)
+
+    # surrounding quotes and trailing sentence punctuation (but keep factorial "!")
+    text = text.lstrip("\"'` ").rstrip("\"'`.,;:? ")
+    return text
+
+def is_blank_answer(answer_text: str) -> bool:
+    """True if the answer is empty or an "I don't know"-style non-answer."""
+    return normalize_answer(answer_text).replace("’", "'").rstrip("!") in NON_ANSWERS
+
+def group_answers(answers: List[str]) -> List[Tuple[str, int]]:
+    """
+    Group answers by their normalized form.
+
+    Returns (representative answer, multiplicity) pairs in first-seen order;
+    the representative is the first original answer seen in each group.
+    """
+    return [(members[0], len(members)) for members in _group_by_normalized(answers, lambda answer: answer)]
+
+def group_responses(responses: List[Dict], text_key: str = "response_text") -> List[Tuple[str, List[Dict]]]:
+    """
+    Group response rows by the normalized form of their answer text.
+
+    Returns (representative answer, member rows) pairs in first-seen order.
+    """
+    return [(members[0][text_key], members) for members in _group_by_normalized(responses, lambda response: response[text_key])]
+
+def _group_by_normalized(items: List, get_text: Callable) -> List[List]:
+    groups: Dict[str, List] = {}
+    for item in items:
+        groups.setdefault(normalize_answer(get_text(item)), []).append(item)
+    return list(groups.values())
@@ -0,0 +1,87 @@
+import os
+import time
+import asyncio
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Tuple
+
+# Default cap on how many LLM/DB calls a single pipeline keeps in flight at once
+DEFAULT_CONCURRENCY = int(os.environ.get("GRADING_CONCURRENCY", "16"))
+
+# Worker processes for CPU-bound work such as PDF text extraction (defaults to the CPU count)
+PROCESS_POOL_WORKERS = int(os.environ.get("PROCESS_POOL_WORKERS", "0")) or None
+
+# How long (seconds) a finished single-flight result is handed to repeat callers
+SINGLE_FLIGHT_TTL = float(os.environ.get("SINGLE_FLIGHT_TTL", "10"))
+
+async def gather_with_concurrency(limit: int, coros: Iterable[Awaitable[Any]]) -> List[Any]:
+    """
+    Run awaitables concurrently with at most `limit` of them in flight.
+    Results are returned in the same order as the input.
+    """
+    return await gather_with_semaphore(asyncio.Semaphore(max(1, limit)), coros)
+
+async def gather_with_semaphore(semaphore: asyncio.Semaphore, coros: Iterable[Awaitable[Any]]) -> List[Any]:
+    """Like gather_with_concurrency, but shares a caller-owned semaphore so several gathers can draw from one cap."""
+    async def run(coro: Awaitable[Any]) -> Any:
+        async with semaphore:
+            return await coro
+
+    return await asyncio.gather(*(run(coro) for coro in coros))
+
+async def run_blocking(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run a blocking call (e.g. a Supabase query) in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(func, *args, **kwargs)
+
+_process_pool: ProcessPoolExecutor = None
+
+async def run_in_process(func: Callable[..., Any], *args) -> Any:
+    """
+    Run a CPU-bound call in the shared process pool so it neither blocks the
+    event loop nor holds the GIL. `func` and its arguments must be picklable.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS)
+    return await asyncio.get_running_loop().run_in_executor(_process_pool, func, *args)
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight execution.
+
+    While a call for a key is running, further calls with the same key wait for
+    it and receive its result (or its exception). A successful result is also
+    returned to callers arriving within `ttl` seconds after it finished, instead
+    of running the call again.
+
+    The call runs in its own task rather than in the first caller, so any
+    caller (the first one included) can be cancelled without cancelling the
+    execution the others are waiting on.
+    """
+
+    def __init__(self, ttl: float = SINGLE_FLIGHT_TTL):
+        self.ttl = ttl
+        self.in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.recent: Dict[Hashable, Tuple[float, Any]] = {}
+
+    async def run(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        now = time.monotonic()
+        self.recent = {k: v for k, v in self.recent.items() if v[0] > now}
+        if key in self.recent:
+            return self.recent[key][1]
+
+        task = self.in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._execute(key, func, *args, **kwargs))
+            # mark the exception retrieved in case every caller gave up before it finished
+            task.add_done_callback(lambda done: done.cancelled() or done.exception())
+            self.in_flight[key] = task
+        # shield so a caller giving up doesn't cancel the shared execution
+        return await asyncio.shield(task)
+
+    async def _execute(self, key: Hashable, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        try:
+            result = await func(*args, **kwargs)
+        finally:
+            self.in_flight.pop(key, None)
+        self.recent[key] = (time.monotonic() + self.ttl, result)
+        return result
@@ -0,0 +1,50 @@
+import numpy as np
+from typing import List, Optional
+
+def cluster_embeddings(embeddings: np.ndarray, weights: Optional[np.ndarray] = None, threshold: float = 0.75) -> List[List[int]]:
+    """
+    Deterministically cluster embedding vectors by cosine similarity.
+
+    Greedy leader clustering: the unassigned point with the largest weighted
+    number of unassigned neighbours (similarity >= threshold) becomes a cluster
+    centre and takes all of those neighbours; repeat until every point is
+    assigned. Ties are broken by input order, so the same input always gives
+    the same clusters.
+
+    Args:
+        embeddings: (n, d) array of embedding vectors
+        weights: optional (n,) array of how many students each point stands for
+        threshold: minimum cosine similarity to join a centre's cluster
+
+    Returns:
+        Clusters as lists of point indices, the centre first and the rest ordered
+        by similarity to it, sorted by total weight (largest first).
+    """
+    n = len(embeddings)
+    if n == 0:
+        return []
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+
+    vectors = np.asarray(embeddings, dtype=float)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    vectors = vectors / np.where(norms == 0, 1, norms)
+    similarity = vectors @ vectors.T
+    neighbours = similarity >= threshold
+
+    unassigned = np.ones(n, dtype=bool)
+    clusters = []
+    while unassigned.any():
+        # weighted count of still-unassigned neighbours for every unassigned point
+        density = (neighbours[:, unassigned] * weights[unassigned]).sum(axis=1)
+        density[~unassigned] = -1
+        centre = int(np.argmax(density))
+
+        members = np.flatnonzero(neighbours[centre] & unassigned)
+        members = members[members != centre]
+        members = members[np.argsort(-similarity[centre, members], kind="stable")]
+        clusters.append([centre] + [int(i) for i in members])
+        unassigned[centre] = False
+        unassigned[members] = False
+
+    clusters.sort(key=lambda cluster: (-weights[cluster].sum(), cluster[0]))
+    return clusters
@@ -27,6 +27,12 @@ def download_file(file_id: str, save_path: str) -> bool:
         print(f"Error downloading file: {str(e)}")
         return False
 
+def convert_drive_link_to_direct_download(drive_link: str) -> str:
+    """Convert a Google Drive sharing link to a direct download link"""
+    # Extract file ID from the Google Drive link
+    file_id = drive_link.split('/d/')[1].split('/')[0]
+    return f"https://drive.google.com/uc?export=download&id={file_id}"
+
 def download_files_to_data(file_ids: list[str]) -> list[str]:
     """
     Downloads multiple files from Google Drive to the data directory.
@@ -0,0 +1,169 @@
+import os
+import io
+import json
+import uuid
+import asyncio
+from typing import Callable, Dict, List, Optional
+from openai import OpenAI
+from llm_cache import scheduled_chat_completion
+from async_utils import run_blocking
+
+# Which batch backend grading jobs use: "openai" (the provider's Batch API) or "local"
+LLM_BATCH_BACKEND = os.environ.get("LLM_BATCH_BACKEND", "openai")
+# Where the local backend keeps its batches
+LOCAL_BATCH_DIR = os.environ.get("LOCAL_BATCH_DIR", "data/local_batches")
+BATCH_POLL_INTERVAL = float(os.environ.get("BATCH_POLL_INTERVAL", "30"))
+BATCH_COMPLETION_WINDOW = "24h"
+
+# Terminal batch statuses; anything else is still in progress
+BATCH_DONE = {"completed", "failed", "expired", "cancelled"}
+
+def make_batch_request(custom_id: str, params: Dict) -> Dict:
+    """One line of a batch input file: a chat completion request tagged with `custom_id`."""
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": params}
+
+def write_batch_file(path: str, requests: List[Dict]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        for request in requests:
+            f.write(json.dumps(request) + "\n")
+
+def parse_batch_output(lines: str) -> Dict[str, Optional[Dict]]:
+    """
+    Map each custom_id in a batch output file to its chat completion body,
+    or None if that request failed.
+    """
+    results = {}
+    for line in lines.splitlines():
+        if not line.strip():
+            continue
+        record = json.loads(line)
+        response = record.get("response") or {}
+        ok = not record.get("error") and response.get("status_code") == 200
+        results[record["custom_id"]] = response.get("body") if ok else None
+    return results
+
+def completion_text(body: Optional[Dict]) -> Optional[str]:
+    """Message content of a chat completion body from a batch output file."""
+    if not body:
+        return None
+    return body["choices"][0]["message"]["content"]
+
+class BatchBackend:
+    """
+    Provider batch interface: submit a JSONL file of chat completion requests
+    (see make_batch_request), poll its status, then read the results keyed by
+    custom_id once the status is "completed".
+    """
+
+    def submit(self, input_path: str) -> str:
+        """Submit a batch input file. Returns the batch id."""
+        raise NotImplementedError
+
+    def status(self, batch_id: str) -> str:
+        """The batch's status; one of BATCH_DONE once it is finished."""
+        raise NotImplementedError
+
+    def results(self, batch_id: str) -> Dict[str, Optional[Dict]]:
+        """Response body per custom_id, or None for requests that failed or never ran."""
+        raise NotImplementedError
+
+class OpenAIBatchBackend(BatchBackend):
+    """OpenAI's Batch API: half the price of online requests, completed within 24 hours."""
+
+    def __init__(self, client: OpenAI = None):
+        self.client = client or OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self.client.files.create(file=f, purpose="batch")
+        batch = self.client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=BATCH_COMPLETION_WINDOW
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> str:
+        return self.client.batches.retrieve(batch_id).status
+
+    def results(self, batch_id: str) -> Dict[str, Optional[Dict]]:
+        batch = self.client.batches.retrieve(batch_id)
+        results = {}
+        # failed requests are listed in the error file, so they come back as None too
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                results.update(parse_batch_output(self.client.files.content(file_id).text))
+        return results
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a provider batch API, for development and tests.
+
+    Each batch is a directory holding a copy of its input file; the requests
+    are answered by `responder(body) -> completion body` the first time the
+    batch's status is checked, and written to output.jsonl in the provider's
+    output format. The default responder sends each request online.
+    """
+
+    def __init__(self, directory: str = LOCAL_BATCH_DIR, responder: Callable[[Dict], Dict] = None):
+        self.directory = directory
+        self.responder = responder or self._respond_online
+        self.client: OpenAI = None
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"batch_{uuid.uuid4().hex}"
+        batch_dir = os.path.join(self.directory, batch_id)
+        os.makedirs(batch_dir)
+        with open(input_path) as src, open(os.path.join(batch_dir, "input.jsonl"), "w") as dst:
+            dst.write(src.read())
+        return batch_id
+
+    def status(self, batch_id: str) -> str:
+        batch_dir = os.path.join(self.directory, batch_id)
+        output_path = os.path.join(batch_dir, "output.jsonl")
+        if not os.path.exists(output_path):
+            output = io.StringIO()
+            with open(os.path.join(batch_dir, "input.jsonl")) as f:
+                for line in f:
+                    if line.strip():
+                        output.write(json.dumps(self._run(json.loads(line))) + "\n")
+            # written in one go so a half-finished batch never looks completed
+            with open(output_path + ".tmp", "w") as f:
+                f.write(output.getvalue())
+            os.replace(output_path + ".tmp", output_path)
+        return "completed"
+
+    def results(self, batch_id: str) -> Dict[str, Optional[Dict]]:
+        with open(os.path.join(self.directory, batch_id, "output.jsonl")) as f:
+            return parse_batch_output(f.read())
+
+    def _run(self, request: Dict) -> Dict:
+        try:
+            body = self.responder(request["body"])
+            return {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}
+        except Exception as e:
+            return {"custom_id": request["custom_id"], "response": None, "error": {"message": str(e)}}
+
+    def _respond_online(self, body: Dict) -> Dict:
+        if self.client is None:
+            self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        return scheduled_chat_completion(self.client, **body).model_dump()
+
+def get_batch_backend(name: str = LLM_BATCH_BACKEND) -> BatchBackend:
+    if name == "local":
+        return LocalBatchBackend()
+    if name == "openai":
+        return OpenAIBatchBackend()
+    raise ValueError(f"Unknown batch backend: {name}")
+
+async def wait_for_batch(backend: BatchBackend, batch_id: str, poll_interval: float = BATCH_POLL_INTERVAL) -> str:
+    """Poll a batch until it finishes, without blocking the event loop. Returns its final status."""
+    while True:
+        status = await run_blocking(backend.status, batch_id)
+        if status in BATCH_DONE:
+            return status
+        print(f"batch {batch_id} is {status}, checking again in {poll_interval:.0f}s")
+        await asyncio.sleep(poll_interval)
@@ -0,0 +1,359 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, List, Optional
+from openai.types.chat import ChatCompletion
+from llm_scheduler import DEFAULT_COMPLETION_TOKENS, estimate_tokens, llm_scheduler
+from llm_hedge import hedged, hedged_sync
+from prompt_budget import IMAGE_TOKENS
+
+# Where cached LLM responses live, how much disk they may use and how long an entry stays valid
+LLM_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", "data/llm_cache.db")
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+
+def normalize_content(content: Any) -> Any:
+    """
+    Reduce message content to a stable, JSON-serializable form for hashing:
+    text has per-line indentation and surrounding whitespace stripped, and
+    images or binary parts are replaced by a digest of their bytes.
+    """
+    if isinstance(content, str):
+        return "\n".join(line.strip() for line in content.strip().splitlines())
+    if isinstance(content, (bytes, bytearray)):
+        return {"sha256": hashlib.sha256(content).hexdigest()}
+    if isinstance(content, dict):
+        return {key: normalize_content(value) for key, value in sorted(content.items())}
+    if isinstance(content, (list, tuple)):
+        return [normalize_content(item) for item in content]
+    if hasattr(content, "tobytes") and hasattr(content, "size"):
+        # PIL image
+        return {"image": [content.mode, list(content.size)], "sha256": hashlib.sha256(content.tobytes()).hexdigest()}
+    return content
+
+def make_cache_key(provider: str, model: str, messages: Any, params: Optional[Dict] = None) -> str:
+    """Content address of an LLM request: provider, model, normalized messages and all other parameters (schema included)."""
+    payload = {
+        "provider": provider,
+        "model": model,
+        "messages": normalize_content(messages),
+        "params": normalize_content(params or {}),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    Persistent, content-addressed cache of LLM responses in a local SQLite file.
+
+    Entries expire after their TTL and the least recently used entries are
+    evicted once the stored values exceed `max_bytes`. Hits and misses are
+    counted per "provider:model" for monitoring.
+    """
+
+    def __init__(self, db_path: str = LLM_CACHE_PATH, max_bytes: int = LLM_CACHE_MAX_BYTES, ttl: float = LLM_CACHE_TTL, enabled: bool = LLM_CACHE_ENABLED):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self.db_lock = threading.Lock()
+        self.db: sqlite3.Connection = None
+        self.total_bytes = 0
+        self.metrics: Dict[str, Dict[str, int]] = {}
+
+    def get(self, key: str, label: str = "") -> Optional[str]:
+        self._connect()
+        now = time.time()
+        with self.db_lock:
+            row = self.db.execute("SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row and row[1] > now:
+                self.db.execute("UPDATE llm_cache SET last_used = ? WHERE key = ?", (now, key))
+                self.db.commit()
+            value = row[0] if row and row[1] > now else None
+        self._count(label, "hits" if value is not None else "misses")
+        return value
+
+    def set(self, key: str, value: str, ttl: float = None):
+        self._connect()
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self.db_lock:
+            previous = self.db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            self.db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, size, expires_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + (ttl if ttl is not None else self.ttl), now),
+            )
+            self.total_bytes += size - (previous[0] if previous else 0)
+            if self.total_bytes > self.max_bytes:
+                self._evict(now)
+            self.db.commit()
+
+    def delete(self, key: str):
+        self._connect()
+        with self.db_lock:
+            previous = self.db.execute("SELECT size FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if previous:
+                self.db.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self.total_bytes -= previous[0]
+                self.db.commit()
+
+    def stats(self) -> Dict:
+        self._connect()
+        with self.db_lock:
+            entries = self.db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+        return {
+            "enabled": self.enabled,
+            "entries": entries,
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "by_model": self.metrics,
+        }
+
+    def _evict(self, now: float):
+        # drop expired entries, then least recently used ones until back under 90% of the budget
+        self.db.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        self.total_bytes = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        target = self.max_bytes * 0.9
+        if self.total_bytes <= target:
+            return
+        evicted = []
+        for key, size in self.db.execute("SELECT key, size FROM llm_cache ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            evicted.append((key,))
+            self.total_bytes -= size
+        self.db.executemany("DELETE FROM llm_cache WHERE key = ?", evicted)
+
+    def _count(self, label: str, outcome: str):
+        counts = self.metrics.setdefault(label, {"hits": 0, "misses": 0})
+        counts[outcome] += 1
+
+    def _connect(self):
+        if self.db is not None:
+            return
+        with self.db_lock:
+            if self.db is not None:
+                return
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_used ON llm_cache (last_used)")
+            db.commit()
+            self.total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+            self.db = db
+
+llm_cache = LLMCache()
+
+def _chat_key(params: Dict) -> tuple:
+    model = params.get("model", "")
+    rest = {key: value for key, value in params.items() if key not in ("model", "messages")}
+    return make_cache_key("openai", model, params.get("messages"), rest), f"openai:{model}"
+
+def _chat_tokens(params: Dict) -> int:
+    return estimate_tokens(params.get("messages"), params.get("max_tokens") or DEFAULT_COMPLETION_TOKENS)
+
+def _total_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return getattr(usage, "total_tokens", None)
+
+def scheduled_chat_completion(client, **params) -> ChatCompletion:
+    """client.chat.completions.create(**params) through llm_scheduler's rate limits and retries."""
+    model_key = f"openai:{params.get('model', '')}"
+    tokens = _chat_tokens(params)
+    response = llm_scheduler.call(model_key, lambda: client.chat.completions.create(**params), tokens)
+    llm_scheduler.record_usage(model_key, tokens, _total_tokens(response))
+    return response
+
+async def scheduled_async_chat_completion(client, hedge_site: str = None, hedge_model: str = None, **params) -> ChatCompletion:
+    """
+    Async counterpart of scheduled_chat_completion for AsyncOpenAI clients.
+    With `hedge_site`, the provider request (once admitted) is hedged under
+    that call site with a duplicate, sent to `hedge_model` if given. The
+    duplicate is admitted and charged through llm_scheduler like any other
+    request, and each request corrects its own model's token estimate.
+    """
+    model_key = f"openai:{params.get('model', '')}"
+    tokens = _chat_tokens(params)
+
+    async def send(request_key: str, request_params: Dict) -> ChatCompletion:
+        response = await client.chat.completions.create(**request_params)
+        llm_scheduler.record_usage(request_key, tokens, _total_tokens(response))
+        return response
+
+    create = lambda: send(model_key, params)
+    if hedge_site:
+        request = create
+        hedge_params = {**params, "model": hedge_model} if hedge_model else params
+        hedge_key = f"openai:{hedge_params.get('model', '')}"
+        duplicate = lambda: llm_scheduler.acall(hedge_key, lambda: send(hedge_key, hedge_params), tokens)
+        create = lambda: hedged(hedge_site, request, hedge=duplicate)
+    return await llm_scheduler.acall(model_key, create, tokens)
+
+def require_text(response: ChatCompletion):
+    """validate= check for replies whose text is used as is: rejects an empty reply."""
+    if not (response.choices[0].message.content or "").strip():
+        raise ValueError("LLM returned an empty reply")
+
+def _cached_reply(key: str, label: str, validate: Optional[Callable[[Any], Any]], load: Callable[[str], Any] = ChatCompletion.model_validate_json) -> Any:
+    cached = llm_cache.get(key, label)
+    if cached is None:
+        return None
+    response = load(cached)
+    if validate is not None:
+        try:
+            validate(response)
+        except Exception:
+            # stored before its caller validated replies; ask again rather than keep serving it
+            llm_cache.delete(key)
+            return None
+    return response
+
+def _store_reply(key: str, response: Any, ttl: float, validate: Optional[Callable[[Any], Any]], dump: Callable[[Any], str] = lambda response: response.model_dump_json()):
+    if validate is not None:
+        # raises for a reply the caller cannot use, which is then never cached
+        validate(response)
+    llm_cache.set(key, dump(response), ttl)
+
+def cached_chat_completion(client, cache: bool = True, ttl: float = None, validate: Callable[[ChatCompletion], Any] = None, **params) -> ChatCompletion:
+    """
+    client.chat.completions.create(**params), served from llm_cache when an
+    identical request was answered before. Pass cache=False to always call the
+    API. `validate(response)` should raise for a reply the caller cannot use;
+    such replies are raised to the caller and never cached.
+    """
+    if not (cache and llm_cache.enabled):
+        response = scheduled_chat_completion(client, **params)
+        if validate is not None:
+            validate(response)
+        return response
+    key, label = _chat_key(params)
+    cached = _cached_reply(key, label, validate)
+    if cached is not None:
+        return cached
+    response = scheduled_chat_completion(client, **params)
+    _store_reply(key, response, ttl, validate)
+    return response
+
+async def cached_async_chat_completion(client, cache: bool = True, ttl: float = None, validate: Callable[[ChatCompletion], Any] = None,
+                                      hedge_site: str = None, hedge_model: str = None, **params) -> ChatCompletion:
+    """
+    Async counterpart of cached_chat_completion for AsyncOpenAI clients. On a
+    cache miss, `hedge_site` / `hedge_model` hedge the provider request (see
+    scheduled_async_chat_completion); the winning reply is cached under this request.
+    """
+    if not (cache and llm_cache.enabled):
+        response = await scheduled_async_chat_completion(client, hedge_site, hedge_model, **params)
+        if validate is not None:
+            validate(response)
+        return response
+    key, label = _chat_key(params)
+    cached = _cached_reply(key, label, validate)
+    if cached is not None:
+        return cached
+    response = await scheduled_async_chat_completion(client, hedge_site, hedge_model, **params)
+    _store_reply(key, response, ttl, validate)
+    return response
+
+def _embed(client, model: str, texts: List[str]) -> List[List[float]]:
+    model_key = f"openai:{model}"
+    tokens = estimate_tokens(texts, 0)
+    response = llm_scheduler.call(model_key, lambda: client.embeddings.create(model=model, input=texts), tokens)
+    llm_scheduler.record_usage(model_key, tokens, _total_tokens(response))
+    return [item.embedding for item in response.data]
+
+def cached_embeddings(client, model: str, texts: List[str], cache: bool = True) -> List[List[float]]:
+    """Embed texts, calling the API only for texts whose embedding is not cached yet."""
+    if not (cache and llm_cache.enabled):
+        return _embed(client, model, texts)
+
+    label = f"openai:{model}"
+    keys = [make_cache_key("openai-embedding", model, text) for text in texts]
+    vectors: List[Optional[List[float]]] = []
+    for key in keys:
+        cached = llm_cache.get(key, label)
+        vectors.append(json.loads(cached) if cached is not None else None)
+
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        embeddings = _embed(client, model, [texts[i] for i in missing])
+        for i, embedding in zip(missing, embeddings):
+            vectors[i] = embedding
+            llm_cache.set(keys[i], json.dumps(embedding))
+    return vectors
+
+class CachedGeminiResponse:
+    """Stand-in for a Gemini response restored from the cache; callers only read .text."""
+
+    def __init__(self, text: str):
+        self.text = text
+
+def scheduled_generate_content(model, contents: Any, hedge_site: str = None, hedge_model=None, **params):
+    """
+    model.generate_content(contents, **params) through llm_scheduler's rate
+    limits and retries. With `hedge_site`, the provider request (once
+    admitted) is hedged under that call site with a duplicate, sent to the
+    GenerativeModel `hedge_model` if given. The duplicate is admitted and
+    charged through llm_scheduler like any other request.
+    """
+    model_key = f"gemini:{getattr(model, 'model_name', '')}"
+    # images are budgeted at the flat token count Gemini bills them at
+    normalized = normalize_content(contents)
+    tokens = estimate_tokens(normalized) + IMAGE_TOKENS * json.dumps(normalized).count('"image"')
+
+    def send(request_key: str, request_model):
+        response = request_model.generate_content(contents, **params)
+        usage = getattr(response, "usage_metadata", None)
+        llm_scheduler.record_usage(request_key, tokens, getattr(usage, "total_token_count", None))
+        return response
+
+    generate = lambda: send(model_key, model)
+    if hedge_site:
+        request = generate
+        hedge_target = hedge_model if hedge_model is not None else model
+        hedge_key = f"gemini:{getattr(hedge_target, 'model_name', '')}"
+        duplicate = lambda: llm_scheduler.call(hedge_key, lambda: send(hedge_key, hedge_target), tokens)
+        generate = lambda: hedged_sync(hedge_site, request, hedge=duplicate)
+    return llm_scheduler.call(model_key, generate, tokens)
+
+def cached_generate_content(model, contents: Any, cache: bool = True, ttl: float = None, validate: Callable[[Any], Any] = None,
+                            hedge_site: str = None, hedge_model=None, **params):
+    """
+    model.generate_content(contents, **params) for a Gemini GenerativeModel,
+    served from llm_cache when identical contents (images included) were
+    answered before. Pass cache=False to always call the API. As with
+    cached_chat_completion, a reply `validate(response)` rejects is raised and
+    never cached. On a cache miss, `hedge_site` / `hedge_model` hedge the
+    provider request (see scheduled_generate_content).
+    """
+    if not (cache and llm_cache.enabled):
+        response = scheduled_generate_content(model, contents, hedge_site, hedge_model, **params)
+        if validate is not None:
+            validate(response)
+        return response
+    model_name = getattr(model, "model_name", "")
+    label = f"gemini:{model_name}"
+    key = make_cache_key("gemini", model_name, contents, params)
+    cached = _cached_reply(key, label, validate, load=CachedGeminiResponse)
+    if cached is not None:
+        return cached
+    response = scheduled_generate_content(model, contents, hedge_site, hedge_model, **params)
+    if response and response.text:
+        _store_reply(key, response, ttl, validate, dump=lambda response: response.text)
+    elif validate is not None:
+        validate(response)
+    return response
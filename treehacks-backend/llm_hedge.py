@@ -0,0 +1,168 @@
+import os
+import time
+import asyncio
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+import numpy as np
+
+# Hedge a request once it has run longer than this percentile of its call site's recent latencies
+HEDGE_PERCENTILE = float(os.environ.get("HEDGE_PERCENTILE", "95"))
+# Deadline used until a call site has HEDGE_MIN_SAMPLES latencies, and the floor under any deadline
+HEDGE_DEFAULT_DEADLINE = float(os.environ.get("HEDGE_DEFAULT_DEADLINE", "8"))
+HEDGE_MIN_DEADLINE = float(os.environ.get("HEDGE_MIN_DEADLINE", "1"))
+HEDGE_MIN_SAMPLES = 20
+HEDGE_ENABLED = os.environ.get("HEDGE_ENABLED", "1") != "0"
+HEDGE_THREADS = int(os.environ.get("HEDGE_THREADS", "8"))
+LATENCY_WINDOW = 500
+
+class CallSiteStats:
+    """Rolling latency window and hedge counters for one call site."""
+
+    def __init__(self):
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def deadline(self, percentile: float) -> float:
+        if len(self.latencies) < HEDGE_MIN_SAMPLES:
+            return HEDGE_DEFAULT_DEADLINE
+        return max(HEDGE_MIN_DEADLINE, float(np.percentile(self.latencies, percentile)))
+
+    def record(self, latency: float, hedged: bool, hedge_won: bool):
+        self.latencies.append(latency)
+        self.calls += 1
+        self.hedges += hedged
+        self.hedge_wins += hedge_won
+
+    def summary(self) -> Dict:
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        return {
+            "calls": self.calls,
+            "p50": round(float(p50), 3),
+            "p95": round(float(p95), 3),
+            "p99": round(float(p99), 3),
+            "hedge_rate": round(self.hedges / self.calls, 3) if self.calls else 0,
+            "hedge_win_rate": round(self.hedge_wins / self.hedges, 3) if self.hedges else 0,
+        }
+
+call_site_stats: Dict[str, CallSiteStats] = {}
+# Threads for sync hedging; an abandoned loser keeps its thread (and slot) until its request returns
+_hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_THREADS)
+_hedge_slots = threading.BoundedSemaphore(HEDGE_THREADS)
+
+def _stats(call_site: str) -> CallSiteStats:
+    return call_site_stats.setdefault(call_site, CallSiteStats())
+
+def _submit(func: Callable[[], Any]) -> Optional[Future]:
+    """Run func on a free hedge thread with the caller's context, or return None when every thread is busy."""
+    slots = _hedge_slots
+    if not slots.acquire(blocking=False):
+        return None
+    context = contextvars.copy_context()
+
+    def run():
+        try:
+            return context.run(func)
+        finally:
+            slots.release()
+
+    return _hedge_executor.submit(run)
+
+def hedge_status() -> Dict[str, Dict]:
+    """p50/p95/p99 latency (seconds), hedge-fire rate and how often the hedge won, per call site."""
+    return {call_site: stats.summary() for call_site, stats in call_site_stats.items()}
+
+async def hedged(call_site: str, primary: Callable[[], Awaitable[Any]], hedge: Optional[Callable[[], Awaitable[Any]]] = None,
+                 percentile: float = HEDGE_PERCENTILE, enabled: bool = True) -> Any:
+    """
+    Await primary(), and if it has not finished by the call site's latency
+    percentile deadline, also start hedge() (a duplicate of primary by
+    default, or e.g. the same request to a fallback model). The first to
+    succeed wins and the other is cancelled. Latencies are recorded per
+    call site whenever the call is eligible for hedging (`enabled`), so
+    calls that could never hedge do not pull its deadline down.
+
+    Wrap only the provider request itself, after any cache lookup and rate
+    limiter admission, so the deadline reflects time spent at the provider.
+    """
+    if not enabled:
+        return await primary()
+    stats = _stats(call_site)
+    start = time.monotonic()
+    if not HEDGE_ENABLED:
+        result = await primary()
+        stats.record(time.monotonic() - start, False, False)
+        return result
+
+    first = asyncio.ensure_future(primary())
+    pending = {first}
+    try:
+        done, pending = await asyncio.wait(pending, timeout=stats.deadline(percentile))
+        if done:
+            stats.record(time.monotonic() - start, False, False)
+            return first.result()
+
+        second = asyncio.ensure_future((hedge or primary)())
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    stats.record(time.monotonic() - start, True, task is second)
+                    return task.result()
+                error = error or task.exception()
+        raise error
+    finally:
+        # also covers the caller being cancelled while waiting
+        for task in pending:
+            task.cancel()
+
+def hedged_sync(call_site: str, primary: Callable[[], Any], hedge: Optional[Callable[[], Any]] = None,
+                percentile: float = HEDGE_PERCENTILE, enabled: bool = True) -> Any:
+    """
+    Blocking counterpart of hedged for sync SDK calls. Both requests run on
+    hedge threads with the caller's context (so LLM priority carries over);
+    a blocking HTTP call cannot be interrupted, so the loser is abandoned
+    rather than cancelled and its result discarded.
+
+    A request is only handed to a free hedge thread, never queued behind
+    abandoned losers: with every thread busy the primary runs unhedged on
+    the calling thread, and a hedge that finds none is not sent.
+    """
+    if not enabled:
+        return primary()
+    stats = _stats(call_site)
+    start = time.monotonic()
+    if not HEDGE_ENABLED:
+        result = primary()
+        stats.record(time.monotonic() - start, False, False)
+        return result
+
+    first = _submit(primary)
+    if first is None:
+        result = primary()
+        stats.record(time.monotonic() - start, False, False)
+        return result
+    done, _ = wait({first}, timeout=stats.deadline(percentile))
+    second = None if done else _submit(hedge or primary)
+    if second is None:
+        result = first.result()
+        stats.record(time.monotonic() - start, False, False)
+        return result
+
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                stats.record(time.monotonic() - start, True, future is second)
+                return future.result()
+            error = error or future.exception()
+    raise error
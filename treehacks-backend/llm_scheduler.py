@@ -0,0 +1,256 @@
+import os
+import json
+import time
+import heapq
+import random
+import asyncio
+import threading
+import itertools
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, List, Tuple
+
+# Priority classes; lower runs first
+INTERACTIVE = 0
+BATCH = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BATCH: "batch"}
+
+# Default per-model budgets, overridable per "provider:model" with LLM_RATE_LIMITS='{"openai:gpt-4o": {"rpm": 500, "tpm": 30000}}'
+LLM_DEFAULT_RPM = int(os.environ.get("LLM_DEFAULT_RPM", "500"))
+LLM_DEFAULT_TPM = int(os.environ.get("LLM_DEFAULT_TPM", "200000"))
+LLM_RATE_LIMITS: Dict[str, Dict[str, int]] = json.loads(os.environ.get("LLM_RATE_LIMITS", "{}"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF_BASE = float(os.environ.get("LLM_BACKOFF_BASE", "1"))
+LLM_BACKOFF_CAP = float(os.environ.get("LLM_BACKOFF_CAP", "30"))
+
+# Completion tokens assumed when a request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 500
+# How often a waiting request re-checks whether it may go
+POLL_INTERVAL = 0.05
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"RateLimitError", "APIConnectionError", "APITimeoutError", "InternalServerError",
+                    "ResourceExhausted", "ServiceUnavailable", "DeadlineExceeded", "TooManyRequests"}
+
+# Priority of LLM calls made from the current task or thread (copied into asyncio.to_thread workers)
+current_priority: ContextVar[int] = ContextVar("llm_priority", default=BATCH)
+
+@contextmanager
+def llm_priority(priority: int):
+    """Run the enclosed LLM calls, including those in tasks and threads started inside it, at `priority`."""
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+def with_llm_priority(priority: int):
+    """Decorator form of llm_priority for coroutine functions."""
+    def decorator(func: Callable[..., Awaitable[Any]]):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with llm_priority(priority):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def estimate_tokens(payload: Any, completion_tokens: int = DEFAULT_COMPLETION_TOKENS) -> int:
+    """Rough token estimate of a request: ~4 characters per prompt token plus the expected completion."""
+    return len(json.dumps(payload, default=str)) // 4 + completion_tokens
+
+def is_retryable(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status in RETRYABLE_STATUS or type(error).__name__ in RETRYABLE_ERRORS
+
+def is_rate_limited(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(error, "code", None)
+    return status == 429 or type(error).__name__ in ("RateLimitError", "ResourceExhausted", "TooManyRequests")
+
+class RateLimit:
+    """Token buckets for one provider:model's requests-per-minute and tokens-per-minute budgets."""
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        elapsed = now - self.updated
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+        self.updated = now
+
+    def try_acquire(self, tokens: int, now: float) -> float:
+        """Take one request and `tokens` tokens if available; otherwise return seconds until they might be."""
+        self.refill(now)
+        # a request larger than the whole budget goes once the bucket is full
+        tokens = min(tokens, self.tpm)
+        if self.requests >= 1 and self.tokens >= tokens:
+            self.requests -= 1
+            self.tokens -= tokens
+            return 0
+        request_wait = (1 - self.requests) * 60 / self.rpm if self.requests < 1 else 0
+        token_wait = (tokens - self.tokens) * 60 / self.tpm if self.tokens < tokens else 0
+        return max(request_wait, token_wait)
+
+class LLMScheduler:
+    """
+    Process-wide gate that every LLM request goes through.
+
+    Each provider:model has requests-per-minute and tokens-per-minute budgets.
+    Waiting requests are admitted strictly by priority class (interactive
+    before batch) and then arrival order, so a large batch run cannot starve
+    live-class calls. Transient failures are retried with full-jitter
+    exponential backoff; a 429 also empties the model's buckets so every
+    other caller backs off with it. Works for both sync callers (worker
+    threads) and async callers.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.limits: Dict[str, RateLimit] = {}
+        self.waiting: Dict[str, List[Tuple[int, int]]] = {}
+        self.sequence = itertools.count()
+        self.stats: Dict[str, Dict[str, Any]] = {}
+
+    def call(self, model_key: str, func: Callable[[], Any], tokens: int) -> Any:
+        """
+        Run the blocking request `func` under `model_key`'s budget, retrying
+        transient failures. Waiting here blocks the calling thread, so this
+        refuses to run on an event loop's thread, where it would also stall the
+        async requests queued ahead of it; call it through run_blocking there.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        else:
+            raise RuntimeError(f"Blocking LLM request to {model_key} made on the event loop; run it with run_blocking or use acall")
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            ticket = self._enqueue(model_key)
+            try:
+                while True:
+                    wait = self._try_admit(model_key, ticket, tokens)
+                    if wait == 0:
+                        break
+                    time.sleep(min(wait, POLL_INTERVAL))
+            except BaseException:
+                self._dequeue(model_key, ticket)
+                raise
+            try:
+                return func()
+            except Exception as e:
+                delay = self._after_failure(model_key, e, attempt)
+            time.sleep(delay)
+
+    async def acall(self, model_key: str, func: Callable[[], Awaitable[Any]], tokens: int) -> Any:
+        """Async counterpart of call for coroutine-returning requests."""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            ticket = self._enqueue(model_key)
+            try:
+                while True:
+                    wait = self._try_admit(model_key, ticket, tokens)
+                    if wait == 0:
+                        break
+                    await asyncio.sleep(min(wait, POLL_INTERVAL))
+            except BaseException:
+                self._dequeue(model_key, ticket)
+                raise
+            try:
+                return await func()
+            except Exception as e:
+                delay = self._after_failure(model_key, e, attempt)
+            await asyncio.sleep(delay)
+
+    def record_usage(self, model_key: str, estimated: int, actual: int):
+        """Correct the token bucket once a response reports how many tokens it really used."""
+        if actual is None:
+            return
+        with self.lock:
+            self._limit(model_key).tokens -= actual - estimated
+
+    def status(self) -> Dict:
+        """Queue depth per priority and admission wait times, per provider:model."""
+        with self.lock:
+            status = {}
+            for model_key, stats in self.stats.items():
+                depth = {name: 0 for name in PRIORITY_NAMES.values()}
+                for priority, _ in self.waiting.get(model_key, []):
+                    depth[PRIORITY_NAMES[priority]] += 1
+                status[model_key] = {
+                    "queued": depth,
+                    "requests": stats["requests"],
+                    "retries": stats["retries"],
+                    "rate_limited": stats["rate_limited"],
+                    "wait_seconds": {
+                        name: {
+                            "avg": round(wait["total"] / wait["count"], 3) if wait["count"] else 0,
+                            "max": round(wait["max"], 3),
+                        }
+                        for name, wait in stats["wait"].items()
+                    },
+                }
+            return status
+
+    def _limit(self, model_key: str) -> RateLimit:
+        if model_key not in self.limits:
+            provider = model_key.split(":")[0]
+            config = LLM_RATE_LIMITS.get(model_key) or LLM_RATE_LIMITS.get(provider) or {}
+            self.limits[model_key] = RateLimit(config.get("rpm", LLM_DEFAULT_RPM), config.get("tpm", LLM_DEFAULT_TPM))
+            self.stats[model_key] = {
+                "requests": 0, "retries": 0, "rate_limited": 0,
+                "wait": {name: {"count": 0, "total": 0.0, "max": 0.0} for name in PRIORITY_NAMES.values()},
+            }
+        return self.limits[model_key]
+
+    def _enqueue(self, model_key: str) -> Tuple[int, int, float]:
+        with self.lock:
+            self._limit(model_key)
+            entry = (current_priority.get(), next(self.sequence))
+            heapq.heappush(self.waiting.setdefault(model_key, []), entry)
+        return entry + (time.monotonic(),)
+
+    def _dequeue(self, model_key: str, ticket: Tuple[int, int, float]):
+        with self.lock:
+            waiting = self.waiting[model_key]
+            waiting.remove(ticket[:2])
+            heapq.heapify(waiting)
+
+    def _try_admit(self, model_key: str, ticket: Tuple[int, int, float], tokens: int) -> float:
+        # only the highest-priority, longest-waiting request for a model may take its budget
+        with self.lock:
+            waiting = self.waiting[model_key]
+            if waiting[0] != ticket[:2]:
+                return POLL_INTERVAL
+            now = time.monotonic()
+            wait = self._limit(model_key).try_acquire(tokens, now)
+            if wait == 0:
+                heapq.heappop(waiting)
+                stats = self.stats[model_key]
+                stats["requests"] += 1
+                waited = stats["wait"][PRIORITY_NAMES[ticket[0]]]
+                waited["count"] += 1
+                waited["total"] += now - ticket[2]
+                waited["max"] = max(waited["max"], now - ticket[2])
+            return wait
+
+    def _after_failure(self, model_key: str, error: Exception, attempt: int) -> float:
+        """Re-raise non-retryable errors or the last attempt's error; otherwise return the backoff delay."""
+        if attempt >= LLM_MAX_RETRIES or not is_retryable(error):
+            raise error
+        with self.lock:
+            self.stats[model_key]["retries"] += 1
+            if is_rate_limited(error):
+                self.stats[model_key]["rate_limited"] += 1
+                limit = self._limit(model_key)
+                limit.refill(time.monotonic())
+                limit.requests = 0
+                limit.tokens = 0
+        delay = random.uniform(0, min(LLM_BACKOFF_CAP, LLM_BACKOFF_BASE * 2 ** attempt))
+        print(f"LLM request to {model_key} failed ({type(error).__name__}), retrying in {delay:.1f}s")
+        return delay
+
+llm_scheduler = LLMScheduler()
@@ -3,6 +3,8 @@ import os
 from typing import List
 import json
 import traceback
+from llm_cache import cached_chat_completion
+from prompt_budget import PromptSection, fit_prompt
 
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -24,13 +26,6 @@ def extract_topics_from_syllabus(syllabus_text: str) -> List[str]:
     if not syllabus_text or not syllabus_text.strip():
         raise ValueError("Syllabus text cannot be empty")
         
-    # Truncate text to approximately 8k tokens (about 32k characters)
-    # This ensures we stay within GPT-3.5's context window
-    MAX_CHARS = 32000
-    if len(syllabus_text) > MAX_CHARS:
-        print(f"Truncating syllabus text from {len(syllabus_text)} to {MAX_CHARS} characters")
-        syllabus_text = syllabus_text[:MAX_CHARS]
-        
     system_prompt = """
     You are an expert at analyzing course syllabi and identifying the core concepts and recurring themes that appear throughout the course.
     Identify fundamental topics and concepts that:
@@ -42,11 +37,17 @@ def extract_topics_from_syllabus(syllabus_text: str) -> List[str]:
     Make topics specific enough to be meaningful but general enough to span multiple lectures.
     Each topic should be 2-5 words long and capture a distinct concept.
     """
+
+    # Keep the prompt within the syllabus_topics token budget, trimming the end of the syllabus if needed
+    syllabus_text = fit_prompt("syllabus_topics", [
+        PromptSection("instructions", system_prompt, trim=False),
+        PromptSection("syllabus", syllabus_text),
+    ], model="gpt-4o-mini")["syllabus"]
     
     try:
         print(f"Processing syllabus text of length: {len(syllabus_text)}")
         
-        response = client.chat.completions.create(
+        response = cached_chat_completion(client,
             model="gpt-4o-mini",
             messages=[
                 {"role": "system", "content": system_prompt},
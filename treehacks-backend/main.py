@@ -8,12 +8,14 @@ import json
 from models import *
 from drive_utils import download_lecture_and_slides
 import os
+import uuid
+from typing import List
 from supabase import create_client, Client
 from video_utils import extract_audio
 from speech_to_text import transcribe_with_timestamps
 from slide_utils import map_slides_to_video
 from question_gen import generate_questions, save_questions
-from topic_utils import get_all_topics, get_topic_by_id
+from topic_utils import get_all_topics, get_topic_by_id, get_categorization_stats
 from services.homeworkService import publish_question_extracted_insight, publish_homework_summary
 from llm_utils import extract_topics_from_syllabus
 import requests
@@ -24,12 +26,32 @@ from fastapi import File, UploadFile
 from services.questionParsingService import parse_and_store_questions
 from services.sessionService import publish_session_question_extracted_insight, publish_session_summary
 from services.sessionGradingService import grade_session
+from services.assignmentGradingService import grade_submission_archive, grade_submissions
+from services.batchGradingService import grade_submission_archive_batch
+from llm_batch import BATCH_POLL_INTERVAL
+from services.submissionParsingService import iter_submission_files, pack_submission_archive
+from services.gradingQueueService import grading_queue
+from services.questionGradingService import get_cascade_stats
+from services.jobService import Job, JobDeferred, job_manager
+from services.counterService import assignment_counter, session_counter
+from async_utils import SingleFlight, run_blocking
+from llm_cache import llm_cache
+from llm_scheduler import INTERACTIVE, llm_scheduler, with_llm_priority
+from llm_hedge import hedge_status
+from prompt_budget import get_budget_stats
+from slide_cache import slide_cache
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
+# Where uploaded submission batches wait for their background grading job
+SUBMISSIONS_UPLOAD_DIR = os.environ.get("SUBMISSIONS_UPLOAD_DIR", "data/submissions")
+
+# Concurrent identical pipeline runs (double-clicks, two TAs) share one execution
+pipeline_flights = SingleFlight()
+
 app = FastAPI(
     title="Treehacks API",
     description="An API to interact with Treehacks",
@@ -45,6 +67,20 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+@app.on_event("startup")
+async def start_background_workers():
+    grading_queue.start()
+    job_manager.start()
+    assignment_counter.start()
+    session_counter.start()
+
+@app.on_event("shutdown")
+async def stop_background_workers():
+    await grading_queue.stop()
+    await job_manager.stop()
+    await assignment_counter.stop()
+    await session_counter.stop()
+
 def generate_short_id(length: int = 5) -> str:
     # Use only uppercase letters and numbers, excluding confusing characters
     characters = string.ascii_uppercase.replace('O', '') + string.digits.replace('0', '').replace('1', '')
@@ -190,6 +226,10 @@ async def post_response(response_data: ResponseCreate):
             results.append(result.data[0])
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+
+    # start grading in the background while the session is still live
+    for question_id in {response.question_id for response in response_data.responses}:
+        await grading_queue.submit(question_id)
     
     return results
 
@@ -282,7 +322,7 @@ async def transcribe_endpoint(request: TranscribeRequest):
         video_path = f"data/{request.video_name}"
         
         # Transcribe with timestamps
-        result = transcribe_with_timestamps(video_path, test_mode=request.test_mode)
+        result = await run_blocking(transcribe_with_timestamps, video_path, test_mode=request.test_mode)
         
         if not result:
             raise HTTPException(
@@ -310,33 +350,46 @@ async def map_slides(video_path: str = Form(...), pdf_path: str = Form(...)):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
+# live-class path: its LLM calls go ahead of background work
+@with_llm_priority(INTERACTIVE)
+async def generate_questions_pipeline(lecture_id: str, session_id: str, job: Job = None):
+    # Verify lecture exists (without fetching its transcript and slide mapping blobs)
+    lecture_response = await run_blocking(supabase.table('lectures').select('id').eq('id', lecture_id).execute)
+    if not lecture_response or not lecture_response.data:
+        raise HTTPException(status_code=404, detail=f"Lecture {lecture_id} not found")
+        
+    # Verify session exists
+    session_response = await run_blocking(supabase.table('sessions').select('*').eq('id', session_id).execute)
+    if not session_response or not session_response.data:
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
+    session = session_response.data[0]
+        
+    # Generate and save questions
+    if job:
+        job.progress("generate", 0, 1)
+    timestamp = float(session['timestamp']) if 'timestamp' in session else 0.0
+    questions = await run_blocking(generate_questions, lecture_id, session_id, timestamp)
+    if job:
+        job.progress("generate", 1, 1)
+    
+    return {
+        "success": True,
+        "message": f"Generated {len(questions)} questions",
+        "questions": questions
+    }
+
 @app.post("/api/generate-questions")
-async def generate_questions_endpoint(lecture_id: str, session_id: str):
+async def generate_questions_endpoint(lecture_id: str, session_id: str, background: bool = False):
     """
-    Generate questions based on lecture content up to timestamp
+    Generate questions based on lecture content up to timestamp.
+    With background=true, returns a job id to poll at /api/jobs/{job_id} instead.
     """
     try:
-        # Verify lecture exists
-        lecture_response = supabase.table('lectures').select('*').eq('id', lecture_id).execute()
-        if not lecture_response or not lecture_response.data:
-            raise HTTPException(status_code=404, detail=f"Lecture {lecture_id} not found")
-        lecture = lecture_response.data[0]
-            
-        # Verify session exists
-        session_response = supabase.table('sessions').select('*').eq('id', session_id).execute()
-        if not session_response or not session_response.data:
-            raise HTTPException(status_code=404, detail=f"Session {session_id} not found")
-        session = session_response.data[0]
-            
-        # Generate and save questions
-        timestamp = float(session['timestamp']) if 'timestamp' in session else 0.0
-        questions = generate_questions(lecture_id, session_id, timestamp)
-        
-        return {
-            "success": True,
-            "message": f"Generated {len(questions)} questions",
-            "questions": questions
-        }
+        if background:
+            job_id = job_manager.submit("generate-questions", {"lecture_id": lecture_id, "session_id": session_id})
+            return {"job_id": job_id, "status": "queued"}
+
+        return await pipeline_flights.run(("generate-questions", lecture_id, session_id), generate_questions_pipeline, lecture_id, session_id)
         
     except Exception as e:
         raise HTTPException(
@@ -410,17 +463,32 @@ async def get_question_insights(assignment_id: int):
         print(f"Error in get_question_insights: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def run_homework_nlp_pipeline(assignment_id: int, job: Job = None, force: bool = False):
+    if job:
+        job.progress("insights", 0, 1)
+    insight_result = await publish_question_extracted_insight(assignment_id, force=force)
+    if job:
+        job.progress("insights", 1, 1)
+        job.progress("summary", 0, 1)
+    summary_result = await run_blocking(publish_homework_summary, assignment_id, force)
+    if job:
+        job.progress("summary", 1, 1)
+    
+    return {
+        "message": "NLP processing completed successfully",
+        "insight_result": insight_result,
+        "summary_result": summary_result
+    }
+
 @app.post("/assignment/{assignment_id}/run-nlp")
-async def run_homework_nlp(assignment_id: int):
+async def run_homework_nlp(assignment_id: int, background: bool = False, force: bool = False):
+    # force=true re-asks the LLM for misconception names and the summary instead of reusing cached replies
     try:
-        insight_result = publish_question_extracted_insight(assignment_id)
-        summary_result = publish_homework_summary(assignment_id)
-        
-        return {
-            "message": "NLP processing completed successfully",
-            "insight_result": insight_result,
-            "summary_result": summary_result
-        }
+        if background:
+            job_id = job_manager.submit("homework-nlp", {"assignment_id": assignment_id, "force": force})
+            return {"job_id": job_id, "status": "queued"}
+
+        return await pipeline_flights.run(("homework-nlp", assignment_id), run_homework_nlp_pipeline, assignment_id, force=force)
     except Exception as e:
         print(f"Error in run_homework_nlp: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -442,6 +510,55 @@ async def upload_assignment_pdf(assignment_id: int, file: UploadFile = File(...)
         print(f"Error processing PDF: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/assignment/{assignment_id}/submissions")
+async def upload_assignment_submissions(assignment_id: int, files: List[UploadFile] = File(...), background: bool = False, batch: bool = False):
+    """
+    Grade a batch of student submissions: one or more zips of PDFs and/or
+    individual PDFs. Returns per-file failures alongside the totals; with
+    background=true, returns a job id whose progress reports files parsed and
+    grading batches done. batch=true grades through the provider's batch API,
+    which is cheaper but can take hours, so it always runs in the background.
+    """
+    try:
+        for file in files:
+            if not file.filename.lower().endswith(('.pdf', '.zip')):
+                raise HTTPException(status_code=400, detail=f"Only PDF and zip files are supported: {file.filename}")
+        uploads = [(file.filename, file.file) for file in files]
+
+        if background or batch:
+            archive_path = os.path.join(SUBMISSIONS_UPLOAD_DIR, f"{uuid.uuid4().hex}.zip")
+            await run_blocking(pack_submission_archive, uploads, archive_path)
+            job_id = job_manager.submit("homework-grading-batch" if batch else "homework-grading", {"assignment_id": assignment_id, "archive_path": archive_path})
+            return {"job_id": job_id, "status": "queued"}
+
+        return await grade_submissions(assignment_id, iter_submission_files(uploads))
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"Error grading submissions: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def grade_uploaded_archive(assignment_id: int, archive_path: str, job: Job = None):
+    try:
+        return await grade_submission_archive(assignment_id, archive_path, on_progress=job.progress if job else None)
+    finally:
+        os.remove(archive_path)
+
+async def grade_uploaded_archive_batch(assignment_id: int, archive_path: str, job: Job):
+    # runs in steps: between them the job gives its worker back while the provider works through the batch
+    try:
+        result = await grade_submission_archive_batch(assignment_id, archive_path, job.params.get("checkpoint"),
+                                                      lambda checkpoint: job.save(checkpoint=checkpoint), on_progress=job.progress)
+    except Exception:
+        if os.path.exists(archive_path):
+            os.remove(archive_path)
+        raise
+    if result is None:
+        raise JobDeferred(BATCH_POLL_INTERVAL)
+    if os.path.exists(archive_path):
+        os.remove(archive_path)
+    return result
+
 @app.get("/api/topics")
 async def get_topics(class_id: str):
     try:
@@ -500,7 +617,7 @@ async def generate_topic(syllabus: Syllabus):
         text_content = extract_text_from_pdf(pdf_content)
 
         # Extract topics using OpenAI
-        topics = extract_topics_from_syllabus(text_content)
+        topics = await run_blocking(extract_topics_from_syllabus, text_content)
         
         # Insert topics into the database
         for topic in topics:
@@ -657,24 +774,71 @@ async def get_assignment_question_topics(question_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# instructors wait on this at the end of class, so it is scheduled ahead of homework runs
+@with_llm_priority(INTERACTIVE)
+async def run_session_nlp_pipeline(short_id: str, job: Job = None, force: bool = False):
+    on_progress = (lambda done, total: job.progress("grading", done, total)) if job else None
+    graded_count = await grade_session(short_id, on_progress=on_progress)
+    if job:
+        job.progress("insights", 0, 1)
+    insight_result = await publish_session_question_extracted_insight(short_id, force=force)
+    if job:
+        job.progress("insights", 1, 1)
+        job.progress("summary", 0, 1)
+    summary_result = await run_blocking(publish_session_summary, short_id, force)
+    if job:
+        job.progress("summary", 1, 1)
+    
+    return {
+        "message": "NLP processing completed successfully",
+        "graded_responses": graded_count,
+        "insight_result": insight_result,
+        "summary_result": summary_result
+    }
+
 @app.post("/api/sessions/{short_id}/run-nlp")
-async def run_session_grading_nlp(short_id: str):
+async def run_session_grading_nlp(short_id: str, background: bool = False, force: bool = False):
+    # force=true re-extracts question insights and regenerates the summary even if their inputs are unchanged
     short_id = short_id.upper()
     
     try:
-        await grade_session(short_id)
-        insight_result = publish_session_question_extracted_insight(short_id)
-        summary_result = publish_session_summary(short_id)
-        
-        return {
-            "message": "NLP processing completed successfully",
-            "insight_result": insight_result,
-            "summary_result": summary_result
-        }
+        if background:
+            job_id = job_manager.submit("session-nlp", {"short_id": short_id, "force": force})
+            return {"job_id": job_id, "status": "queued"}
+
+        return await pipeline_flights.run(("session-nlp", short_id), run_session_nlp_pipeline, short_id, force=force)
     except Exception as e:
         print(f"Error in run_session_nlp: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# background jobs share the same single-flight keys as the synchronous endpoints; the NLP pipelines
+# rewrite the same rows whether forced or not, so a forced run shares one in flight or just finished
+job_manager.register("session-nlp", lambda params, job: pipeline_flights.run(
+    ("session-nlp", params["short_id"]), run_session_nlp_pipeline, params["short_id"], job, params.get("force", False)))
+job_manager.register("homework-nlp", lambda params, job: pipeline_flights.run(
+    ("homework-nlp", params["assignment_id"]), run_homework_nlp_pipeline, params["assignment_id"], job, params.get("force", False)))
+# online grading writes insights and submission counts as it finishes, so an interrupted run is not repeated
+job_manager.register("homework-grading", lambda params, job: grade_uploaded_archive(
+    params["assignment_id"], params["archive_path"], job), resumable=False)
+job_manager.register("homework-grading-batch", lambda params, job: grade_uploaded_archive_batch(
+    params["assignment_id"], params["archive_path"], job))
+# question generation inserts each question as it goes, so an interrupted run is not repeated either
+job_manager.register("generate-questions", lambda params, job: pipeline_flights.run(
+    ("generate-questions", params["lecture_id"], params["session_id"]), generate_questions_pipeline, params["lecture_id"], params["session_id"], job), resumable=False)
+
+@app.get("/api/jobs")
+async def list_jobs(limit: int = 50):
+    """List recent background jobs, newest first"""
+    return await run_blocking(job_manager.list_jobs, limit)
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Get a background job's status, per-stage progress and result"""
+    job = await run_blocking(job_manager.get, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
 @app.get("/api/sessions/{session_id}/insight")
 async def get_session_insight(session_id: str):
     try:
@@ -737,6 +901,45 @@ async def get_session_question_insights(question_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/grading/status")
+async def get_grading_status():
+    """Get the background grading queue's depth, the cascaded grader's per-stage hit rates and unflushed submission counts"""
+    return {
+        **grading_queue.status(),
+        "cascade": get_cascade_stats(),
+        "pending_counts": {"assignment": assignment_counter.pending(), "session": session_counter.pending()}
+    }
+
+@app.get("/api/llm/cache")
+async def get_llm_cache_stats():
+    """Get the shared LLM response cache's size and per-model hit/miss counts"""
+    return await run_blocking(llm_cache.stats)
+
+@app.get("/api/llm/scheduler")
+async def get_llm_scheduler_status():
+    """Get the LLM scheduler's queue depth, admission wait times and retries per provider:model"""
+    return llm_scheduler.status()
+
+@app.get("/api/llm/latency")
+async def get_llm_latency():
+    """Get p50/p95/p99 latency and hedge-fire rate per hedged call site"""
+    return hedge_status()
+
+@app.get("/api/llm/budget")
+async def get_llm_prompt_budget():
+    """Get prompt sizes, token budgets and overrun counts per prompt call site"""
+    return get_budget_stats()
+
+@app.get("/api/slides/cache")
+async def get_slide_cache_stats():
+    """Get the slide cache's disk usage and page hit / render counts"""
+    return await run_blocking(slide_cache.stats)
+
+@app.get("/api/topics/categorization")
+async def get_topic_categorization_stats():
+    """Get how many questions were tagged by the local classifier, by the LLM, by nearest topic, or left untagged"""
+    return get_categorization_stats()
+
 @app.get("/api/session_questions/{question_id}/response_count")
 async def get_question_response_count(question_id: str):
     """Get the total number of responses for a specific question"""
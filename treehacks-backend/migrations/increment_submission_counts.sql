@@ -0,0 +1,18 @@
+-- Applies a batch of submission count deltas as atomic increments; called by
+-- services/counterService.py. Install with the Supabase SQL editor or psql.
+--
+--   deltas: [{"id": "<question id>", "total": <int>, "correct": <int>}, ...]
+
+create or replace function increment_submission_counts(table_name text, deltas jsonb)
+returns void language plpgsql as $$
+declare d jsonb;
+begin
+  if table_name not in ('assignment_question', 'session_questions') then
+    raise exception 'increment_submission_counts: unsupported table %', table_name;
+  end if;
+  for d in select * from jsonb_array_elements(deltas) loop
+    execute format('update %I set total_submission = coalesce(total_submission, 0) + $1,
+                    correct_submission = coalesce(correct_submission, 0) + $2 where id::text = $3', table_name)
+    using (d->>'total')::int, (d->>'correct')::int, d->>'id';
+  end loop;
+end $$;
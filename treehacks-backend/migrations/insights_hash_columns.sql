@@ -0,0 +1,6 @@
+-- Hash of the insights each summary was generated from, so an unchanged
+-- summary is not regenerated (services/homeworkService.py, services/sessionService.py).
+-- Install with the Supabase SQL editor or psql; safe to run more than once.
+
+alter table assignment_insight add column if not exists insights_hash text;
+alter table session_insight add column if not exists insights_hash text;
@@ -0,0 +1,5 @@
+-- How many identical student answers a session answer insight stands for, so
+-- duplicate answers are diagnosed once but still counted (services/sessionGradingService.py).
+-- Install with the Supabase SQL editor or psql; safe to run more than once.
+
+alter table session_answer_insight add column if not exists answer_count integer not null default 1;
@@ -0,0 +1,20 @@
+-- Columns for incremental session grading (services/sessionGradingService.py)
+-- and for skipping unchanged question insights (services/sessionService.py).
+-- Install with the Supabase SQL editor or psql; safe to run more than once.
+
+-- each response keeps its grade (0 / 1) and the insight describing it once graded
+alter table session_responses add column if not exists grade integer;
+
+-- insight_id takes the type of session_answer_insight.id, whatever the project created it as
+do $$
+declare id_type text;
+begin
+  select format_type(atttypid, atttypmod) into id_type
+  from pg_attribute where attrelid = 'session_answer_insight'::regclass and attname = 'id';
+  execute format('alter table session_responses add column if not exists insight_id %s references session_answer_insight (id) on delete set null', id_type);
+end $$;
+
+create index if not exists session_responses_question_id on session_responses (question_id);
+
+-- fingerprint of the answer insights a question's extracted insights were built from
+alter table session_questions add column if not exists insights_fingerprint text;
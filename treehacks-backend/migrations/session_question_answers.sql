@@ -0,0 +1,6 @@
+-- Generated questions store their answer and explanation so grading can check
+-- answers against them before calling an LLM (question_gen.py).
+-- Install with the Supabase SQL editor or psql; safe to run more than once.
+
+alter table session_questions add column if not exists answer text;
+alter table session_questions add column if not exists explanation text;
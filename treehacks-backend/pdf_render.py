@@ -0,0 +1,39 @@
+import os
+import io
+from typing import List, Optional, Tuple, Union
+import PIL.Image
+from PyPDF2 import PdfReader
+from pdf2image import convert_from_bytes
+
+# Resolution pages are rasterized at, and an optional cap on their size ("1280" for width, "1280x720" for width x height)
+SLIDE_RENDER_DPI = int(os.environ.get("SLIDE_RENDER_DPI", "200"))
+SLIDE_RENDER_SIZE = os.environ.get("SLIDE_RENDER_SIZE")
+
+def parse_render_size(size: Optional[str]) -> Union[None, int, Tuple[int, int]]:
+    """pdf2image's size argument from "W" or "WxH"; None keeps the size implied by the DPI."""
+    if not size:
+        return None
+    if "x" in size:
+        width, height = size.lower().split("x")
+        return (int(width), int(height))
+    return int(size)
+
+def count_pdf_pages(pdf_bytes: bytes) -> int:
+    return len(PdfReader(io.BytesIO(pdf_bytes)).pages)
+
+def render_pdf_pages(pdf_bytes: bytes, first_page: int, last_page: Optional[int] = None, dpi: int = SLIDE_RENDER_DPI,
+                     size: Union[None, int, Tuple[int, int]] = parse_render_size(SLIDE_RENDER_SIZE)) -> List[PIL.Image.Image]:
+    """
+    Rasterize pages `first_page`..`last_page` (1-based, inclusive; just
+    `first_page` by default) of a PDF held in memory.
+
+    Only the requested pages are rendered, so memory grows with the range and
+    not with the deck. Images come back from poppler's output stream; the
+    only file involved is pdf2image's private, uniquely named copy of the
+    input, so concurrent renders never share a path.
+    """
+    last_page = last_page or first_page
+    images = convert_from_bytes(pdf_bytes, dpi=dpi, first_page=first_page, last_page=last_page, size=size)
+    if not images:
+        raise ValueError(f"No images were rendered for pages {first_page}-{last_page}")
+    return images
@@ -0,0 +1,181 @@
+import os
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+try:
+    import tiktoken
+except ImportError:
+    # fall back to the ~4 characters per token estimate
+    tiktoken = None
+
+# Input-token budget per call site; overridable with PROMPT_BUDGETS='{"question_gen": 16000}'
+DEFAULT_PROMPT_BUDGETS: Dict[str, int] = {
+    "syllabus_topics": 8000,
+    "question_gen": 24000,
+    "split_into_questions": 12000,
+    "split_into_answers": 12000,
+    "misconception_names": 6000,
+    "homework_summary": 8000,
+    "session_summary": 8000,
+}
+PROMPT_BUDGETS: Dict[str, int] = {**DEFAULT_PROMPT_BUDGETS, **json.loads(os.environ.get("PROMPT_BUDGETS", "{}"))}
+# Budget for call sites without an entry above
+DEFAULT_PROMPT_BUDGET = int(os.environ.get("DEFAULT_PROMPT_BUDGET", "16000"))
+
+CHARS_PER_TOKEN = 4
+# Gemini bills an image at a flat token count
+IMAGE_TOKENS = 258
+TRUNCATION_MARKER = "\n[...]\n"
+
+_encodings: Dict[str, object] = {}
+
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    if model not in _encodings:
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            # not an OpenAI model (e.g. Gemini); the estimate is close enough for budgeting
+            _encodings[model] = None
+    return _encodings[model]
+
+def count_tokens(text: str, model: str = "gpt-4o") -> int:
+    """Tokens `text` takes up for `model`, exact for OpenAI models when tiktoken is installed."""
+    if not text:
+        return 0
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o", keep: str = "head") -> str:
+    """
+    Cut `text` to at most `max_tokens` tokens, keeping its start ("head") or
+    its end ("tail"). The cut snaps to a line boundary when that keeps at
+    least half the text, so line-per-item text loses whole items.
+    """
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+    encoding = _encoding(model)
+    if encoding is None:
+        chars = max_tokens * CHARS_PER_TOKEN
+        kept = text[:chars] if keep == "head" else text[-chars:]
+    else:
+        tokens = encoding.encode(text, disallowed_special=())
+        kept = encoding.decode(tokens[:max_tokens] if keep == "head" else tokens[-max_tokens:])
+
+    if keep == "head":
+        boundary = kept.rfind("\n")
+        return kept[:boundary] if boundary >= len(kept) // 2 else kept
+    boundary = kept.find("\n")
+    return kept[boundary + 1:] if 0 <= boundary <= len(kept) // 2 else kept
+
+@dataclass
+class PromptSection:
+    """
+    One part of a prompt. When the prompt is over budget, sections with the
+    lowest `priority` are trimmed first, never below `min_tokens`; `keep`
+    says which end of the text survives trimming. Sections with trim=False
+    (e.g. instructions) count against the budget but are never cut.
+    """
+    name: str
+    text: str
+    priority: int = 0
+    keep: str = "head"
+    min_tokens: int = 0
+    trim: bool = True
+
+class BudgetStats:
+    """Per call site prompt sizes and how often, and by how much, prompts ran over budget."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sites: Dict[str, Dict] = {}
+
+    def record(self, call_site: str, budget: int, tokens: int, trimmed: Dict[str, int], rejected: bool = False):
+        with self.lock:
+            site = self.sites.setdefault(call_site, {
+                "calls": 0, "overruns": 0, "rejected": 0, "budget": budget, "max_tokens": 0, "trimmed_tokens": 0, "trimmed_sections": {},
+            })
+            site["calls"] += 1
+            site["budget"] = budget
+            site["max_tokens"] = max(site["max_tokens"], tokens)
+            if rejected:
+                site["overruns"] += 1
+                site["rejected"] += 1
+            if trimmed:
+                site["overruns"] += 1
+                site["trimmed_tokens"] += sum(trimmed.values())
+                for name, count in trimmed.items():
+                    site["trimmed_sections"][name] = site["trimmed_sections"].get(name, 0) + count
+
+    def summary(self) -> Dict[str, Dict]:
+        with self.lock:
+            return {
+                call_site: {**site, "overrun_rate": round(site["overruns"] / site["calls"], 3) if site["calls"] else 0}
+                for call_site, site in self.sites.items()
+            }
+
+budget_stats = BudgetStats()
+
+def get_budget_stats() -> Dict[str, Dict]:
+    return budget_stats.summary()
+
+class PromptTooLarge(ValueError):
+    """A prompt that may not be trimmed is over its call site's token budget."""
+
+def check_prompt(call_site: str, sections: List[PromptSection], model: str = "gpt-4o", budget: Optional[int] = None,
+                 reserved_tokens: int = 0):
+    """
+    Budget check for prompts whose content must not be lost, such as
+    documents split into questions or answers, where a cut would silently
+    drop the trailing items. Records the prompt size in budget_stats and
+    raises PromptTooLarge instead of trimming when it is over budget.
+    """
+    budget = (budget or PROMPT_BUDGETS.get(call_site, DEFAULT_PROMPT_BUDGET)) - reserved_tokens
+    tokens = sum(count_tokens(section.text, model) for section in sections)
+    budget_stats.record(call_site, budget, tokens, {}, rejected=tokens > budget)
+    if tokens > budget:
+        raise PromptTooLarge(f"{call_site} prompt is {tokens} tokens, over its {budget} token budget")
+
+def fit_prompt(call_site: str, sections: List[PromptSection], model: str = "gpt-4o", budget: Optional[int] = None,
+               reserved_tokens: int = 0) -> Dict[str, str]:
+    """
+    Fit a prompt's sections into the call site's input-token budget (less
+    `reserved_tokens` for parts counted elsewhere, such as images).
+
+    If the sections are over budget, they are trimmed lowest priority first,
+    each only as far as needed. Returns the (possibly trimmed) text per
+    section name and records the prompt size and any overrun in budget_stats.
+    """
+    budget = (budget or PROMPT_BUDGETS.get(call_site, DEFAULT_PROMPT_BUDGET)) - reserved_tokens
+    sizes = {section.name: count_tokens(section.text, model) for section in sections}
+    texts = {section.name: section.text for section in sections}
+    over = sum(sizes.values()) - budget
+    trimmed: Dict[str, int] = {}
+
+    for section in sorted(sections, key=lambda section: section.priority):
+        if over <= 0:
+            break
+        if not section.trim:
+            continue
+        target = max(section.min_tokens, sizes[section.name] - over)
+        if target >= sizes[section.name]:
+            continue
+        text = truncate_to_tokens(section.text, max(0, target - count_tokens(TRUNCATION_MARKER, model)), model, section.keep)
+        text = (text + TRUNCATION_MARKER if section.keep == "head" else TRUNCATION_MARKER + text) if text else ""
+        size = count_tokens(text, model)
+        texts[section.name] = text
+        trimmed[section.name] = sizes[section.name] - size
+        over -= sizes[section.name] - size
+        sizes[section.name] = size
+
+    if trimmed:
+        print(f"{call_site} prompt over its {budget} token budget, trimmed {trimmed}")
+    budget_stats.record(call_site, budget, sum(sizes.values()), trimmed)
+    return texts
@@ -2,28 +2,33 @@ import os
 import json
 from typing import List, Dict
 import google.generativeai as genai
+from llm_cache import cached_generate_content
+from prompt_budget import IMAGE_TOKENS, PromptSection, fit_prompt
 from datetime import datetime
 import PIL.Image
-from pdf2image import convert_from_path
 import base64
 import io
-import requests
 from supabase import create_client, Client
-from topic_utils import get_topics_for_question_generation, categorize_question
+from topic_utils import categorize_questions
+from slide_cache import slide_cache
+from timeline_index import LectureTimeline, lecture_timelines
+
+# Gemini model a slow question generation request is duplicated to; unset duplicates to the same model
+QUESTION_GEN_FALLBACK_MODEL = os.environ.get("QUESTION_GEN_FALLBACK_MODEL")
 
 # Initialize Supabase client
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
-def setup_gemini():
+def setup_gemini(model_name: str = 'gemini-2.0-flash'):
     """Initialize Gemini API with key"""
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("API key not found")
     
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return genai.GenerativeModel(model_name)
 
 def encode_pil_image(pil_image):
     """Encodes a PIL Image as a Base64 string."""
@@ -34,39 +39,12 @@ def encode_pil_image(pil_image):
     
     return base64.b64encode(img_byte_arr).decode('utf-8')
 
-def convert_drive_link_to_direct_download(drive_link: str) -> str:
-    """Convert a Google Drive sharing link to a direct download link"""
-    # Extract file ID from the Google Drive link
-    file_id = drive_link.split('/d/')[1].split('/')[0]
-    return f"https://drive.google.com/uc?export=download&id={file_id}"
-
-def download_and_convert_pdf(pdf_url: str) -> List[PIL.Image.Image]:
-    """Download PDF from URL and convert to list of PIL Images"""
-    # Convert Google Drive link if needed
-    if 'drive.google.com' in pdf_url:
-        pdf_url = convert_drive_link_to_direct_download(pdf_url)
-    
-    # Download PDF to temporary file
-    response = requests.get(pdf_url)
-    if response.status_code != 200:
-        raise ValueError(f"Failed to download PDF: HTTP {response.status_code}")
-        
-    temp_pdf = "temp_slides.pdf"
-    with open(temp_pdf, "wb") as f:
-        f.write(response.content)
-    
-    try:
-        # Convert to images
-        images = convert_from_path(temp_pdf)
-        if not images:
-            raise ValueError("No images were extracted from the PDF")
-        return images
-    except Exception as e:
-        raise ValueError(f"Failed to convert PDF: {str(e)}")
-    finally:
-        # Clean up
-        if os.path.exists(temp_pdf):
-            os.remove(temp_pdf)
+def load_lecture_timeline(lecture_id: str) -> LectureTimeline:
+    """Fetch the columns a lecture's timeline needs and build its index"""
+    lecture_result = supabase.table('lectures').select('id, slides, slide_mappings, audio_transcription').eq('id', lecture_id).execute()
+    if not lecture_result or not lecture_result.data:
+        raise ValueError(f"Lecture {lecture_id} not found")
+    return LectureTimeline.from_lecture(lecture_result.data[0])
 
 def get_context_until_timestamp(lecture_id: str, session_id: str, timestamp: float) -> tuple:
     """
@@ -81,53 +59,29 @@ def get_context_until_timestamp(lecture_id: str, session_id: str, timestamp: flo
         List of content items (images and text) for Gemini
     """
     try:
-        # Get lecture info
-        lecture_result = supabase.table('lectures').select('*').eq('id', lecture_id).execute()
-        if not lecture_result or not lecture_result.data:
-            raise ValueError(f"Lecture {lecture_id} not found")
-        
-        # Since we're querying by ID, we expect only one result
-        lecture = lecture_result.data[0]
-        
-        # Get slide mappings and transcription from lecture data
-        if not lecture.get('slide_mappings'):
-            raise ValueError("No slide mappings found in lecture data")
-        if not lecture.get('audio_transcription'):
-            raise ValueError("No audio transcription found in lecture data")
-        if not lecture.get('slides'):
+        # Get the lecture's timeline index, fetched and built once per lecture
+        timeline = lecture_timelines.get(lecture_id, load_lecture_timeline)
+        if not timeline.slides_url:
             raise ValueError("No slides URL found in lecture data")
-            
-        slide_mappings = lecture['slide_mappings']
-        transcription = lecture['audio_transcription']
         
-        # Convert PDF slides to images
-        all_slides = download_and_convert_pdf(lecture['slides'])
-        if not all_slides:
-            raise ValueError("No slides were converted from PDF")
+        # Slides come from the slide cache, which downloads each deck once and rasterizes only the pages asked for
+        slide_count = slide_cache.page_count(timeline.slides_url)
+        if not slide_count:
+            raise ValueError("No slides were found in the PDF")
         
-        # Get transcript segments up to timestamp from the audio_transcription
-        transcript_segments = []
-        for segment in transcription.get('segments', []):
-            if float(segment['start']) <= timestamp:
-                transcript_segments.append(segment)
-        # Get current slide based on timestamp
-        current_slide_num = 0
-        for mapping in slide_mappings["slide_timestamps"]:
-            if float(mapping['timestamp']) <= timestamp:
-                current_slide_num = int(mapping['slide'])
-            else:
-                break
+        # Get transcript up to timestamp and the current slide with binary searches
+        transcript_text = timeline.transcript_until(timestamp)
+        current_slide_num = timeline.slide_at(timestamp)
                 
         # Prepare content items for Gemini
         contents = []
         
         # Add current slide image
-        if current_slide_num < len(all_slides):
-            contents.append(all_slides[current_slide_num])
+        if current_slide_num < slide_count:
+            contents.append(slide_cache.get_page(timeline.slides_url, current_slide_num))
             
         # Add transcript text
-        if transcript_segments:
-            transcript_text = " ".join([seg['text'] for seg in transcript_segments])
+        if transcript_text:
             contents.append(transcript_text)
             
         return contents
@@ -136,6 +90,40 @@ def get_context_until_timestamp(lecture_id: str, session_id: str, timestamp: flo
         print(f"Error getting context: {str(e)}")
         raise ValueError(f"Error getting context: {str(e)}")
 
+def parse_generated_questions(response_text: str, num_questions: int) -> List[Dict]:
+    """Parse the model's JSON array of questions, raising unless it holds exactly num_questions complete questions"""
+    # Clean up response text
+    response_text = (response_text or "").strip()
+    
+    # Remove markdown code block if present
+    if response_text.startswith("```json"):
+        response_text = response_text[7:]
+    if response_text.endswith("```"):
+        response_text = response_text[:-3]
+        
+    # Remove any leading/trailing whitespace and newlines
+    response_text = response_text.strip()
+    if not response_text:
+        raise ValueError("Empty response from model after cleanup")
+    
+    questions = json.loads(response_text)
+        
+    # Validate response structure
+    if not isinstance(questions, list):
+        raise ValueError(f"Response is not a list. Got type: {type(questions)}")
+    if len(questions) != num_questions:
+        raise ValueError(f"Did not receive exactly {num_questions} questions. Got {len(questions)} questions")
+    
+    # Validate each question has required fields
+    required_fields = {"question", "answer", "explanation"}
+    for i, q in enumerate(questions):
+        if not isinstance(q, dict):
+            raise ValueError(f"Question {i} is not a dictionary. Got type: {type(q)}")
+        missing_fields = required_fields - set(q.keys())
+        if missing_fields:
+            raise ValueError(f"Question {i} is missing required fields: {missing_fields}")
+    return questions
+
 def generate_questions(lecture_id: str, session_id: str, timestamp: float) -> List[Dict]:
     """
     Generate questions based on lecture content up to timestamp
@@ -158,7 +146,7 @@ def generate_questions(lecture_id: str, session_id: str, timestamp: float) -> Li
             raise ValueError("No content was retrieved from lecture")
             
         # Get lecture info to get number of questions and class_id
-        lecture_result = supabase.table('lectures').select('*').eq('id', lecture_id).execute()
+        lecture_result = supabase.table('lectures').select('id, class_id').eq('id', lecture_id).execute()
         if not lecture_result or not lecture_result.data:
             raise ValueError(f"Lecture {lecture_id} not found")
         lecture = lecture_result.data[0]
@@ -183,54 +171,32 @@ def generate_questions(lecture_id: str, session_id: str, timestamp: float) -> Li
         
         Return exactly {num_questions} questions in a JSON array. Return ONLY the JSON array, no other text or formatting."""
         
-        contents.insert(0, prompt)
+        # the instructions and slide image are fixed; an over-budget transcript keeps its most recent part
+        images = [item for item in contents if not isinstance(item, str)]
+        transcript = " ".join(item for item in contents if isinstance(item, str))
+        transcript = fit_prompt("question_gen", [
+            PromptSection("instructions", prompt, trim=False),
+            PromptSection("transcript", transcript, keep="tail"),
+        ], model=model.model_name, reserved_tokens=IMAGE_TOKENS * len(images))["transcript"]
+        contents = [prompt] + images + ([transcript] if transcript else [])
         
         # Generate response
-        response = model.generate_content(contents)
+        # question generation runs live in class, so a slow response is hedged with a duplicate (or fallback model) request
+        # a reply that does not parse into exactly num_questions questions is never cached, so a retry asks again
+        response = cached_generate_content(model, contents, validate=lambda response: parse_generated_questions(response.text, num_questions),
+                                           hedge_site="question_gen",
+                                           hedge_model=setup_gemini(QUESTION_GEN_FALLBACK_MODEL) if QUESTION_GEN_FALLBACK_MODEL else None)
         if not response or not response.text:
             raise ValueError("No response received from Gemini model")
+        questions = parse_generated_questions(response.text, num_questions)
         
-        # Clean up response text
-        response_text = response.text.strip()
-        
-        # Remove markdown code block if present
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-            
-        # Remove any leading/trailing whitespace and newlines
-        response_text = response_text.strip()
-        if not response_text:
-            raise ValueError("Empty response from model after cleanup")
-        
-        # Parse questions and add topic IDs
-        questions = json.loads(response_text)
-        
-        # Categorize each question into topics
-        for question in questions:
-            # Use LLM to categorize the question into multiple topics
-            question["topic_ids"] = categorize_question(
-                question["question"], 
-                question.get("explanation", ""),
-                class_id
-            )
-            # print(question, question["topic_ids"])
-            
-        # Validate response structure
-        if not isinstance(questions, list):
-            raise ValueError(f"Response is not a list. Got type: {type(questions)}")
-        if len(questions) != num_questions:
-            raise ValueError(f"Did not receive exactly {num_questions} questions. Got {len(questions)} questions")
-        
-        # Validate each question has required fields
-        required_fields = {"question", "answer", "explanation", "topic_ids"}
-        for i, q in enumerate(questions):
-            if not isinstance(q, dict):
-                raise ValueError(f"Question {i} is not a dictionary. Got type: {type(q)}")
-            missing_fields = required_fields - set(q.keys())
-            if missing_fields:
-                raise ValueError(f"Question {i} is missing required fields: {missing_fields}")
+        # Categorize every question into topics with a single LLM request
+        topic_ids = categorize_questions(
+            [{"text": question["question"], "explanation": question.get("explanation", "")} for question in questions],
+            class_id
+        )
+        for question, question_topic_ids in zip(questions, topic_ids):
+            question["topic_ids"] = question_topic_ids
                 
         try:
             # Save questions to database
@@ -240,8 +206,9 @@ def generate_questions(lecture_id: str, session_id: str, timestamp: float) -> Li
                     'session_id': session_id,
                     'question_number': i,
                     'question_text': q["question"],
-                    # 'answer': q["answer"],
-                    # 'explanation': q["explanation"]
+                    # kept so grading can check answers against it before calling an LLM
+                    'answer': q["answer"],
+                    'explanation': q["explanation"]
                 }
                 
                 # Insert the question first
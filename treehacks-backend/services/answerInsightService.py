@@ -1,7 +1,9 @@
 import os
+from typing import Dict
 from dotenv import load_dotenv
 from supabase import create_client, Client
 from openai import OpenAI
+from llm_cache import cached_chat_completion
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
@@ -10,6 +12,14 @@ supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 def add_answer_insight(question_id: int, question_text: str, answer_text: str):
+    insight = diagnose_answer(question_text, answer_text)
+    return insert_answer_insight(question_id, insight)
+
+def diagnose_answer(question_text: str, answer_text: str) -> str:
+    response = cached_chat_completion(openai_client, **build_diagnosis_request(question_text, answer_text))
+    return response.choices[0].message.content
+
+def build_diagnosis_request(question_text: str, answer_text: str) -> Dict:
     # openai call to get what is the main misunderstanding of the problem
     prompt = f"""
     Given this homework question: {question_text}
@@ -23,20 +33,17 @@ def add_answer_insight(question_id: int, question_text: str, answer_text: str):
     Provide a concise response focusing on these points.
     """
     
-    response = openai_client.chat.completions.create(
-        model="gpt-4o",
-        messages=[
+    return {
+        "model": "gpt-4o",
+        "messages": [
             {"role": "system", "content": "You are an educational assistant helping to analyze student answers."},
             {"role": "user", "content": prompt}
         ]
-    )
-    
-    insight = response.choices[0].message.content
+    }
 
+def insert_answer_insight(question_id: int, summary: str):
     # add to homework_answer_insight table
-    response = supabase.table("homework_answer_insight").insert({
-        "summary": insight,
+    return supabase.table("homework_answer_insight").insert({
+        "summary": summary,
         "question_id": question_id,
-    }).execute()
-    
-    return response
\ No newline at end of file
+    }).execute()
\ No newline at end of file
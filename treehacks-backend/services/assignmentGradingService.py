@@ -1,13 +1,18 @@
 import os
-from typing import Dict, List
+import asyncio
+import zipfile
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
 from PyPDF2 import PdfReader
 import json
 from openai import OpenAI
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from services.submissionParsingService import extract_text_from_pdf, split_into_answers
-from services.questionGradingService import grade_student_answer
-from services.answerInsightService import add_answer_insight
+from services.submissionParsingService import extract_text_from_pdf_bytes, iter_pdf_entries, list_pdf_entries, split_into_answers
+from services.questionGradingService import GRADING_BATCH_SIZE, format_answer_insight, grade_answers_cascade, split_into_batches
+from services.answerInsightService import diagnose_answer
+from services.bulkDataService import insert_rows
+from services.counterService import assignment_counter
+from async_utils import DEFAULT_CONCURRENCY, gather_with_concurrency, run_blocking, run_in_process
 
 # Load environment variables and initialize clients
 load_dotenv()
@@ -16,42 +21,189 @@ key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
+# How many submission files are extracted and split into answers at once
+SUBMISSION_PARSE_CONCURRENCY = int(os.environ.get("SUBMISSION_PARSE_CONCURRENCY", "8"))
+
 async def grade_student_assignment(assignment_id: int, pdf_path: str):
     """
+    Grade a single student's submission PDF for an assignment.
+    """
+    return await grade_student_assignments(assignment_id, [pdf_path])
+
+async def grade_student_assignments(assignment_id: int, pdf_paths: List[str], max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE) -> Dict:
+    """
+    Grade several students' submission PDFs, given as local paths, for an assignment.
+    """
+    def read_files() -> Iterator[Tuple[str, bytes]]:
+        for pdf_path in pdf_paths:
+            with open(pdf_path, "rb") as f:
+                yield pdf_path, f.read()
+
+    return await grade_submissions(assignment_id, read_files(), max_concurrency=max_concurrency, batch_size=batch_size, total_files=len(pdf_paths))
+
+async def grade_submission_archive(assignment_id: int, archive_path: str, max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE, on_progress: Callable[[str, int, int], None] = None) -> Dict:
+    """
+    Grade every student PDF in a zip archive for an assignment, streaming the
+    entries out of the archive without extracting them to disk.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        total_files = len(list_pdf_entries(archive))
+        return await grade_submissions(assignment_id, iter_pdf_entries(archive), max_concurrency=max_concurrency,
+                                       batch_size=batch_size, on_progress=on_progress, total_files=total_files)
+
+async def grade_submissions(assignment_id: int, submissions: Iterable[Tuple[str, bytes]], max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE,
+                            on_progress: Callable[[str, int, int], None] = None, total_files: int = None) -> Dict:
+    """
+    Grade many students' submissions, given as (file name, PDF bytes), for an assignment.
+
+    Files are pulled from `submissions` lazily by a bounded set of workers, so
+    only a few PDFs are held in memory at once. Each file's text is extracted
+    in the process pool and split into answers by the LLM; a file that fails
+    either step is reported and skipped without stopping the rest.
+
+    Answers are then grouped by problem number across all submissions so each
+    question's answers are graded with batched grading requests, with at most
+    `max_concurrency` requests in flight at once. Questions are read with one
+    query, insights are written back with one bulk insert, and submission
+    counts are applied as atomic increments through assignment_counter.
+
+    If given, `on_progress(stage, done, total)` is called as each file is
+    parsed ("files") and each grading batch finishes ("grading").
+
+    A grading batch that fails is reported and skipped the same way, so the
+    other batches' grades and insights are still stored.
 
+    Returns the number of parsed files and graded answers, and per-file and
+    per-batch failures.
     """
     try:
-        # Extract text from PDF
-        text = extract_text_from_pdf(pdf_path)
-        
-        # Split into questions
-        answers = await split_into_answers(text)
-
-        problem_num = 1
-        for answer in answers:
-            # fetch question for this assignment_id and this problem_number from Supabase
-            question_response = supabase.table("assignment_question").select("*").eq("assignment_id", assignment_id).eq("problem_number", problem_num).execute()
-            question_id = question_response.data[0].get("id")
-            question_text = question_response.data[0].get("text")
-
-            print(question_text)
-            print("response", answer)
-
-            # for each question, call questionGradingService to grade it given the problem statement and the student's answer
-            grade = await grade_student_answer(question_id, question_text, answer)
-
-            # update the "total_submission" column of the assignment_question table for this question_id by 1
-            supabase.table("assignment_question").update({"total_submission": question_response.data[0].get("total_submission") + 1}).eq("id", question_id).execute()
-            print("grade", grade)
-            if grade == "0":
-                # was incorrect, need to trigger insights for the problem
-                add_answer_insight(question_id, question_text, answer)
-            else:
-                # was correct
-                supabase.table("assignment_question").update({"correct_submission": question_response.data[0].get("correct_submission") + 1}).eq("id", question_id).execute()
+        questions = await fetch_assignment_questions(assignment_id)
+
+        def report(stage: str, done: int, total: int):
+            if on_progress:
+                on_progress(stage, done, total)
+
+        answers_by_problem, parsed, failures = await parse_submissions(assignment_id, questions, submissions, max_concurrency, report, total_files)
+
+        async def grade_batch(question: Dict, answers: List[str]) -> Tuple[List[bool], List[Dict]]:
+            question_id = question.get("id")
+            question_text = question.get("text")
+
+            # for each batch, call questionGradingService to grade and diagnose it given the problem statement and the students' answers
+            results = await grade_answers_cascade(question_id, question_text, answers)
+            print("grades", [result["grade"] for result in results])
+
+            async def diagnose(answer: str, result: Dict) -> Dict:
+                # was incorrect, keep the grader's diagnosis (or ask for one if the grader gave none)
+                summary = format_answer_insight(result)
+                if not summary:
+                    summary = await run_blocking(diagnose_answer, question_text, answer)
+                return {"summary": summary, "question_id": question_id}
+
+            insights = await asyncio.gather(*(
+                diagnose(answer, result)
+                for answer, result in zip(answers, results) if result["grade"] == "0"
+            ))
+            return [result["grade"] != "0" for result in results], list(insights)
+
+        batches = [
+            (questions[problem_num], batch)
+            for problem_num, answers in answers_by_problem.items()
+            for batch in split_into_batches(answers, batch_size)
+        ]
+        graded_batches = 0
+        failed_batches: List[Dict] = []
+
+        async def grade_and_report(question: Dict, batch: List[str]) -> Tuple[List[bool], List[Dict]]:
+            nonlocal graded_batches
+            try:
+                result = await grade_batch(question, batch)
+            except Exception as e:
+                # keep the other batches' grades; this batch's answers are left out of the counts
+                print(f"Error grading a batch of {len(batch)} answers to question {question.get('id')}: {str(e)}")
+                failed_batches.append({"question_id": question.get("id"), "answers": len(batch), "error": str(e)})
+                result = ([], [])
+            graded_batches += 1
+            report("grading", graded_batches, len(batches))
+            return result
+
+        report("grading", 0, len(batches))
+        batch_grades = await gather_with_concurrency(max_concurrency, (
+            grade_and_report(question, batch) for question, batch in batches
+        ))
+
+        graded: Dict[int, List[bool]] = {}
+        insights = []
+        for (question, _), (grades, batch_insights) in zip(batches, batch_grades):
+            graded.setdefault(question["id"], []).extend(grades)
+            insights.extend(batch_insights)
+        await store_grading_results(graded, insights)
+
+        return {
+            "parsed_files": parsed,
+            "graded_answers": sum(len(grades) for grades in graded.values()),
+            "failed_files": failures,
+            "failed_batches": failed_batches
+        }
 
-            problem_num += 1
-            print("\n\n")
-        
     except Exception as e:
-        raise Exception(f"Error processing assignment: {str(e)}")
\ No newline at end of file
+        raise Exception(f"Error processing assignment: {str(e)}")
+
+async def fetch_assignment_questions(assignment_id: int) -> Dict[int, Dict]:
+    """Every question of an assignment, keyed by problem_number."""
+    question_response = await run_blocking(supabase.table("assignment_question").select("*").eq("assignment_id", assignment_id).execute)
+    return {question["problem_number"]: question for question in question_response.data}
+
+async def parse_submissions(assignment_id: int, questions: Dict[int, Dict], submissions: Iterable[Tuple[str, bytes]], max_concurrency: int = DEFAULT_CONCURRENCY,
+                            report: Callable[[str, int, int], None] = None, total_files: int = None) -> Tuple[Dict[int, List[str]], int, List[Dict[str, str]]]:
+    """
+    Extract and split every submission into answers, a few files at a time.
+
+    Returns the answers grouped by problem number, the number of files parsed
+    and the files that failed.
+    """
+    answers_by_problem: Dict[int, List[str]] = {}
+    failures: List[Dict[str, str]] = []
+    submission_iter = iter(submissions)
+    parsed = 0
+
+    async def parse_files():
+        nonlocal parsed
+        for name, pdf_bytes in submission_iter:
+            try:
+                text = await run_in_process(extract_text_from_pdf_bytes, pdf_bytes)
+                answers = await split_into_answers(text)
+            except Exception as e:
+                print(f"Error parsing submission {name}: {str(e)}")
+                failures.append({"file": name, "error": str(e)})
+            else:
+                problem_num = 1
+                for answer in answers:
+                    if problem_num in questions:
+                        answer_text = answer["text"] if isinstance(answer, dict) else answer
+                        answers_by_problem.setdefault(problem_num, []).append(answer_text)
+                    else:
+                        print(f"No question {problem_num} in assignment {assignment_id}, skipping answer in {name}")
+                    problem_num += 1
+                parsed += 1
+            if report:
+                report("files", parsed + len(failures), total_files or parsed + len(failures))
+
+    if report:
+        report("files", 0, total_files or 0)
+    await asyncio.gather(*(parse_files() for _ in range(max(1, min(max_concurrency, SUBMISSION_PARSE_CONCURRENCY)))))
+    return answers_by_problem, parsed, failures
+
+async def store_grading_results(graded: Dict[int, List[bool]], insights: List[Dict]):
+    """
+    Write an assignment's grading results: every answer insight in one bulk
+    insert, and per-question correctness (True per correct answer) as
+    submission-count increments through assignment_counter.
+    """
+    await run_blocking(insert_rows, "homework_answer_insight", insights)
+
+    # add to the "total_submission" and "correct_submission" columns of the assignment_question table
+    for question_id, question_grades in graded.items():
+        assignment_counter.add(question_id, len(question_grades), sum(question_grades))
+    await assignment_counter.flush()
+
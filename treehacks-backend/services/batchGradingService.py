@@ -0,0 +1,235 @@
+import os
+import json
+import uuid
+import shutil
+import zipfile
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from llm_batch import BATCH_DONE, BatchBackend, completion_text, get_batch_backend, make_batch_request, write_batch_file
+from services.questionGradingService import (CASCADE_STRONG_MODEL, GRADING_BATCH_SIZE, build_batch_grading_request, format_answer_insight,
+                                             parse_batch_grading_reply, score_answers_batch, settle_answers_locally, split_into_batches)
+from services.answerInsightService import build_diagnosis_request, diagnose_answer
+from services.assignmentGradingService import fetch_assignment_questions, parse_submissions, store_grading_results
+from services.submissionParsingService import iter_pdf_entries, list_pdf_entries
+from async_utils import DEFAULT_CONCURRENCY, gather_with_concurrency, run_blocking
+
+# Scratch space for batch input files while their batches run
+BATCH_WORK_DIR = os.environ.get("BATCH_WORK_DIR", "data/batches")
+# Batch requests are priced per token at half the online rate, so the strong model grades everything
+BATCH_GRADING_MODEL = os.environ.get("BATCH_GRADING_MODEL", CASCADE_STRONG_MODEL)
+# Consecutive failed polls of a batch (provider outages, timeouts) tolerated before the job fails
+BATCH_MAX_POLL_ERRORS = int(os.environ.get("BATCH_MAX_POLL_ERRORS", "20"))
+
+async def submit_batch(backend: BatchBackend, requests: List[Dict], input_path: str) -> Optional[str]:
+    """Write `requests` to a batch input file and submit it. Returns the batch id, or None when there is nothing to send."""
+    if not requests:
+        return None
+    await run_blocking(write_batch_file, input_path, requests)
+    batch_id = await run_blocking(backend.submit, input_path)
+    print(f"submitted batch {batch_id} with {len(requests)} requests")
+    return batch_id
+
+async def collect_batch(backend: BatchBackend, batch_id: Optional[str]) -> Optional[Dict[str, Optional[Dict]]]:
+    """
+    Check a batch once. Returns None while it is still running, and the
+    response body per custom_id once it is done; a batch that did not
+    complete returns no results, leaving every request to the caller's fallback.
+    """
+    if batch_id is None:
+        return {}
+    status = await run_blocking(backend.status, batch_id)
+    if status not in BATCH_DONE:
+        print(f"batch {batch_id} is {status}")
+        return None
+    if status != "completed":
+        print(f"batch {batch_id} ended {status}, falling back to online requests")
+        return {}
+    return await run_blocking(backend.results, batch_id)
+
+def save_state(work_dir: str, state: Dict):
+    os.makedirs(work_dir, exist_ok=True)
+    path = os.path.join(work_dir, "state.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(path + ".tmp", path)
+
+def load_state(work_dir: str) -> Dict:
+    with open(os.path.join(work_dir, "state.json")) as f:
+        return json.load(f)
+
+async def grade_submission_archive_batch(assignment_id: int, archive_path: str, checkpoint: Dict = None, save: Callable[[Dict], None] = None,
+                                         backend: BatchBackend = None, max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE,
+                                         on_progress: Callable[[str, int, int], None] = None) -> Optional[Dict]:
+    """Batch-mode counterpart of grade_submission_archive; the archive is only read until its submissions are parsed."""
+    if checkpoint and checkpoint.get("stage"):
+        return await grade_submissions_batch(assignment_id, [], checkpoint, save, backend, max_concurrency=max_concurrency,
+                                             batch_size=batch_size, on_progress=on_progress)
+    with zipfile.ZipFile(archive_path) as archive:
+        total_files = len(list_pdf_entries(archive))
+        return await grade_submissions_batch(assignment_id, iter_pdf_entries(archive), checkpoint, save, backend, max_concurrency=max_concurrency,
+                                             batch_size=batch_size, on_progress=on_progress, total_files=total_files)
+
+async def grade_submissions_batch(assignment_id: int, submissions: Iterable[Tuple[str, bytes]], checkpoint: Dict = None, save: Callable[[Dict], None] = None,
+                                  backend: BatchBackend = None, max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE,
+                                  on_progress: Callable[[str, int, int], None] = None, total_files: int = None) -> Optional[Dict]:
+    """
+    Grade an assignment's submissions through a provider batch API instead of
+    online requests, for homework that does not need results right away.
+
+    Submissions are parsed into answers as in grade_submissions. Answers that
+    settle_answers_locally can grade never leave the process; the rest of each
+    question's answers go into one batch of grading requests. Wrong answers the
+    grader did not diagnose then go into a second batch of diagnosis requests.
+    Any request whose batch result is missing or malformed is retried online.
+    Results are stored exactly as grade_submissions stores them.
+
+    Batches take hours, so this never waits on one: it advances as far as it
+    can and returns None while a batch is still running; call it again with
+    the same `checkpoint` to continue. `checkpoint` records the current stage
+    and batch id (the parsed answers and grades so far live in a state file in
+    its work directory) and is passed to `save(checkpoint)` whenever it
+    changes, so a caller that persists it resumes polling the same batches
+    after a restart instead of paying for new ones. An error checking on a
+    batch is treated like a batch still running, up to BATCH_MAX_POLL_ERRORS
+    in a row; only errors that end the job remove its work directory. A run interrupted while
+    storing results raises instead of storing them again. `submissions` is
+    only read on the first call.
+
+    If given, `on_progress(stage, done, total)` is called as each file is
+    parsed ("files") and as each batch finishes ("grading", "diagnosis").
+
+    Returns the number of parsed files and graded answers, and per-file failures.
+    """
+    backend = backend or get_batch_backend()
+    checkpoint = checkpoint if checkpoint is not None else {}
+    save = save or (lambda checkpoint: None)
+    if "work_dir" not in checkpoint:
+        checkpoint["work_dir"] = os.path.join(BATCH_WORK_DIR, f"assignment-{assignment_id}-{uuid.uuid4().hex[:8]}")
+        save(checkpoint)
+    work_dir = checkpoint["work_dir"]
+
+    def report(stage: str, done: int, total: int):
+        if on_progress:
+            on_progress(stage, done, total)
+
+    async def poll() -> Optional[Dict[str, Optional[Dict]]]:
+        # a failed poll is not a failed batch: keep the work directory and try again on the next poll
+        try:
+            replies = await collect_batch(backend, checkpoint["batch_id"])
+        except Exception as e:
+            checkpoint["poll_errors"] = checkpoint.get("poll_errors", 0) + 1
+            if checkpoint["poll_errors"] > BATCH_MAX_POLL_ERRORS:
+                raise
+            print(f"Error polling batch {checkpoint['batch_id']} ({checkpoint['poll_errors']}/{BATCH_MAX_POLL_ERRORS}), retrying: {str(e)}")
+            save(checkpoint)
+            return None
+        if checkpoint.pop("poll_errors", None):
+            save(checkpoint)
+        return replies
+
+    try:
+        if not checkpoint.get("stage"):
+            questions = await fetch_assignment_questions(assignment_id)
+            answers_by_problem, parsed, failures = await parse_submissions(assignment_id, questions, submissions, max_concurrency, report, total_files)
+            batches = [
+                (questions[problem_num], batch)
+                for problem_num, answers in answers_by_problem.items()
+                for batch in split_into_batches(answers, batch_size)
+            ]
+            state = {
+                "batches": batches,
+                "results": [settle_answers_locally(answers) for _, answers in batches],
+                "parsed": parsed,
+                "failures": failures,
+            }
+            await run_blocking(save_state, work_dir, state)
+
+            # grading batch: one request per answer batch, covering only the answers that need a model
+            requests = [
+                make_batch_request(f"grade-{n}", build_batch_grading_request(
+                    question.get("text"), [answer for answer, result in zip(answers, state["results"][n]) if result is None], model=BATCH_GRADING_MODEL))
+                for n, (question, answers) in enumerate(batches) if None in state["results"][n]
+            ]
+            report("grading", 0, 1)
+            checkpoint.update(stage="grading", batch_id=await submit_batch(backend, requests, os.path.join(work_dir, "grading.jsonl")))
+            save(checkpoint)
+        else:
+            state = await run_blocking(load_state, work_dir)
+        batches, results = state["batches"], state["results"]
+
+        if checkpoint["stage"] == "storing":
+            # storing inserts insights and increments counts, so a run interrupted there is never repeated
+            raise RuntimeError("interrupted while storing results; not retried to avoid storing them twice")
+
+        if checkpoint["stage"] == "grading":
+            replies = await poll()
+            if replies is None:
+                return None
+            report("grading", 1, 1)
+            pending = [[i for i, result in enumerate(batch_results) if result is None] for batch_results in results]
+
+            async def settle(n: int):
+                question, answers = batches[n]
+                if not pending[n]:
+                    return
+                try:
+                    scores = parse_batch_grading_reply(completion_text(replies.get(f"grade-{n}")), len(pending[n]))
+                except Exception as e:
+                    print(f"No usable batch grades for question {question.get('id')}, grading online: {str(e)}")
+                    scores = await score_answers_batch(question.get("id"), question.get("text"), [answers[i] for i in pending[n]], model=BATCH_GRADING_MODEL)
+                for i, score in zip(pending[n], scores):
+                    results[n][i] = score
+
+            await gather_with_concurrency(max_concurrency, (settle(n) for n in range(len(batches))))
+
+            # diagnosis batch: wrong answers the grader gave no diagnosis for
+            state["undiagnosed"] = [
+                (n, i) for n, batch_results in enumerate(results)
+                for i, result in enumerate(batch_results) if result["grade"] == "0" and not format_answer_insight(result)
+            ]
+            await run_blocking(save_state, work_dir, state)
+            requests = [
+                make_batch_request(f"diagnose-{n}-{i}", build_diagnosis_request(batches[n][0].get("text"), batches[n][1][i]))
+                for n, i in state["undiagnosed"]
+            ]
+            report("diagnosis", 0, 1)
+            checkpoint.update(stage="diagnosis", batch_id=await submit_batch(backend, requests, os.path.join(work_dir, "diagnosis.jsonl")))
+            save(checkpoint)
+
+        replies = await poll()
+        if replies is None:
+            return None
+        report("diagnosis", 1, 1)
+
+        async def diagnose(n: int, i: int) -> Tuple[int, int, str]:
+            summary = completion_text(replies.get(f"diagnose-{n}-{i}"))
+            if not summary:
+                summary = await run_blocking(diagnose_answer, batches[n][0].get("text"), batches[n][1][i])
+            return n, i, summary
+
+        summaries = {
+            (n, i): summary
+            for n, i, summary in await gather_with_concurrency(max_concurrency, (diagnose(n, i) for n, i in state["undiagnosed"]))
+        }
+
+        graded: Dict[int, List[bool]] = {}
+        insights = []
+        for n, ((question, _), batch_results) in enumerate(zip(batches, results)):
+            graded.setdefault(question["id"], []).extend(result["grade"] != "0" for result in batch_results)
+            insights.extend(
+                {"summary": format_answer_insight(result) or summaries[(n, i)], "question_id": question["id"]}
+                for i, result in enumerate(batch_results) if result["grade"] == "0"
+            )
+        checkpoint["stage"] = "storing"
+        save(checkpoint)
+        await store_grading_results(graded, insights)
+
+        shutil.rmtree(work_dir, ignore_errors=True)
+        return {
+            "parsed_files": state["parsed"],
+            "graded_answers": sum(len(grades) for grades in graded.values()),
+            "failed_files": state["failures"]
+        }
+
+    except Exception as e:
+        shutil.rmtree(work_dir, ignore_errors=True)
+        raise Exception(f"Error batch processing assignment: {str(e)}")
@@ -0,0 +1,63 @@
+import os
+from typing import Dict, List
+from dotenv import load_dotenv
+from supabase import create_client, Client
+
+load_dotenv()
+url: str = os.environ.get("SUPABASE_URL")
+key: str = os.environ.get("SUPABASE_KEY")
+supabase: Client = create_client(url, key)
+
+# PostgREST caps rows per response, so reads are paged and writes chunked
+PAGE_SIZE = 1000
+WRITE_CHUNK_SIZE = 500
+
+def select_in(table: str, columns: str, column: str, values: List, page_size: int = PAGE_SIZE) -> List[Dict]:
+    """Select every row of `table` whose `column` is in `values`, in one query per page."""
+    if not values:
+        return []
+    rows = []
+    start = 0
+    while True:
+        response = (supabase.table(table)
+            .select(columns)
+            .in_(column, list(values))
+            .order("id")
+            .range(start, start + page_size - 1)
+            .execute())
+        rows.extend(response.data)
+        if len(response.data) < page_size:
+            return rows
+        start += page_size
+
+def group_rows(rows: List[Dict], column: str) -> Dict[str, List[Dict]]:
+    """Group rows by the string value of `column`."""
+    groups: Dict[str, List[Dict]] = {}
+    for row in rows:
+        groups.setdefault(str(row[column]), []).append(row)
+    return groups
+
+def delete_in(table: str, column: str, values: List, chunk_size: int = WRITE_CHUNK_SIZE):
+    """Delete every row of `table` whose `column` is in `values`."""
+    values = list(values)
+    for i in range(0, len(values), chunk_size):
+        supabase.table(table).delete().in_(column, values[i:i + chunk_size]).execute()
+
+def insert_rows(table: str, rows: List[Dict]) -> List[Dict]:
+    """Insert rows in bulk and return the inserted rows, in input order."""
+    inserted = []
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        response = supabase.table(table).insert(rows[i:i + WRITE_CHUNK_SIZE]).execute()
+        inserted.extend(response.data)
+    return inserted
+
+def upsert_rows(table: str, rows: List[Dict]) -> List[Dict]:
+    """
+    Upsert rows in bulk on their primary key. Rows should be complete (as
+    loaded, with updated fields) so the insert half of the upsert is valid.
+    """
+    upserted = []
+    for i in range(0, len(rows), WRITE_CHUNK_SIZE):
+        response = supabase.table(table).upsert(rows[i:i + WRITE_CHUNK_SIZE]).execute()
+        upserted.extend(response.data)
+    return upserted
@@ -0,0 +1,111 @@
+import os
+import asyncio
+from typing import Dict, List, Tuple
+from dotenv import load_dotenv
+from supabase import create_client, Client
+from services.bulkDataService import select_in, upsert_rows
+from async_utils import run_blocking
+
+load_dotenv()
+url: str = os.environ.get("SUPABASE_URL")
+key: str = os.environ.get("SUPABASE_KEY")
+supabase: Client = create_client(url, key)
+
+# Seconds between background flushes of buffered submission counts
+COUNTER_FLUSH_INTERVAL = float(os.environ.get("COUNTER_FLUSH_INTERVAL", "5"))
+
+# Postgres function that applies a batch of deltas as atomic increments, defined in
+# migrations/increment_submission_counts.sql
+INCREMENT_RPC = "increment_submission_counts"
+# PostgREST's error code for a function that does not exist
+RPC_NOT_FOUND = "PGRST202"
+
+class SubmissionCounter:
+    """
+    In-memory buffer of per-question total_submission / correct_submission deltas.
+
+    Graders add() deltas instead of updating rows themselves; flush() sends
+    every pending delta for the table in a single increment_submission_counts
+    RPC, so concurrent graders neither lose updates nor make a round trip per
+    answer. Deltas are flushed every `flush_interval` seconds once start() has
+    been called, and on stop(). Only if the RPC is not installed does flush()
+    fall back to one bulk read and one bulk upsert, which is only safe while
+    this process is the sole writer. Any other RPC error (e.g. a timeout,
+    which may come after the increments were committed) is raised and the
+    deltas are retried through the RPC on the next flush, never through the
+    fallback.
+    """
+
+    def __init__(self, table: str, flush_interval: float = COUNTER_FLUSH_INTERVAL):
+        self.table = table
+        self.flush_interval = flush_interval
+        self.deltas: Dict[str, List[int]] = {}
+        self.flush_lock = asyncio.Lock()
+        self.flusher: asyncio.Task = None
+
+    def add(self, question_id, total: int, correct: int):
+        """Buffer `total` new submissions, `correct` of them correct, for a question."""
+        delta = self.deltas.setdefault(str(question_id), [0, 0])
+        delta[0] += total
+        delta[1] += correct
+
+    async def flush(self) -> int:
+        """Write every buffered delta to the database. Returns the number of questions updated."""
+        async with self.flush_lock:
+            deltas, self.deltas = self.deltas, {}
+            if not deltas:
+                return 0
+            try:
+                await run_blocking(self._write, list(deltas.items()))
+            except Exception:
+                # keep the deltas for the next flush rather than dropping them
+                for question_id, (total, correct) in deltas.items():
+                    self.add(question_id, total, correct)
+                raise
+            return len(deltas)
+
+    def start(self):
+        if self.flusher is None:
+            self.flusher = asyncio.create_task(self._flush_periodically())
+
+    async def stop(self):
+        if self.flusher is not None:
+            self.flusher.cancel()
+            await asyncio.gather(self.flusher, return_exceptions=True)
+            self.flusher = None
+        await self.flush()
+
+    def pending(self) -> int:
+        return len(self.deltas)
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing {self.table} submission counts: {str(e)}")
+
+    def _write(self, deltas: List[Tuple[str, List[int]]]):
+        payload = [{"id": question_id, "total": total, "correct": correct} for question_id, (total, correct) in deltas]
+        try:
+            supabase.rpc(INCREMENT_RPC, {"table_name": self.table, "deltas": payload}).execute()
+            return
+        except Exception as e:
+            if getattr(e, "code", None) != RPC_NOT_FOUND:
+                raise
+            print(f"{INCREMENT_RPC} is not installed, falling back to bulk upsert")
+
+        by_id = dict(deltas)
+        rows = select_in(self.table, "*", "id", list(by_id.keys()))
+        upsert_rows(self.table, [
+            {
+                **row,
+                "total_submission": (row.get("total_submission") or 0) + by_id[str(row["id"])][0],
+                "correct_submission": (row.get("correct_submission") or 0) + by_id[str(row["id"])][1]
+            }
+            for row in rows
+        ])
+
+assignment_counter = SubmissionCounter("assignment_question")
+session_counter = SubmissionCounter("session_questions")
@@ -0,0 +1,81 @@
+import os
+import asyncio
+from typing import List, Set
+from services.sessionGradingService import grade_questions
+from llm_scheduler import INTERACTIVE, llm_priority
+
+# Number of background grading workers and how many questions may wait in the queue
+GRADING_WORKERS = int(os.environ.get("GRADING_WORKERS", "4"))
+GRADING_QUEUE_SIZE = int(os.environ.get("GRADING_QUEUE_SIZE", "1000"))
+
+class GradingQueue:
+    """
+    In-process queue that grades live session responses in the background as they arrive.
+
+    Work items are session question ids; a question already waiting in the
+    queue is not enqueued twice, since one grading pass picks up every
+    ungraded response for it. A worker takes every question waiting in the
+    queue and grades them together, so database round trips stay constant
+    under bursts of submissions. When the queue is full, submit() waits for room,
+    which pushes back on the request that is submitting responses.
+    """
+
+    def __init__(self, num_workers: int = GRADING_WORKERS, max_size: int = GRADING_QUEUE_SIZE):
+        self.num_workers = num_workers
+        self.max_size = max_size
+        self.queue: asyncio.Queue = None
+        self.pending: Set[str] = set()
+        self.workers: List[asyncio.Task] = []
+
+    def start(self):
+        if self.workers:
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_size)
+        self.workers = [asyncio.create_task(self._worker(i)) for i in range(self.num_workers)]
+        print(f"Started {self.num_workers} background grading workers")
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    async def submit(self, question_id: str):
+        """Queue a question for background grading, waiting if the queue is full."""
+        if self.queue is None or str(question_id) in self.pending:
+            return
+        self.pending.add(str(question_id))
+        await self.queue.put(str(question_id))
+
+    async def drain(self):
+        """Wait until every queued question has been graded."""
+        if self.queue is not None:
+            await self.queue.join()
+
+    def status(self) -> dict:
+        return {
+            "workers": len(self.workers),
+            "queued": self.queue.qsize() if self.queue is not None else 0,
+            "max_size": self.max_size,
+        }
+
+    async def _worker(self, worker_number: int):
+        while True:
+            question_ids = [await self.queue.get()]
+            while not self.queue.empty():
+                question_ids.append(self.queue.get_nowait())
+            # responses arriving from here on need another pass, so allow re-queueing now
+            self.pending.difference_update(question_ids)
+            try:
+                # live responses are graded ahead of background batch work
+                with llm_priority(INTERACTIVE):
+                    graded = await grade_questions(question_ids)
+                if graded:
+                    print(f"Worker {worker_number} graded {graded} responses for questions {question_ids}")
+            except Exception as e:
+                print(f"Error grading questions {question_ids} in background: {str(e)}")
+            finally:
+                for _ in question_ids:
+                    self.queue.task_done()
+
+grading_queue = GradingQueue()
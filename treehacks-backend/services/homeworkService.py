@@ -4,6 +4,14 @@ from supabase import create_client, Client
 from openai import OpenAI
 from pydantic import BaseModel
 import json
+import hashlib
+import asyncio
+from typing import Dict, List
+from services.insightClusteringService import extract_misconceptions
+from services.bulkDataService import delete_in, group_rows, insert_rows, select_in
+from async_utils import DEFAULT_CONCURRENCY, gather_with_concurrency, run_blocking
+from llm_cache import cached_chat_completion, require_text
+from prompt_budget import PromptSection, fit_prompt
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
@@ -12,90 +20,87 @@ supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 
-def publish_question_extracted_insight(assignment_id: int):
-    response = supabase.table("assignment_question").select("id").eq("assignment_id", assignment_id).execute()
-    question_ids = response.data
+async def publish_question_extracted_insight(assignment_id: int, max_concurrency: int = DEFAULT_CONCURRENCY, force: bool = False):
+    """
+    Rebuild the extracted insights of every question in an assignment.
 
-    for value in question_ids:
-        question_id = value["id"]
-        supabase.table("homework_question_extracted_insight").delete().eq("question_id", question_id).execute()
-    
-    for value in question_ids:
-        question_id = value["id"]
-        answer_insight_response = supabase.table("homework_answer_insight").select("*").eq("question_id", question_id).execute()
-        insights = answer_insight_response.data
+    Old extracted insights are removed with one bulk delete and all answer
+    insights are fetched with one bulk query; the per-question clustering and
+    LLM calls then run concurrently (at most `max_concurrency` at once) and the
+    results are stored with one bulk insert. `force` bypasses cached
+    misconception names.
+    """
+    response = await run_blocking(supabase.table("assignment_question").select("id").eq("assignment_id", assignment_id).execute)
+    question_ids = [value["id"] for value in response.data]
+
+    await run_blocking(delete_in, "homework_question_extracted_insight", "question_id", question_ids)
+    answer_insights = await run_blocking(select_in, "homework_answer_insight", "*", "question_id", question_ids)
+    insights_by_question = group_rows(answer_insights, "question_id")
+
+    async def extract(question_id: int) -> List[Dict]:
+        insights = insights_by_question.get(str(question_id))
         print(f"insights for question id: {question_id}: ", insights)
-        
-        if not insights:
-            continue
-            
-        all_insights = "\n".join([insight["summary"] for insight in insights])
-        
-        prompt = f"""
-        Analyze these student answer insights and identify the most common misconceptions or errors(max 5):
-        {all_insights}
-        
-        For each misconception/error, provide:
-        1. A clear description of the misconception that is under 8 words
-        2. An exact count of how many students had this misconception. There is one student for each Main Misunderstanding or Misconception and Key Areas for Improvement insight.
 
-        Return the response in the following JSON format:
-        {{"misconceptions": [
-            {{"error_type": "description of the misconception",
-             "error_count": number of answers with this misconception}}
-        ]}}
+        if not insights:
+            return []
 
-        """
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an educational analyst identifying common student misconceptions."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format= { "type": "json_object" },
-        )
-        
         try:
-            response_content = json.loads(response.choices[0].message.content)
-            misconceptions = response_content.get("misconceptions", [])
-            print(f"Response for question {question_id}: ", response_content)
+            # cluster the answer insights locally and only ask the LLM to name the top clusters (max 5)
+            misconceptions = await run_blocking(extract_misconceptions, insights, max_misconceptions=5, force=force)
             print(f"Extracted misconceptions: ", misconceptions)
-            
-            for misconception in misconceptions:
-                supabase.table("homework_question_extracted_insight").insert({
-                    "question_id": question_id,
-                    "error_summary": misconception["error_type"],
-                    "error_count": misconception["error_count"],
-                }).execute()
-                
         except Exception as e:
             print(f"Error processing question {question_id}: {str(e)}")
-            continue
-    
+            return []
+
+        return [
+            {
+                "question_id": question_id,
+                "error_summary": misconception["error_type"],
+                "error_count": misconception["error_count"],
+            }
+            for misconception in misconceptions
+        ]
+
+    extracted = await gather_with_concurrency(max_concurrency, (extract(question_id) for question_id in question_ids))
+    await run_blocking(insert_rows, "homework_question_extracted_insight", [row for rows in extracted for row in rows])
+
     return "Question insights published successfully"
 
-def publish_homework_summary(assignment_id: int):
+def publish_homework_summary(assignment_id: int, force: bool = False):
+    """
+    Summarize the extracted question insights with gpt-4o and store the summary.
+
+    A hash of the input insights is stored next to the summary, and the LLM is
+    skipped when it matches the stored one, unless `force` is set, which also
+    bypasses a cached reply.
+    """
     # Get questions with their problem numbers
     questions_response = supabase.table("assignment_question").select("id,problem_number").eq("assignment_id", assignment_id).execute()
     question_map = {q["id"]: q["problem_number"] for q in questions_response.data}
     question_ids = list(question_map.keys())
     
-    all_insights = []
-    for qid in question_ids:
-        insights_response = supabase.table("homework_question_extracted_insight").select("*").eq("question_id", qid).execute()
-        # Add problem_number to each insight
-        for insight in insights_response.data:
-            insight["problem_number"] = question_map[qid]
-        all_insights.extend(insights_response.data)
+    all_insights = select_in("homework_question_extracted_insight", "*", "question_id", question_ids)
+    # Add problem_number to each insight
+    for insight in all_insights:
+        insight["problem_number"] = question_map[insight["question_id"]]
     
     if not all_insights:
         return "No insights found for this homework"
     
+    # order insights so the same set always gives the same prompt and hash
+    all_insights.sort(key=lambda insight: (insight["problem_number"] or 0, insight["error_summary"] or "", insight["error_count"] or 0))
     insights_text = ""
     for insight in all_insights:
         insights_text += f"Problem {insight['problem_number']}: {insight['error_summary']} (Found in {insight['error_count']} responses)\n"
     
+    insights_hash = hashlib.sha256(insights_text.encode("utf-8")).hexdigest()
+    existing_insight = supabase.table("assignment_insight").select("*").eq("assignment_id", assignment_id).execute()
+    if not force and existing_insight.data and existing_insight.data[0].get("insights_hash") == insights_hash:
+        return "Homework summary unchanged, skipped"
+
+    # the hash covers every insight; only the prompt drops trailing lines past the token budget
+    insights_text = fit_prompt("homework_summary", [PromptSection("insights", insights_text)])["insights"]
+
     prompt = f"""
     Analyze these question-level insights from a homework assignment and create a comprehensive summary:
     
@@ -108,7 +113,9 @@ def publish_homework_summary(assignment_id: int):
     Format your response in a clear, concise way that would be helpful for an instructor. Don't leave any additional comments.
     """
     
-    response = openai_client.chat.completions.create(
+    response = cached_chat_completion(openai_client,
+        cache=not force,
+        validate=require_text,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an educational analyst creating homework-level summaries from question-level insights."},
@@ -119,17 +126,17 @@ def publish_homework_summary(assignment_id: int):
     summary = response.choices[0].message.content
     
     try:
-        existing_insight = supabase.table("assignment_insight").select("*").eq("assignment_id", assignment_id).execute()
-            
         if existing_insight.data:
             supabase.table("assignment_insight").update({
                 "summary": summary,
+                "insights_hash": insights_hash,
             }).eq("assignment_id", assignment_id).execute()
             return "Homework summary updated successfully"
         else:
             supabase.table("assignment_insight").insert({
                 "assignment_id": assignment_id,
                 "summary": summary,
+                "insights_hash": insights_hash,
             }).execute()
             return "Assignment summary published successfully"
     except Exception as e:
@@ -154,7 +161,7 @@ if __name__ == "__main__":
             print(f"  - {insight['summary']}")
     
     print("\nPublishing question extracted insights...")
-    result = publish_question_extracted_insight(assignment_id)
+    result = asyncio.run(publish_question_extracted_insight(assignment_id))
     print("Result:", result)
     
     # Verify the extracted insights
@@ -0,0 +1,105 @@
+import os
+import json
+import numpy as np
+from typing import Dict, List
+from dotenv import load_dotenv
+from openai import OpenAI
+from cluster_utils import cluster_embeddings
+from llm_cache import cached_chat_completion, cached_embeddings
+from prompt_budget import PromptSection, fit_prompt
+
+load_dotenv()
+openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+EMBEDDING_MODEL = os.environ.get("INSIGHT_EMBEDDING_MODEL", "text-embedding-3-small")
+# Minimum cosine similarity for two answer insights to count as the same misconception
+INSIGHT_CLUSTER_THRESHOLD = float(os.environ.get("INSIGHT_CLUSTER_THRESHOLD", "0.75"))
+# How many member insights of each cluster are shown to the LLM when naming it
+REPRESENTATIVES_PER_CLUSTER = 3
+EMBEDDING_BATCH_SIZE = 512
+# Tokens of each group's representatives kept when the naming prompt is over budget
+MIN_GROUP_TOKENS = 64
+
+def embed_texts(texts: List[str]) -> np.ndarray:
+    """Embed texts with the OpenAI embeddings API (cached per text), in batches, as an (n, d) array."""
+    vectors = []
+    for i in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+        vectors.extend(cached_embeddings(openai_client, EMBEDDING_MODEL, texts[i:i + EMBEDDING_BATCH_SIZE]))
+    return np.array(vectors)
+
+def extract_misconceptions(insights: List[Dict], max_misconceptions: int, force: bool = False) -> List[Dict]:
+    """
+    Group per-answer insights into common misconceptions with exact counts.
+
+    Insights are embedded and clustered locally; each cluster's count is the
+    sum of its members' answer_count (1 when absent). Only the largest
+    `max_misconceptions` clusters are named, in one LLM call that sees a few
+    representative members per cluster, so the prompt size does not grow with
+    class size. `force` asks the LLM again instead of reusing a cached reply.
+
+    Returns a list of {"error_type", "error_count"} dicts, largest first.
+    """
+    if not insights:
+        return []
+
+    summaries = [insight["summary"] for insight in insights]
+    weights = np.array([insight.get("answer_count") or 1 for insight in insights], dtype=float)
+    clusters = cluster_embeddings(embed_texts(summaries), weights, INSIGHT_CLUSTER_THRESHOLD)[:max_misconceptions]
+
+    # one section per group so trimming shortens later (smaller) groups but never drops one the reply must name
+    groups = fit_prompt("misconception_names", [
+        PromptSection(
+            f"group_{i + 1}",
+            f"Group {i + 1}:\n" + "\n".join(f"- {summaries[member]}" for member in cluster[:REPRESENTATIVES_PER_CLUSTER]),
+            priority=-i,
+            min_tokens=MIN_GROUP_TOKENS
+        )
+        for i, cluster in enumerate(clusters)
+    ])
+    cluster_text = "\n\n".join(groups.values())
+    prompt = f"""
+    Each group below contains student answer insights that share the same underlying misconception or error:
+
+    {cluster_text}
+
+    For each group, provide a clear description of the shared misconception that is under 8 words.
+    Return exactly one description per group, in the same order.
+    """
+
+    def parse_names(response) -> List[str]:
+        names = json.loads(response.choices[0].message.content)["names"]
+        if len(names) != len(clusters):
+            raise ValueError(f"Expected {len(clusters)} misconception names, got {len(names)}")
+        return names
+
+    response = cached_chat_completion(openai_client,
+        cache=not force,
+        validate=parse_names,
+        model="gpt-4o",
+        messages=[
+            {"role": "system", "content": "You are an educational analyst identifying common student misconceptions."},
+            {"role": "user", "content": prompt}
+        ],
+        response_format={
+            "type": "json_schema",
+            "json_schema": {
+                "name": "misconception_names",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "names": {"type": "array", "items": {"type": "string"}}
+                    },
+                    "required": ["names"],
+                    "additionalProperties": False
+                }
+            }
+        }
+    )
+
+    names = parse_names(response)
+
+    return [
+        {"error_type": name, "error_count": int(weights[cluster].sum())}
+        for name, cluster in zip(names, clusters)
+    ]
@@ -0,0 +1,226 @@
+import os
+import json
+import uuid
+import sqlite3
+import asyncio
+import threading
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+# Where the job table lives and how many jobs run at once
+JOBS_DB_PATH = os.environ.get("JOBS_DB_PATH", "data/jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+
+class JobDeferred(Exception):
+    """
+    Raised by a handler that is waiting on something external (e.g. a provider
+    batch) to give its worker back. The job is run again after `delay` seconds,
+    with whatever it recorded through Job.save in its params.
+    """
+
+    def __init__(self, delay: float):
+        super().__init__(f"deferred for {delay:.0f}s")
+        self.delay = delay
+
+class Job:
+    """Handle passed to a running job's handler so it can report per-stage progress and save state to resume from."""
+
+    def __init__(self, manager: "JobManager", job_id: str, params: Dict, stages: Dict[str, Dict[str, int]]):
+        self.manager = manager
+        self.id = job_id
+        self.params = params
+        self.stages = stages
+
+    def progress(self, stage: str, done: int, total: int):
+        self.stages[stage] = {"done": done, "total": total}
+        self.manager._update(self.id, stages=self.stages)
+
+    def save(self, **params):
+        """Persist `params` into the job's params, so a deferred or restarted run picks up from them."""
+        self.params.update(params)
+        self.manager._update(self.id, params=self.params)
+
+class JobManager:
+    """
+    Runs long LLM pipelines as background jobs on a bounded worker pool.
+
+    Jobs are persisted to a local SQLite table so their status survives a
+    restart; jobs that were queued or running when the process stopped are
+    queued again on start(), except running jobs of non-resumable kinds,
+    which are marked failed. Handlers are registered per job kind and receive
+    the job's params plus a Job handle for progress reporting. A handler that
+    raises JobDeferred is parked as "waiting", without holding a worker, and
+    queued again once its delay is up.
+    """
+
+    def __init__(self, db_path: str = JOBS_DB_PATH, num_workers: int = JOB_WORKERS):
+        self.db_path = db_path
+        self.num_workers = num_workers
+        self.handlers: Dict[str, Callable[[Dict, Job], Awaitable[Any]]] = {}
+        # kinds that must not run twice (e.g. they insert rows), so an interrupted run fails instead of re-running
+        self.non_resumable: set = set()
+        self.queue: asyncio.Queue = None
+        self.workers: List[asyncio.Task] = []
+        self.db_lock = threading.Lock()
+        self.db: sqlite3.Connection = None
+
+    def register(self, kind: str, handler: Callable[[Dict, Job], Awaitable[Any]], resumable: bool = True):
+        """
+        Register the handler for a job kind. Pass resumable=False for handlers
+        that are not idempotent: if one was running when the process stopped,
+        the job is marked failed on start() rather than run again.
+        """
+        self.handlers[kind] = handler
+        if not resumable:
+            self.non_resumable.add(kind)
+
+    def start(self):
+        if self.workers:
+            return
+        self._connect()
+        self.queue = asyncio.Queue()
+
+        # pick up work that was dropped by the last shutdown
+        with self.db_lock:
+            rows = self.db.execute(
+                "SELECT id, kind, status FROM jobs WHERE status IN ('queued', 'running', 'waiting') ORDER BY created_at"
+            ).fetchall()
+        requeued = 0
+        for job_id, kind, status in rows:
+            if status == "running" and kind in self.non_resumable:
+                self._update(job_id, status="failed", error="Interrupted by a restart; not retried because it may have partly written its results")
+                continue
+            self._update(job_id, status="queued")
+            self.queue.put_nowait(job_id)
+            requeued += 1
+        if requeued:
+            print(f"Re-queued {requeued} interrupted jobs")
+
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.num_workers)]
+
+    async def stop(self):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        self.workers = []
+
+    def submit(self, kind: str, params: Dict) -> str:
+        """
+        Persist a new job and queue it. Returns the job id to poll.
+
+        If an identical job (same kind and params) is already queued or running,
+        its id is returned instead of starting a duplicate.
+        """
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        self._connect()
+        params_json = json.dumps(params, sort_keys=True)
+        with self.db_lock:
+            existing = self.db.execute(
+                "SELECT id FROM jobs WHERE kind = ? AND params = ? AND status IN ('queued', 'running', 'waiting')",
+                (kind, params_json),
+            ).fetchone()
+            if existing:
+                return existing["id"]
+
+            job_id = uuid.uuid4().hex
+            now = datetime.now().isoformat()
+            self.db.execute(
+                "INSERT INTO jobs (id, kind, params, status, stages, created_at, updated_at) VALUES (?, ?, ?, 'queued', '{}', ?, ?)",
+                (job_id, kind, params_json, now, now),
+            )
+            self.db.commit()
+        if self.queue is not None:
+            self.queue.put_nowait(job_id)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        self._connect()
+        with self.db_lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def list_jobs(self, limit: int = 50) -> List[Dict]:
+        self._connect()
+        with self.db_lock:
+            rows = self.db.execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    async def _worker(self):
+        while True:
+            job_id = await self.queue.get()
+            try:
+                await self._run(job_id)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job_id: str):
+        job_data = self.get(job_id)
+        if not job_data or job_data["status"] != "queued":
+            return
+
+        handler = self.handlers.get(job_data["kind"])
+        if handler is None:
+            self._update(job_id, status="failed", error=f"Unknown job kind: {job_data['kind']}")
+            return
+
+        self._update(job_id, status="running")
+        try:
+            result = await handler(job_data["params"], Job(self, job_id, job_data["params"], job_data["stages"]))
+            self._update(job_id, status="completed", result=result)
+        except JobDeferred as deferred:
+            self._update(job_id, status="waiting")
+            asyncio.get_running_loop().call_later(deferred.delay, self._requeue, job_id)
+        except Exception as e:
+            print(f"Error in job {job_id} ({job_data['kind']}): {str(e)}")
+            self._update(job_id, status="failed", error=str(e))
+
+    def _requeue(self, job_id: str):
+        if not self.workers:
+            # stopped meanwhile; start() picks waiting jobs up again
+            return
+        self._update(job_id, status="queued")
+        self.queue.put_nowait(job_id)
+
+    def _connect(self):
+        if self.db is not None:
+            return
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stages TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        """)
+        self.db.commit()
+
+    def _update(self, job_id: str, **fields):
+        columns = {
+            key: json.dumps(value, sort_keys=True) if key == "params" else json.dumps(value) if key in ("stages", "result") else value
+            for key, value in fields.items()
+        }
+        columns["updated_at"] = datetime.now().isoformat()
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        with self.db_lock:
+            self.db.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+            self.db.commit()
+
+    def _to_dict(self, row: sqlite3.Row) -> Dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["stages"] = json.loads(job["stages"])
+        job["result"] = json.loads(job["result"]) if job["result"] is not None else None
+        return job
+
+job_manager = JobManager()
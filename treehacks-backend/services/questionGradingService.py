@@ -1,15 +1,36 @@
 import os
+import re
+import json
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from answer_utils import is_blank_answer, normalize_answer
+from llm_cache import cached_async_chat_completion
+from llm_scheduler import INTERACTIVE, current_priority
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+async_openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-async def grade_student_answer(question_id: int, question_text: str, answer_text: str, max_points: int = 1):
+# Number of student answers sent together in one batched grading request
+GRADING_BATCH_SIZE = int(os.environ.get("GRADING_BATCH_SIZE", "20"))
+
+# Cascaded grading: the cheap model's grade is kept when its confidence is at least the threshold
+CASCADE_CHEAP_MODEL = os.environ.get("CASCADE_CHEAP_MODEL", "gpt-4o-mini")
+CASCADE_STRONG_MODEL = os.environ.get("CASCADE_STRONG_MODEL", "gpt-4o")
+CASCADE_CONFIDENCE_THRESHOLD = float(os.environ.get("CASCADE_CONFIDENCE_THRESHOLD", "0.85"))
+
+# Model a slow live grading request is duplicated to; unset duplicates to the same model
+GRADING_HEDGE_MODEL = os.environ.get("GRADING_HEDGE_MODEL")
+
+# How many answers each cascade stage has settled since startup
+cascade_stats: Dict[str, int] = {"heuristic": 0, "cheap": 0, "strong": 0}
+
+async def grade_student_answer(question_id: int, question_text: str, answer_text: str, max_points: int = 1, model: str = "gpt-4o"):
     print("grading student answer")
     # openai call to score the problem (either 0 points or full points)
     prompt = f"""
@@ -21,8 +42,8 @@ async def grade_student_answer(question_id: int, question_text: str, answer_text
      representing whether the student's response is correct or not.
     """
     
-    response = openai_client.chat.completions.create(
-        model="gpt-4o",
+    response = await cached_async_chat_completion(async_openai_client,
+        model=model,
         messages=[
             {"role": "system", "content": "You are an educational assistant helping to analyze student responses."},
             {"role": "user", "content": prompt}
@@ -32,4 +53,241 @@ async def grade_student_answer(question_id: int, question_text: str, answer_text
     grade = response.choices[0].message.content
     print(grade)
     
-    return grade
\ No newline at end of file
+    return grade
+
+def parse_plain_grade(reply: str, max_points: int = 1) -> str:
+    """
+    Normalize a grade_student_answer reply such as "1 point" to the "0" /
+    "{max_points}" strings batch grading returns. Raises ValueError for a
+    reply holding neither score.
+    """
+    match = re.search(r"\d+(?:\.\d+)?", reply or "")
+    if match is None:
+        raise ValueError(f"no score in grading reply {reply!r}")
+    score = float(match.group())
+    if score == 0:
+        return "0"
+    if score == max_points:
+        return str(max_points)
+    raise ValueError(f"score {match.group()} in grading reply is neither 0 nor {max_points}")
+
+def split_into_batches(answers: List, batch_size: int = GRADING_BATCH_SIZE) -> List[List]:
+    """Split a question's answers into consecutive batches of at most `batch_size`."""
+    batch_size = max(1, batch_size)
+    return [answers[i:i + batch_size] for i in range(0, len(answers), batch_size)]
+
+async def grade_student_answers_batch(question_id: int, question_text: str, answers: List[str], max_points: int = 1) -> List[str]:
+    """
+    Grade several student answers to the same question in one structured-output request.
+
+    Returns one grade per answer, in order, as the same "0" / "{max_points}" strings
+    that grade_student_answer returns.
+    """
+    results = await score_answers_batch(question_id, question_text, answers, max_points)
+    return [result["grade"] for result in results]
+
+def build_batch_grading_request(question_text: str, answers: List[str], max_points: int = 1, model: str = "gpt-4o",
+                                reference_answer: Optional[str] = None) -> Dict:
+    """Chat completion parameters for one structured request grading and diagnosing `answers`."""
+    numbered_answers = "\n\n".join([f"Answer {i + 1}:\n{answer}" for i, answer in enumerate(answers)])
+    reference = f"\n    A reference answer is: {reference_answer}\n" if reference_answer else ""
+    prompt = f"""
+    Given this assignment question: {question_text} with a maximum of {max_points} point{'' if max_points == 1 else 's' }
+    {reference}
+    And these {len(answers)} numbered student responses:
+
+    {numbered_answers}
+
+    Grade each response independently with a numerical score of either 0 or {max_points} point{'s' if max_points != 1 else ''}
+    representing whether that student's response is correct or not, and a confidence between 0 and 1 in that score.
+    For each response that scores 0, also identify:
+    1. The main misunderstanding or misconception
+    2. Key areas where the student needs improvement
+    Keep these concise. Leave both empty for correct responses.
+    Return exactly one grade per response, in the same order.
+    """
+
+    return {
+        "model": model,
+        "messages": [
+            {"role": "system", "content": "You are an educational assistant helping to analyze student responses."},
+            {"role": "user", "content": prompt}
+        ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "batch_grades",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "grades": {
+                            "type": "array",
+                            "items": {
+                                "type": "object",
+                                "properties": {
+                                    "answer_number": {"type": "integer"},
+                                    "score": {"type": "integer", "enum": [0, max_points]},
+                                    "confidence": {"type": "number"},
+                                    "misconception": {"type": "string"},
+                                    "improvement_area": {"type": "string"}
+                                },
+                                "required": ["answer_number", "score", "confidence", "misconception", "improvement_area"],
+                                "additionalProperties": False
+                            }
+                        }
+                    },
+                    "required": ["grades"],
+                    "additionalProperties": False
+                }
+            }
+        }
+    }
+
+def parse_batch_grading_reply(content: str, num_answers: int) -> List[Dict]:
+    """
+    Parse a reply to build_batch_grading_request into one result dict per
+    answer. Raises if the reply does not grade exactly answers 1..num_answers.
+    """
+    result = json.loads(content)
+    scores = {grade["answer_number"]: grade for grade in result["grades"]}
+    if sorted(scores.keys()) != list(range(1, num_answers + 1)):
+        raise ValueError(f"expected grades for answers 1-{num_answers}, got {sorted(scores.keys())}")
+
+    results = []
+    for i in range(num_answers):
+        score = scores[i + 1]
+        wrong = score["score"] == 0
+        results.append({
+            "grade": str(score["score"]),
+            "confidence": float(score["confidence"]),
+            "misconception": (score["misconception"].strip() or None) if wrong else None,
+            "improvement_area": (score["improvement_area"].strip() or None) if wrong else None,
+        })
+    return results
+
+async def score_answers_batch(question_id: int, question_text: str, answers: List[str], max_points: int = 1,
+                              model: str = "gpt-4o", reference_answer: Optional[str] = None) -> List[Dict]:
+    """
+    Grade and diagnose several student answers to the same question in one structured-output request.
+
+    Returns one dict per answer, in order, with the grade ("0" / "{max_points}"),
+    the model's confidence in it, and for wrong answers the misconception and
+    improvement_area (None when the answer is correct).
+
+    If the model's reply is malformed the batch is split in half and each half
+    retried; a single answer that still fails falls back to grade_student_answer
+    with zero confidence and no diagnosis. Provider errors are raised, not split.
+    """
+    if not answers:
+        return []
+
+    print(f"grading {len(answers)} student answers in one batch with {model}")
+    params = build_batch_grading_request(question_text, answers, max_points, model, reference_answer)
+
+    try:
+        # live grading hedges slow provider requests (optionally to a fallback model); batch grading never does
+        interactive = current_priority.get() == INTERACTIVE
+        # a malformed reply is never cached, so splitting the batch or retrying asks the model again
+        response = await cached_async_chat_completion(async_openai_client,
+            validate=lambda response: parse_batch_grading_reply(response.choices[0].message.content, len(answers)),
+            hedge_site=f"grading:{model}" if interactive else None,
+            hedge_model=GRADING_HEDGE_MODEL if interactive else None,
+            **params
+        )
+
+        return parse_batch_grading_reply(response.choices[0].message.content, len(answers))
+
+    except (json.JSONDecodeError, KeyError, ValueError) as e:
+        if len(answers) == 1:
+            print(f"Malformed grading reply for question {question_id}, falling back to a plain grading request: {str(e)}")
+            reply = await grade_student_answer(question_id, question_text, answers[0], max_points, model)
+            return [{"grade": parse_plain_grade(reply, max_points), "confidence": 0.0, "misconception": None, "improvement_area": None}]
+
+        # split and retry so one bad reply doesn't lose the whole batch
+        print(f"Malformed batch grading reply for question {question_id}, splitting batch of {len(answers)}: {str(e)}")
+        middle = len(answers) // 2
+        first_half = await score_answers_batch(question_id, question_text, answers[:middle], max_points, model, reference_answer)
+        second_half = await score_answers_batch(question_id, question_text, answers[middle:], max_points, model, reference_answer)
+        return first_half + second_half
+
+def settle_answers_locally(answers: List[str], max_points: int = 1, reference_answer: Optional[str] = None) -> List[Optional[Dict]]:
+    """
+    Grade the answers that need no model: blank / "idk" answers score 0 and
+    answers matching the reference answer (after normalization) score full
+    points. Returns a result dict per answer, or None where a model is needed.
+    """
+    results: List[Optional[Dict]] = [None] * len(answers)
+    normalized_reference = normalize_answer(reference_answer) if reference_answer else None
+    for i, answer in enumerate(answers):
+        if is_blank_answer(answer):
+            results[i] = {
+                "grade": "0",
+                "confidence": 1.0,
+                "misconception": "Did not attempt the question",
+                "improvement_area": "Review the concept this question covers",
+            }
+        elif normalized_reference and normalize_answer(answer) == normalized_reference:
+            results[i] = {"grade": str(max_points), "confidence": 1.0, "misconception": None, "improvement_area": None}
+    return results
+
+async def grade_answers_cascade(question_id: int, question_text: str, answers: List[str], max_points: int = 1,
+                                reference_answer: Optional[str] = None) -> List[Dict]:
+    """
+    Grade and diagnose a batch of answers to one question, escalating to stronger graders only when needed.
+
+    Stage 1 settles answers locally: blank / "idk" answers score 0 and answers
+    matching the reference answer (after normalization) score full points.
+    Stage 2 grades the rest with the cheap model, keeping grades whose confidence
+    is at least CASCADE_CONFIDENCE_THRESHOLD. Stage 3 regrades the remainder
+    with the strong model. Per-stage counts accumulate in cascade_stats.
+
+    Returns one result dict per answer in the format of score_answers_batch.
+    """
+    # Stage 1: local heuristics
+    results = settle_answers_locally(answers, max_points, reference_answer)
+    heuristic_hits = sum(result is not None for result in results)
+
+    # Stage 2: cheap model with confidence
+    remaining = [i for i, result in enumerate(results) if result is None]
+    cheap_hits = 0
+    if remaining:
+        scores = await score_answers_batch(question_id, question_text, [answers[i] for i in remaining], max_points,
+                                           CASCADE_CHEAP_MODEL, reference_answer)
+        for i, result in zip(remaining, scores):
+            if result["confidence"] >= CASCADE_CONFIDENCE_THRESHOLD:
+                results[i] = result
+                cheap_hits += 1
+
+    # Stage 3: strong model for whatever is still uncertain
+    remaining = [i for i, result in enumerate(results) if result is None]
+    if remaining:
+        scores = await score_answers_batch(question_id, question_text, [answers[i] for i in remaining], max_points,
+                                           CASCADE_STRONG_MODEL, reference_answer)
+        for i, result in zip(remaining, scores):
+            results[i] = result
+
+    cascade_stats["heuristic"] += heuristic_hits
+    cascade_stats["cheap"] += cheap_hits
+    cascade_stats["strong"] += len(remaining)
+    print(f"cascade for question {question_id}: {heuristic_hits} heuristic, {cheap_hits} cheap, {len(remaining)} strong")
+    return results
+
+def format_answer_insight(result: Dict) -> Optional[str]:
+    """Answer insight summary built from a fused grading result, or None if it has no diagnosis."""
+    if not result.get("misconception"):
+        return None
+    summary = f"Main misconception: {result['misconception']}"
+    if result.get("improvement_area"):
+        summary += f"\nKey areas for improvement: {result['improvement_area']}"
+    return summary
+
+def get_cascade_stats() -> Dict:
+    """Per-stage counts and hit rates of the cascaded grader since startup."""
+    total = sum(cascade_stats.values())
+    return {
+        "total": total,
+        "counts": dict(cascade_stats),
+        "hit_rates": {stage: (count / total if total else 0.0) for stage, count in cascade_stats.items()},
+        "confidence_threshold": CASCADE_CONFIDENCE_THRESHOLD,
+    }
@@ -6,7 +6,10 @@ from openai import OpenAI
 from dotenv import load_dotenv
 from supabase import create_client, Client
 import io
-from topic_utils import categorize_question
+from topic_utils import categorize_questions
+from llm_cache import cached_chat_completion
+from prompt_budget import PromptSection, check_prompt
+from async_utils import run_blocking
 
 # Load environment variables and initialize clients
 load_dotenv()
@@ -47,6 +50,8 @@ async def split_into_questions(text: str) -> List[Dict[str, str]]:
     Returns:
         List of dictionaries containing question number and text
     """
+    # every question must be stored, so a document over budget fails instead of losing its last questions
+    check_prompt("split_into_questions", [PromptSection("document", text)], model="gpt-4o-mini")
     prompt = f"""
     Parse this problem statement document into separate questions.
     
@@ -73,7 +78,7 @@ async def split_into_questions(text: str) -> List[Dict[str, str]]:
     """
 
     try:
-        response = openai_client.chat.completions.create(
+        response = await run_blocking(cached_chat_completion, openai_client,
             model="gpt-4o-mini",
             messages=[
                 {
@@ -119,9 +124,12 @@ async def parse_and_store_questions(assignment_id: int, pdf_bytes: bytes) -> Lis
         num_questions = assignment_result.data[0].get('num_questions', 3)  # default to 3 if not specified
         class_id = assignment_result.data[0].get('class_id')
         
+        # Categorize every question into topics with a single LLM request
+        topic_ids = await run_blocking(categorize_questions, [{"text": question["text"], "explanation": ""} for question in questions], class_id)
+
         # Store each question in Supabase
         stored_questions = []
-        for question in questions:
+        for question, question_topic_ids in zip(questions, topic_ids):
             # Insert question into homework_question table
             response = supabase.table("assignment_question").insert({
                 "assignment_id": assignment_id,
@@ -132,12 +140,7 @@ async def parse_and_store_questions(assignment_id: int, pdf_bytes: bytes) -> Lis
             if response.data:
                 stored_questions.append(response.data) #maybe get [0]?
 
-            # Use LLM to categorize the question into multiple topics
-            question["topic_ids"] = categorize_question(
-                question["text"],
-                "",
-                class_id
-            )
+            question["topic_ids"] = question_topic_ids
             
             # print(response.data[0])
             question_id = response.data[0]['id']
@@ -1,11 +1,18 @@
 import os
-from typing import Dict, List
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Any, Callable, Dict, List, Optional, Tuple
 from PyPDF2 import PdfReader
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from supabase import create_client, Client
-from services.questionGradingService import grade_student_answer
+from services.questionGradingService import GRADING_BATCH_SIZE, format_answer_insight, grade_answers_cascade, split_into_batches
+from answer_utils import group_responses, normalize_answer
+from async_utils import DEFAULT_CONCURRENCY, gather_with_semaphore, run_blocking
+from services.bulkDataService import group_rows, insert_rows, select_in, upsert_rows
+from services.counterService import session_counter
+from llm_cache import cached_async_chat_completion
 
 # Load environment variables and initialize clients
 load_dotenv()
@@ -13,56 +20,207 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+async_openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
-async def grade_session(short_id: str):
+# One lock per session question so background workers and run-nlp never grade the same responses twice
+question_locks: Dict[str, asyncio.Lock] = {}
+
+async def grade_session(short_id: str, max_concurrency: int = DEFAULT_CONCURRENCY, batch_size: int = GRADING_BATCH_SIZE, on_progress: Callable[[int, int], None] = None) -> int:
     """
+    Grade the session's not-yet-graded responses and record insights for incorrect answers.
+
+    All questions draw from one cap of `max_concurrency` LLM requests in
+    flight. See grade_questions for how they are graded. If given,
+    `on_progress(done, total)` is called as each question finishes.
 
+    Returns the number of newly graded responses.
     """
     try:
-        result = supabase.table("sessions").select("id").eq("short_id", short_id).execute()
+        result = await run_blocking(supabase.table("sessions").select("id", "num_questions").eq("short_id", short_id).execute)
         session_id = result.data[0]["id"]
-        # get number of problems in session from "session" table in supabase from "num_questions" column
-        result = supabase.table("sessions").select("num_questions").eq("id", session_id).execute()
         num_questions = result.data[0]["num_questions"]
 
-        # for each question in the session:
-        for i in range(0, num_questions):
-            # get question_id, question_text from "session_questions" by session_id and question_number
-            result = supabase.table("session_questions").select("id", "question_text", "total_submission", "correct_submission").eq("session_id", session_id).eq("question_number", i).execute()
-            question_id = result.data[0]["id"]
-            question_text = result.data[0]["question_text"]
-
-            # get all student answers for the question_id from session_responses 
-            result = supabase.table("session_responses").select("response_text").eq("question_id", question_id).execute()
-            answers = [answer["response_text"] for answer in result.data]
-
-            total_submissions = 0
-            correct_submissions = 0
-
-            # for each student answer:
-            for answer in answers:
-                # call questionGradingService to grade it given the problem statement and the student's answer
-                grade = await grade_student_answer(question_id, question_text, answer)
-                total_submissions += 1
-                
-                # if incorrect, call add_session_answer_insight
-                if grade == "0":
-                    add_session_answer_insight(question_id, question_text, answer)
-                # if correct, increment correct submissions
-                if grade == "1":
-                    correct_submissions += 1
-            
-            # Update the counts after processing all answers
-            supabase.table("session_questions").update({
-                "total_submission": total_submissions,
-                "correct_submission": correct_submissions
-            }).eq("id", question_id).execute()
-    
+        # get question ids from "session_questions" by session_id
+        result = await run_blocking(supabase.table("session_questions").select("id").eq("session_id", session_id).lt("question_number", num_questions).execute)
+
+        semaphore = asyncio.Semaphore(max(1, max_concurrency))
+        return await grade_questions([question["id"] for question in result.data], semaphore=semaphore, batch_size=batch_size, on_progress=on_progress)
+
     except Exception as e:
         raise Exception(f"Error processing session: {str(e)}")
 
+async def grade_question(question_id: str, semaphore: asyncio.Semaphore = None, batch_size: int = GRADING_BATCH_SIZE) -> int:
+    """Grade a single session question's not-yet-graded responses. Returns the number newly graded."""
+    return await grade_questions([question_id], semaphore=semaphore, batch_size=batch_size)
+
+async def grade_questions(question_ids: List[str], semaphore: asyncio.Semaphore = None, batch_size: int = GRADING_BATCH_SIZE, on_progress: Callable[[int, int], None] = None) -> int:
+    """
+    Grade the not-yet-graded responses of several session questions.
+
+    Grading is incremental: each response row keeps its grade and insight once
+    graded, so re-runs only process new responses and update the question's
+    submission counts by delta. A new response whose normalized answer was
+    already graded reuses that grade and bumps the existing insight's
+    answer_count instead of calling the LLM again.
+
+    Identical new answers are graded once, in batches of `batch_size` answers
+    per LLM request, with LLM requests limited by `semaphore`.
+
+    Database traffic does not grow with the number of questions or responses:
+    questions and responses are loaded with one bulk query each, insights and
+    response grades are written back in bulk once grading is done, and
+    submission counts are applied as atomic increments through session_counter.
+
+    A question whose grading fails is logged and skipped: the other questions'
+    grades are still written, and its responses stay ungraded so the next
+    pass picks them up.
+
+    Returns the number of newly graded responses.
+    """
+    semaphore = semaphore or asyncio.Semaphore(DEFAULT_CONCURRENCY)
+    question_ids = sorted({str(question_id) for question_id in question_ids})
+
+    async with AsyncExitStack() as stack:
+        # lock in a fixed order so overlapping calls cannot deadlock
+        for question_id in question_ids:
+            await stack.enter_async_context(question_locks.setdefault(question_id, asyncio.Lock()))
+
+        # load every question (with its reference answer) and all of their responses, graded or not
+        questions = await run_blocking(select_in, "session_questions", "id, question_text, answer", "id", question_ids)
+        responses = group_rows(await run_blocking(select_in, "session_responses", "id, question_id, response_text, grade, insight_id", "question_id", question_ids), "question_id")
+
+        total = len(questions)
+        done = 0
+        failed = []
+
+        async def grade_and_report(question: Dict) -> List[Tuple[List[Dict], int, Any]]:
+            nonlocal done
+            try:
+                outcomes = await grade_question_responses(question, responses.get(str(question["id"]), []), semaphore, batch_size)
+            except Exception as e:
+                # keep the other questions' grades; this question's responses stay ungraded for the next pass
+                print(f"Error grading session question {question['id']}: {str(e)}")
+                failed.append(question["id"])
+                outcomes = []
+            done += 1
+            if on_progress:
+                on_progress(done, total)
+            return outcomes
+
+        if on_progress:
+            on_progress(0, total)
+        outcomes = await asyncio.gather(*(grade_and_report(question) for question in questions))
+        graded = await run_blocking(write_grading_outcomes, outcomes)
+        if failed:
+            print(f"Grading failed for session questions {failed}; their responses are retried on the next pass")
+
+        # update each question's counts by delta through the shared counter buffer
+        for question, question_outcomes in zip(questions, outcomes):
+            if question_outcomes:
+                session_counter.add(
+                    question["id"],
+                    sum(len(members) for members, _, _ in question_outcomes),
+                    sum(grade * len(members) for members, grade, _ in question_outcomes)
+                )
+        await session_counter.flush()
+        return graded
 
-def add_session_answer_insight(question_id: int, question_text: str, answer_text: str):
+async def grade_question_responses(question: Dict, responses: List[Dict], semaphore: asyncio.Semaphore, batch_size: int) -> List[Tuple[List[Dict], int, Any]]:
+    """
+    Grade one question's new responses without writing anything.
+
+    Returns (member rows, grade, insight) per group of identical answers, where
+    insight is None, an existing insight id, or a dict for a new insight row.
+    """
+    question_id = question["id"]
+
+    # earlier grades, keyed by normalized answer, act as a cache for new copies of the same answer
+    previous = {
+        normalize_answer(response["response_text"]): (response["grade"], response.get("insight_id"))
+        for response in responses if response.get("grade") is not None
+    }
+
+    # split new responses into groups of identical answers that still need the
+    # LLM, and groups that can reuse an earlier (grade, insight_id)
+    new_responses = [response for response in responses if response.get("grade") is None]
+    if not new_responses:
+        return []
+
+    groups_to_grade = []
+    reused = []
+    for answer, members in group_responses(new_responses):
+        if normalize_answer(answer) in previous:
+            grade, insight_id = previous[normalize_answer(answer)]
+            reused.append((members, grade, insight_id))
+        else:
+            groups_to_grade.append((answer, members))
+
+    async def grade_batch(groups: List[Tuple[str, List[Dict]]]) -> List[Tuple[int, Optional[Dict]]]:
+        # call questionGradingService to grade one representative of each group of identical answers,
+        # escalating from local checks against the reference answer to the cheap and then strong model
+        answers = [answer for answer, _ in groups]
+        results = await grade_answers_cascade(question_id, question["question_text"], answers, reference_answer=question.get("answer"))
+
+        async def record(answer: str, members: List[Dict], result: Dict) -> Tuple[int, Optional[Dict]]:
+            # if incorrect, keep the grader's diagnosis once per group, carrying its multiplicity
+            insight = None
+            if result["grade"] == "0":
+                summary = format_answer_insight(result)
+                if not summary:
+                    # the grader gave no diagnosis (plain-text fallback), so ask for one separately
+                    summary = await diagnose_session_answer(question["question_text"], answer)
+                insight = {"summary": summary, "question_id": question_id, "answer_count": len(members)}
+            return (1 if result["grade"] == "1" else 0), insight
+
+        return await asyncio.gather(*(record(answer, members, result) for (answer, members), result in zip(groups, results)))
+
+    # fan out batches of distinct new answers under the shared concurrency cap
+    batches = split_into_batches(groups_to_grade, batch_size)
+    batch_results = await gather_with_semaphore(semaphore, (grade_batch(batch) for batch in batches))
+
+    graded = [
+        (members, grade, insight)
+        for batch, results in zip(batches, batch_results)
+        for (_, members), (grade, insight) in zip(batch, results)
+    ]
+    return graded + reused
+
+def write_grading_outcomes(outcomes: List[List[Tuple[List[Dict], int, Any]]]) -> int:
+    """Write the insights and response grades from grade_question_responses back in bulk. Returns the number of graded responses."""
+    # insert all new insights at once and hand their ids to the responses they describe
+    new_insights = [insight for question_outcomes in outcomes for _, _, insight in question_outcomes if isinstance(insight, dict)]
+    inserted = insert_rows("session_answer_insight", new_insights)
+    insight_ids = {id(insight): row["id"] for insight, row in zip(new_insights, inserted)}
+
+    # reused wrong answers add their copies to the existing insight instead of a new LLM call
+    reused_insight_counts: Dict[int, int] = {}
+    for question_outcomes in outcomes:
+        for members, grade, insight in question_outcomes:
+            if grade == 0 and insight is not None and not isinstance(insight, dict):
+                reused_insight_counts[insight] = reused_insight_counts.get(insight, 0) + len(members)
+    if reused_insight_counts:
+        existing = select_in("session_answer_insight", "*", "id", list(reused_insight_counts.keys()))
+        upsert_rows("session_answer_insight", [
+            {**insight, "answer_count": (insight.get("answer_count") or 1) + reused_insight_counts[insight["id"]]}
+            for insight in existing
+        ])
+
+    # record each new response's grade and insight
+    response_rows = []
+    for question_outcomes in outcomes:
+        for members, grade, insight in question_outcomes:
+            insight_id = insight_ids[id(insight)] if isinstance(insight, dict) else insight
+            response_rows.extend({**member, "grade": grade, "insight_id": insight_id} for member in members)
+
+    upsert_rows("session_responses", response_rows)
+    return len(response_rows)
+
+
+async def add_session_answer_insight(question_id: int, question_text: str, answer_text: str, count: int = 1):
+    insight = await diagnose_session_answer(question_text, answer_text)
+    return await insert_session_answer_insight(question_id, insight, count)
+
+async def diagnose_session_answer(question_text: str, answer_text: str) -> str:
     # openai call to get what is the main misunderstanding of the problem
     prompt = f"""
     Given this quiz question: {question_text}
@@ -76,7 +234,7 @@ def add_session_answer_insight(question_id: int, question_text: str, answer_text
     Provide a concise response focusing on these points.
     """
     
-    response = openai_client.chat.completions.create(
+    response = await cached_async_chat_completion(async_openai_client,
         model="gpt-4o-mini",
         messages=[
             {"role": "system", "content": "You are an educational assistant helping to analyze student answers to a learning check."},
@@ -84,12 +242,12 @@ def add_session_answer_insight(question_id: int, question_text: str, answer_text
         ]
     )
     
-    insight = response.choices[0].message.content
+    return response.choices[0].message.content
 
+async def insert_session_answer_insight(question_id: int, summary: str, count: int = 1):
     # add to session_answer_insight table
-    response = supabase.table("session_answer_insight").insert({
-        "summary": insight,
+    return await run_blocking(supabase.table("session_answer_insight").insert({
+        "summary": summary,
         "question_id": question_id,
-    }).execute()
-    
-    return response
\ No newline at end of file
+        "answer_count": count,
+    }).execute)
@@ -4,6 +4,13 @@ from supabase import create_client, Client
 from openai import OpenAI
 from pydantic import BaseModel
 import json
+import hashlib
+from typing import Dict, List, Optional
+from services.insightClusteringService import extract_misconceptions
+from services.bulkDataService import delete_in, group_rows, insert_rows, select_in
+from async_utils import DEFAULT_CONCURRENCY, gather_with_concurrency, run_blocking
+from llm_cache import cached_chat_completion, require_text
+from prompt_budget import PromptSection, fit_prompt
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
@@ -12,72 +19,85 @@ supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 
-def publish_session_question_extracted_insight(short_id: int):
-    result = supabase.table("sessions").select("id").eq("short_id", short_id).execute()
+def answer_insights_fingerprint(insights: list) -> str:
+    """Stable fingerprint of a question's answer insights (which rows exist and how many students each covers)."""
+    entries = sorted((str(insight["id"]), insight.get("answer_count") or 1) for insight in insights)
+    return hashlib.sha256(json.dumps(entries).encode("utf-8")).hexdigest()
+
+async def publish_session_question_extracted_insight(short_id: int, max_concurrency: int = DEFAULT_CONCURRENCY, force: bool = False):
+    """
+    Rebuild the extracted insights of every session question whose answer insights
+    changed since the last run. Questions whose inputs match the stored
+    insights_fingerprint are left untouched, unless `force` is set.
+
+    All answer insights are fetched with one bulk query and stale extracted
+    insights removed with one bulk delete; the changed questions' clustering
+    and LLM calls run concurrently (at most `max_concurrency` at once), and the
+    results are written with one bulk insert. Only the fingerprint column of
+    session_questions is updated, since grading increments the same rows'
+    submission counters concurrently.
+    """
+    result = await run_blocking(supabase.table("sessions").select("id").eq("short_id", short_id).execute)
     session_id = result.data[0]["id"]
-    response = supabase.table("session_questions").select("id").eq("session_id", session_id).execute()
-    question_ids = response.data
+    response = await run_blocking(supabase.table("session_questions").select("id", "insights_fingerprint").eq("session_id", session_id).execute)
+    questions = response.data
 
-    for value in question_ids:
-        question_id = value["id"]
-        supabase.table("session_question_extracted_insight").delete().eq("question_id", question_id).execute()
-    
-    for value in question_ids:
-        question_id = value["id"]
-        answer_insight_response = supabase.table("session_answer_insight").select("*").eq("question_id", question_id).execute()
-        insights = answer_insight_response.data
+    answer_insights = await run_blocking(select_in, "session_answer_insight", "*", "question_id", [question["id"] for question in questions])
+    insights_by_question = group_rows(answer_insights, "question_id")
+
+    changed = []
+    for question in questions:
+        fingerprint = answer_insights_fingerprint(insights_by_question.get(str(question["id"]), []))
+        if not force and fingerprint == question.get("insights_fingerprint"):
+            print(f"Answer insights for question {question['id']} unchanged, skipping")
+        else:
+            changed.append((question, fingerprint))
+
+    await run_blocking(delete_in, "session_question_extracted_insight", "question_id", [question["id"] for question, _ in changed])
+
+    async def extract(question: Dict, fingerprint: str) -> Optional[List[Dict]]:
+        question_id = question["id"]
+        insights = insights_by_question.get(str(question_id), [])
         print(f"insights for question id: {question_id}: ", insights)
-        
-        if not insights:
-            continue
-            
-        all_insights = "\n".join([insight["summary"] for insight in insights])
-        
-        prompt = f"""
-        Analyze these student answer insights and identify the most common misconceptions or errors (max 3):
-        {all_insights}
-        
-        For each misconception/error, provide:
-        1. A clear description of the misconception that is under 8 words
-        2. An exact count of how many students had this misconception. There is one student for each Main Misunderstanding or Misconception and Key Areas for Improvement insight.
 
-        Return the response in the following JSON format:
-        {{"misconceptions": [
-            {{"error_type": "description of the misconception",
-             "error_count": number of answers with this misconception}}
-        ]}}
+        if not insights:
+            return []
 
-        """
-        
-        response = openai_client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are an educational analyst identifying common student misconceptions."},
-                {"role": "user", "content": prompt}
-            ],
-            response_format= { "type": "json_object" },
-        )
-        
         try:
-            response_content = json.loads(response.choices[0].message.content)
-            misconceptions = [response_content.get("misconceptions", [])[0]]
-            print(f"Response for question {question_id}: ", response_content)
+            # cluster the answer insights locally (weighted by answer_count) and only ask the LLM to name the top one
+            misconceptions = await run_blocking(extract_misconceptions, insights, max_misconceptions=1, force=force)
             print(f"Extracted misconceptions: ", misconceptions)
-            
-            for misconception in misconceptions:
-                supabase.table("session_question_extracted_insight").insert({
-                    "question_id": question_id,
-                    "error_summary": misconception["error_type"],
-                    "error_count": misconception["error_count"],
-                }).execute()
-                
         except Exception as e:
             print(f"Error processing question {question_id}: {str(e)}")
-            continue
+            return None
+
+        return [
+            {
+                "question_id": question_id,
+                "error_summary": misconception["error_type"],
+                "error_count": misconception["error_count"],
+            }
+            for misconception in misconceptions
+        ]
+
+    extracted = await gather_with_concurrency(max_concurrency, (extract(question, fingerprint) for question, fingerprint in changed))
+    await run_blocking(insert_rows, "session_question_extracted_insight", [row for rows in extracted if rows for row in rows])
+
+    # only questions that were processed successfully record their new fingerprint, so failures are retried next run
+    await gather_with_concurrency(max_concurrency, (
+        run_blocking(supabase.table("session_questions").update({"insights_fingerprint": fingerprint}).eq("id", question["id"]).execute)
+        for (question, fingerprint), rows in zip(changed, extracted) if rows is not None
+    ))
     
     return "Question insights published successfully"
 
-def publish_session_summary(short_id: int):
+def publish_session_summary(short_id: int, force: bool = False):
+    """
+    Write the quiz-level summary of the session's extracted question insights.
+    The gpt-4o call is skipped when the input insights hash to the
+    insights_hash stored with the current summary; `force` regenerates anyway,
+    bypassing a cached reply.
+    """
     result = supabase.table("sessions").select("id").eq("short_id", short_id).execute()
     session_id = result.data[0]["id"]
     # Get questions with their problem numbers
@@ -85,21 +105,28 @@ def publish_session_summary(short_id: int):
     question_map = {q["id"]: q["question_number"] for q in questions_response.data}
     question_ids = list(question_map.keys())
     
-    all_insights = []
-    for qid in question_ids:
-        insights_response = supabase.table("session_question_extracted_insight").select("*").eq("question_id", qid).execute()
-        # Add problem_number to each insight
-        for insight in insights_response.data:
-            insight["question_number"] = question_map[qid]
-        all_insights.extend(insights_response.data)
+    all_insights = select_in("session_question_extracted_insight", "*", "question_id", question_ids)
+    # Add problem_number to each insight
+    for insight in all_insights:
+        insight["question_number"] = question_map[insight["question_id"]]
     
     if not all_insights:
         return "No insights found for this session"
     
+    # order insights so the same set always gives the same prompt and hash
+    all_insights.sort(key=lambda insight: (insight["question_number"] or 0, insight["error_summary"] or "", insight["error_count"] or 0))
     insights_text = ""
     for insight in all_insights:
         insights_text += f"Problem {insight['question_number']}: {insight['error_summary']} (Found in {insight['error_count']} responses)\n"
     
+    insights_hash = hashlib.sha256(insights_text.encode("utf-8")).hexdigest()
+    existing_insight = supabase.table("session_insight").select("*").eq("session_id", session_id).execute()
+    if not force and existing_insight.data and existing_insight.data[0].get("insights_hash") == insights_hash:
+        return "Session summary unchanged, skipped"
+
+    # a quiz with too many insights for the budget loses whole lines from the end of the prompt
+    insights_text = fit_prompt("session_summary", [PromptSection("insights", insights_text)])["insights"]
+
     prompt = f"""
     Analyze these question-level insights from a learning check quiz and create a comprehensive summary:
     
@@ -112,7 +139,9 @@ def publish_session_summary(short_id: int):
     Format your response in a clear, simple, very concise way that would be helpful for an instructor. Don't leave any additional comments.
     """
     
-    response = openai_client.chat.completions.create(
+    response = cached_chat_completion(openai_client,
+        cache=not force,
+        validate=require_text,
         model="gpt-4o",
         messages=[
             {"role": "system", "content": "You are an educational analyst creating quiz-level summaries from question-level insights."},
@@ -123,17 +152,17 @@ def publish_session_summary(short_id: int):
     summary = response.choices[0].message.content
     
     try:
-        existing_insight = supabase.table("session_insight").select("*").eq("session_id", session_id).execute()
-            
         if existing_insight.data:
             supabase.table("session_insight").update({
                 "summary": summary,
+                "insights_hash": insights_hash,
             }).eq("session_id", session_id).execute()
             return "Session summary updated successfully"
         else:
             supabase.table("session_insight").insert({
                 "session_id": session_id,
                 "summary": summary,
+                "insights_hash": insights_hash,
             }).execute()
             return "Session summary published successfully"
     except Exception as e:
@@ -1,10 +1,15 @@
 import os
-from typing import Dict, List
+import io
+import zipfile
+import shutil
+from typing import BinaryIO, Dict, Iterator, List, Tuple
 from PyPDF2 import PdfReader
 import json
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
 from supabase import create_client, Client
+from llm_cache import cached_async_chat_completion
+from prompt_budget import PromptSection, check_prompt
 
 # Load environment variables and initialize clients
 load_dotenv()
@@ -12,6 +17,7 @@ url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 openai_client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+async_openai_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
 
 def extract_text_from_pdf(pdf_path: str) -> str:
     """Extract text content from a PDF file."""
@@ -25,6 +31,65 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     except Exception as e:
         raise Exception(f"Error extracting text from PDF: {str(e)}")
 
+def extract_text_from_pdf_bytes(pdf_bytes: bytes) -> str:
+    """Extract text content from an in-memory PDF. Picklable, so it can run in a process pool."""
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        return "".join(page.extract_text() for page in reader.pages)
+    except Exception as e:
+        raise Exception(f"Error extracting text from PDF: {str(e)}")
+
+def list_pdf_entries(archive: zipfile.ZipFile) -> List[zipfile.ZipInfo]:
+    """List the PDFs in a zip of student submissions, skipping directories and macOS resource forks."""
+    return [
+        info for info in archive.infolist()
+        if not info.is_dir()
+        and not info.filename.startswith("__MACOSX/")
+        and not os.path.basename(info.filename).startswith("._")
+        and info.filename.lower().endswith(".pdf")
+    ]
+
+def iter_pdf_entries(archive: zipfile.ZipFile) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (file name, PDF bytes) for each PDF in a zip of student submissions.
+
+    Entries are decompressed one at a time, in memory, as the iterator is
+    advanced; nothing is extracted to disk.
+    """
+    for info in list_pdf_entries(archive):
+        yield info.filename, archive.read(info)
+
+def iter_submission_files(files: List[Tuple[str, BinaryIO]]) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yield (file name, PDF bytes) for a batch of uploaded files, each either a
+    single PDF or a zip of PDFs, reading one PDF into memory at a time.
+    """
+    for name, file in files:
+        if name.lower().endswith(".zip"):
+            with zipfile.ZipFile(file) as archive:
+                for entry_name, pdf_bytes in iter_pdf_entries(archive):
+                    yield f"{name}/{entry_name}", pdf_bytes
+        else:
+            yield name, file.read()
+
+def pack_submission_archive(files: List[Tuple[str, BinaryIO]], archive_path: str):
+    """
+    Write a batch of uploaded PDFs and zips of PDFs into one uncompressed zip at
+    `archive_path`, copying entries stream to stream, so a background job can
+    grade them later.
+    """
+    os.makedirs(os.path.dirname(archive_path) or ".", exist_ok=True)
+    with zipfile.ZipFile(archive_path, "w", zipfile.ZIP_STORED) as packed:
+        for name, file in files:
+            if name.lower().endswith(".zip"):
+                with zipfile.ZipFile(file) as archive:
+                    for info in list_pdf_entries(archive):
+                        with archive.open(info) as source, packed.open(f"{name}/{info.filename}", "w", force_zip64=True) as target:
+                            shutil.copyfileobj(source, target)
+            else:
+                with packed.open(name, "w", force_zip64=True) as target:
+                    shutil.copyfileobj(file, target)
+
 async def split_into_answers(text: str) -> List[Dict[str, str]]:
     """
     Use GPT-4 to split text into individual answers.
@@ -35,6 +100,8 @@ async def split_into_answers(text: str) -> List[Dict[str, str]]:
     Returns:
         List of dictionaries containing answer number and text
     """
+    # every answer must be graded, so a submission over budget fails (and is reported per file) instead of losing its last answers
+    check_prompt("split_into_answers", [PromptSection("document", text)], model="gpt-4o-mini")
     prompt = f"""
     Parse this student homework document into separate answers.
     
@@ -61,7 +128,7 @@ async def split_into_answers(text: str) -> List[Dict[str, str]]:
     """
     print("splitting answers")
     try:
-        response = openai_client.chat.completions.create(
+        response = await cached_async_chat_completion(async_openai_client,
             model="gpt-4o-mini",
             messages=[
                 {
@@ -0,0 +1,214 @@
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+from typing import Dict, Tuple
+import requests
+import PIL.Image
+from pdf_render import SLIDE_RENDER_DPI, SLIDE_RENDER_SIZE, count_pdf_pages, render_pdf_pages
+from drive_utils import convert_drive_link_to_direct_download
+
+# Where downloaded slide decks and rasterized pages live, and how much disk they may use
+SLIDE_CACHE_DIR = os.environ.get("SLIDE_CACHE_DIR", "data/slide_cache")
+SLIDE_CACHE_MAX_BYTES = int(os.environ.get("SLIDE_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+# How long a slides URL is trusted to point at the same deck before it is revalidated
+SLIDE_URL_TTL = float(os.environ.get("SLIDE_URL_TTL", "300"))
+# Rasterized pages are stored compressed; JPEG keeps slide text legible at a fraction of the raw size
+SLIDE_IMAGE_FORMAT = os.environ.get("SLIDE_IMAGE_FORMAT", "JPEG")
+SLIDE_IMAGE_QUALITY = int(os.environ.get("SLIDE_IMAGE_QUALITY", "85"))
+DOWNLOAD_TIMEOUT = 60
+
+class SlideCache:
+    """
+    Content-addressed, on-disk cache of lecture slide decks and their pages.
+
+    A slides URL resolves to the SHA-256 digest of the PDF it serves. The URL
+    is revalidated with its ETag (or re-downloaded and re-hashed when the
+    server sends none) at most every SLIDE_URL_TTL seconds, so an edited deck
+    gets a new digest while an unchanged one is never fetched twice. Each page
+    is rasterized the first time it is asked for and stored as a compressed
+    image under the deck's digest, so every session on the same deck shares
+    it. Decks and pages are evicted least recently used first once they take
+    up more than `max_bytes`.
+    """
+
+    def __init__(self, directory: str = SLIDE_CACHE_DIR, max_bytes: int = SLIDE_CACHE_MAX_BYTES, url_ttl: float = SLIDE_URL_TTL):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.url_ttl = url_ttl
+        self.db_lock = threading.Lock()
+        self.db: sqlite3.Connection = None
+        self.total_bytes = 0
+        # one lock per deck or page so concurrent sessions download or render it once
+        self.key_locks: Dict[str, threading.Lock] = {}
+        self.metrics = {"page_hits": 0, "page_renders": 0, "downloads": 0, "not_modified": 0, "url_hits": 0}
+
+    def page_count(self, slides_url: str) -> int:
+        return self.resolve(slides_url)[1]
+
+    def get_page(self, slides_url: str, page: int) -> PIL.Image.Image:
+        """Page `page` (0-based) of the deck at `slides_url`, rasterized on first use."""
+        digest, page_count = self.resolve(slides_url)
+        if not 0 <= page < page_count:
+            raise IndexError(f"Slide {page} out of range for a {page_count} page deck")
+
+        path = self._page_path(digest, page)
+        with self._key_lock(path):
+            if self._touch(path):
+                self._count("page_hits")
+            else:
+                image = self._render(digest, page)
+                self._write_file(path, lambda f: image.save(f, format=SLIDE_IMAGE_FORMAT, quality=SLIDE_IMAGE_QUALITY))
+                self._count("page_renders")
+            with PIL.Image.open(path) as image:
+                image.load()
+                return image.convert("RGB")
+
+    def resolve(self, slides_url: str) -> Tuple[str, int]:
+        """The digest and page count of the deck currently served at `slides_url`, downloading it if needed."""
+        self._connect()
+        with self._key_lock(slides_url):
+            with self.db_lock:
+                row = self.db.execute("SELECT etag, digest, page_count, checked_at FROM slide_urls WHERE url = ?", (slides_url,)).fetchone()
+            etag, digest, page_count, checked_at = row if row else (None, None, 0, 0)
+            cached = digest is not None and self._touch(self._deck_path(digest))
+            if cached and time.time() - checked_at < self.url_ttl:
+                self._count("url_hits")
+                return digest, page_count
+
+            download_url = slides_url
+            if 'drive.google.com' in download_url:
+                download_url = convert_drive_link_to_direct_download(download_url)
+            headers = {"If-None-Match": etag} if cached and etag else {}
+            response = requests.get(download_url, headers=headers, timeout=DOWNLOAD_TIMEOUT)
+            if response.status_code == 304:
+                self._count("not_modified")
+            elif response.status_code != 200:
+                raise ValueError(f"Failed to download PDF: HTTP {response.status_code}")
+            else:
+                self._count("downloads")
+                etag = response.headers.get("ETag")
+                digest = hashlib.sha256(response.content).hexdigest()
+                deck_path = self._deck_path(digest)
+                if not self._touch(deck_path):
+                    self._write_file(deck_path, lambda f: f.write(response.content))
+                page_count = count_pdf_pages(response.content)
+
+            with self.db_lock:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO slide_urls (url, etag, digest, page_count, checked_at) VALUES (?, ?, ?, ?, ?)",
+                    (slides_url, etag, digest, page_count, time.time()),
+                )
+                self.db.commit()
+            return digest, page_count
+
+    def stats(self) -> Dict:
+        self._connect()
+        with self.db_lock:
+            files = self.db.execute("SELECT COUNT(*) FROM slide_files").fetchone()[0]
+        return {"files": files, "bytes": self.total_bytes, "max_bytes": self.max_bytes, **self.metrics}
+
+    def _render(self, digest: str, page: int) -> PIL.Image.Image:
+        with open(self._deck_path(digest), "rb") as f:
+            return render_pdf_pages(f.read(), page + 1)[0]
+
+    def _deck_path(self, digest: str) -> str:
+        return os.path.join(self.directory, "decks", f"{digest}.pdf")
+
+    def _page_path(self, digest: str, page: int) -> str:
+        # render settings are part of the key so changing them never serves stale pages
+        settings = f"{SLIDE_RENDER_DPI}dpi-{SLIDE_RENDER_SIZE or 'full'}"
+        return os.path.join(self.directory, "pages", digest, settings, f"{page}.{SLIDE_IMAGE_FORMAT.lower()}")
+
+    def _key_lock(self, key: str) -> threading.Lock:
+        with self.db_lock:
+            return self.key_locks.setdefault(key, threading.Lock())
+
+    def _touch(self, path: str) -> bool:
+        """Mark a cached file as just used. Returns False if it is not cached."""
+        self._connect()
+        with self.db_lock:
+            cursor = self.db.execute("UPDATE slide_files SET last_used = ? WHERE path = ?", (time.time(), path))
+            self.db.commit()
+            if cursor.rowcount and os.path.exists(path):
+                return True
+            if cursor.rowcount:
+                # removed from disk behind our back
+                self._forget(path)
+                self.db.commit()
+            return False
+
+    def _write_file(self, path: str, write):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # written under a unique temp name and renamed, so readers never see a partial file
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as f:
+            write(f)
+        os.replace(temp_path, path)
+        size = os.path.getsize(path)
+        with self.db_lock:
+            self._forget(path)
+            self.db.execute("INSERT INTO slide_files (path, size, last_used) VALUES (?, ?, ?)", (path, size, time.time()))
+            self.total_bytes += size
+            if self.total_bytes > self.max_bytes:
+                self._evict(keep=path)
+            self.db.commit()
+
+    def _evict(self, keep: str):
+        # least recently used files until back under 90% of the budget
+        target = self.max_bytes * 0.9
+        evicted = []
+        for path, size in self.db.execute("SELECT path, size FROM slide_files ORDER BY last_used"):
+            if self.total_bytes <= target:
+                break
+            if path == keep:
+                continue
+            evicted.append(path)
+            self.total_bytes -= size
+        for path in evicted:
+            self.db.execute("DELETE FROM slide_files WHERE path = ?", (path,))
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _forget(self, path: str):
+        size = self.db.execute("SELECT size FROM slide_files WHERE path = ?", (path,)).fetchone()
+        if size:
+            self.db.execute("DELETE FROM slide_files WHERE path = ?", (path,))
+            self.total_bytes -= size[0]
+
+    def _count(self, metric: str):
+        with self.db_lock:
+            self.metrics[metric] += 1
+
+    def _connect(self):
+        if self.db is not None:
+            return
+        with self.db_lock:
+            if self.db is not None:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            db = sqlite3.connect(os.path.join(self.directory, "index.db"), check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS slide_urls (
+                    url TEXT PRIMARY KEY,
+                    etag TEXT,
+                    digest TEXT NOT NULL,
+                    page_count INTEGER NOT NULL,
+                    checked_at REAL NOT NULL
+                )
+            """)
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS slide_files (
+                    path TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            db.execute("CREATE INDEX IF NOT EXISTS slide_files_last_used ON slide_files (last_used)")
+            db.commit()
+            self.total_bytes = db.execute("SELECT COALESCE(SUM(size), 0) FROM slide_files").fetchone()[0]
+            self.db = db
+
+slide_cache = SlideCache()
@@ -1,7 +1,7 @@
 import os
 import cv2
 import numpy as np
-from pdf2image import convert_from_path
+from pdf_render import count_pdf_pages, render_pdf_pages
 import pytesseract
 from typing import List, Dict, Tuple
 import json
@@ -82,10 +82,13 @@ def extract_slides_text(pdf_path: str) -> List[str]:
         List of text content from each slide
     """
     print("Converting PDF slides to text...")
-    images = convert_from_path(pdf_path)
+    with open(pdf_path, "rb") as f:
+        pdf_bytes = f.read()
     slides_text = []
     
-    for i, image in enumerate(images):
+    # render one page at a time so only a single slide image is in memory
+    for page in range(1, count_pdf_pages(pdf_bytes) + 1):
+        image = render_pdf_pages(pdf_bytes, page)[0]
         # Convert PIL image to numpy array
         np_image = np.array(image)
         text = extract_text_from_image(np_image)
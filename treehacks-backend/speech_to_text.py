@@ -5,6 +5,7 @@ from datetime import datetime
 from openai import OpenAI
 from video_utils import extract_audio
 from dotenv import load_dotenv
+from llm_scheduler import llm_scheduler
 
 # Load environment variables
 load_dotenv()
@@ -35,12 +36,17 @@ def transcribe_with_timestamps(video_path: str, test_mode: bool = False) -> Opti
             
         print("Transcribing with OpenAI Whisper API...")
         with open(audio_path, 'rb') as audio_file:
-            response = client.audio.transcriptions.create(
-                model="whisper-1",
-                file=audio_file,
-                response_format="verbose_json",
-                timestamp_granularities=["word", "segment"]
-            )
+            def transcribe():
+                # rewind so a retried request uploads the whole file again
+                audio_file.seek(0)
+                return client.audio.transcriptions.create(
+                    model="whisper-1",
+                    file=audio_file,
+                    response_format="verbose_json",
+                    timestamp_granularities=["word", "segment"]
+                )
+
+            response = llm_scheduler.call("openai:whisper-1", transcribe, tokens=0)
             
             # Convert response to dictionary
             response_dict = dict(response)
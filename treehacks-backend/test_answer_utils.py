@@ -0,0 +1,24 @@
+from answer_utils import normalize_answer, group_answers, is_blank_answer
+
+def test_normalize_answer():
+    assert normalize_answer("O(n log n)") == normalize_answer("o(n  log n).")
+    assert normalize_answer("(13!) ** 4") == normalize_answer("13! ^ 4") == "13!^4"
+    assert normalize_answer(' "True" ') == normalize_answer("true.") == "true"
+    # factorial and function-call parentheses are kept
+    assert normalize_answer("13!") == "13!"
+    assert normalize_answer("f(x) = 2x") == "f(x)=2x"
+
+def test_group_answers():
+    groups = group_answers(["True", "false", "true.", "O(n log n)", "o(n log n)", "TRUE"])
+    assert groups == [("True", 3), ("false", 1), ("O(n log n)", 2)]
+
+def test_is_blank_answer():
+    assert all(is_blank_answer(answer) for answer in ["", "   ", "IDK", "I don't know.", "no idea!", "?"])
+    assert not any(is_blank_answer(answer) for answer in ["none", "0", "13!", "true"])
+
+# Run the test
+if __name__ == "__main__":
+    test_normalize_answer()
+    test_group_answers()
+    test_is_blank_answer()
+    print("Successfully completed")
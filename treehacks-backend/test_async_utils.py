@@ -0,0 +1,69 @@
+import asyncio
+from async_utils import SingleFlight
+
+def test_single_flight_coalesces():
+    flights = SingleFlight(ttl=60)
+    runs = []
+
+    async def work(value):
+        runs.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def main():
+        results = await asyncio.gather(*(flights.run("key", work, 1) for _ in range(3)), flights.run("other", work, 2))
+        assert results == [2, 2, 2, 4]
+        # a finished result is reused within the ttl
+        assert await flights.run("key", work, 1) == 2
+        assert not flights.in_flight
+
+    asyncio.run(main())
+    assert runs == [1, 2]
+
+def test_single_flight_errors_are_not_kept():
+    flights = SingleFlight(ttl=60)
+    runs = []
+
+    async def fail():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        results = await asyncio.gather(flights.run("key", fail), flights.run("key", fail), return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        # a failure is shared by the callers waiting on it, but the next call runs again
+        try:
+            await flights.run("key", fail)
+            assert False, "expected the call to fail again"
+        except ValueError:
+            pass
+
+    asyncio.run(main())
+    assert runs == [1, 1]
+
+def test_single_flight_cancelled_caller():
+    flights = SingleFlight(ttl=0)
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def main():
+        # cancelling the caller that started the call leaves it running for the others
+        leader = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(flights.run("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        assert await follower == "done"
+        assert leader.cancelled()
+
+    asyncio.run(main())
+
+# Run the test
+if __name__ == "__main__":
+    test_single_flight_coalesces()
+    test_single_flight_errors_are_not_kept()
+    test_single_flight_cancelled_caller()
+    print("Successfully completed")
@@ -0,0 +1,28 @@
+import numpy as np
+from cluster_utils import cluster_embeddings
+
+def test_cluster_embeddings():
+    embeddings = np.array([
+        [1.0, 0.0, 0.0],
+        [0.0, 1.0, 0.0],
+        [0.95, 0.05, 0.0],
+        [0.0, 0.98, 0.1],
+        [0.0, 0.0, 1.0],
+    ])
+    clusters = cluster_embeddings(embeddings, threshold=0.9)
+    assert sorted(sorted(cluster) for cluster in clusters) == [[0, 2], [1, 3], [4]]
+
+    # weights decide cluster order, and the result is the same on every run
+    weights = np.array([1, 5, 1, 1, 1])
+    clusters = cluster_embeddings(embeddings, weights, threshold=0.9)
+    assert clusters[0][0] == 1
+    assert clusters == cluster_embeddings(embeddings, weights, threshold=0.9)
+
+def test_cluster_embeddings_empty():
+    assert cluster_embeddings(np.zeros((0, 3))) == []
+
+# Run the test
+if __name__ == "__main__":
+    test_cluster_embeddings()
+    test_cluster_embeddings_empty()
+    print("Successfully completed")
@@ -0,0 +1,84 @@
+import os
+import asyncio
+import tempfile
+from services.jobService import JobDeferred, JobManager
+
+async def wait_for(manager, job_id, status):
+    for _ in range(200):
+        job = manager.get(job_id)
+        if job["status"] == status:
+            return job
+        await asyncio.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {manager.get(job_id)['status']}, expected {status}")
+
+def test_restart():
+    with tempfile.TemporaryDirectory() as directory:
+        db_path = os.path.join(directory, "jobs.db")
+
+        async def hang(params, job):
+            job.progress("work", 1, 2)
+            await asyncio.Event().wait()
+
+        async def finish(params, job):
+            job.progress("work", 2, 2)
+            return {"value": params["value"]}
+
+        async def first_run():
+            manager = JobManager(db_path, num_workers=2)
+            manager.register("resumable", hang)
+            manager.register("one-shot", hang, resumable=False)
+            manager.start()
+            ids = manager.submit("resumable", {"value": 1}), manager.submit("one-shot", {"value": 2})
+            # an identical job that is still pending is not submitted twice
+            assert manager.submit("resumable", {"value": 1}) == ids[0]
+            for job_id in ids:
+                await wait_for(manager, job_id, "running")
+            await manager.stop()
+            return ids
+
+        async def second_run(ids):
+            manager = JobManager(db_path, num_workers=2)
+            manager.register("resumable", finish)
+            manager.register("one-shot", finish, resumable=False)
+            manager.start()
+            # the resumable job runs again; the other may have partly written its results, so it is failed
+            resumed = await wait_for(manager, ids[0], "completed")
+            assert resumed["result"] == {"value": 1}
+            assert resumed["stages"] == {"work": {"done": 2, "total": 2}}
+            failed = await wait_for(manager, ids[1], "failed")
+            assert "Interrupted by a restart" in failed["error"]
+            await manager.stop()
+
+        asyncio.run(second_run(asyncio.run(first_run())))
+
+def test_deferred_resume():
+    with tempfile.TemporaryDirectory() as directory:
+        runs = []
+
+        async def poll(params, job):
+            runs.append(params.get("checkpoint"))
+            if params.get("checkpoint") is None:
+                # record where to pick up, then give the worker back
+                job.save(checkpoint="submitted")
+                raise JobDeferred(0.05)
+            return {"checkpoint": params["checkpoint"]}
+
+        async def main():
+            manager = JobManager(os.path.join(directory, "jobs.db"), num_workers=1)
+            manager.register("poll", poll)
+            manager.start()
+            job_id = manager.submit("poll", {})
+            waiting = await wait_for(manager, job_id, "waiting")
+            assert waiting["params"] == {"checkpoint": "submitted"}
+            completed = await wait_for(manager, job_id, "completed")
+            assert completed["result"] == {"checkpoint": "submitted"}
+            await manager.stop()
+
+        asyncio.run(main())
+        assert runs == [None, "submitted"]
+
+# Run the test
+if __name__ == "__main__":
+    test_restart()
+    test_deferred_resume()
+    print("Successfully completed")
@@ -0,0 +1,36 @@
+import os
+import json
+import asyncio
+import tempfile
+from llm_batch import LocalBatchBackend, completion_text, make_batch_request, wait_for_batch, write_batch_file
+
+def echo(body):
+    # answers every request with its last message, and fails requests that ask it to
+    content = body["messages"][-1]["content"]
+    if content == "fail":
+        raise ValueError("asked to fail")
+    return {"choices": [{"message": {"role": "assistant", "content": content.upper()}}]}
+
+def test_local_batch_backend():
+    with tempfile.TemporaryDirectory() as directory:
+        backend = LocalBatchBackend(os.path.join(directory, "batches"), responder=echo)
+        input_path = os.path.join(directory, "input.jsonl")
+        write_batch_file(input_path, [
+            make_batch_request(f"req-{i}", {"model": "gpt-4o", "messages": [{"role": "user", "content": content}]})
+            for i, content in enumerate(["hello", "fail", "world"])
+        ])
+        with open(input_path) as f:
+            assert [json.loads(line)["url"] for line in f] == ["/v1/chat/completions"] * 3
+
+        batch_id = backend.submit(input_path)
+        assert asyncio.run(wait_for_batch(backend, batch_id, poll_interval=0)) == "completed"
+        results = backend.results(batch_id)
+        assert sorted(results) == ["req-0", "req-1", "req-2"]
+        assert completion_text(results["req-0"]) == "HELLO"
+        assert completion_text(results["req-1"]) is None
+        assert completion_text(results["req-2"]) == "WORLD"
+
+# Run the test
+if __name__ == "__main__":
+    test_local_batch_backend()
+    print("Successfully completed")
@@ -0,0 +1,75 @@
+import os
+import time
+import tempfile
+from types import SimpleNamespace
+from openai.types.chat import ChatCompletion
+import llm_cache as llm_cache_module
+from llm_cache import LLMCache, cached_chat_completion, cached_generate_content, require_text
+
+def make_completion(content):
+    return ChatCompletion.model_validate({
+        "id": "test", "object": "chat.completion", "created": 0, "model": "gpt-4o",
+        "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+    })
+
+class FakeClient:
+    """Sync OpenAI client stand-in that answers with `replies` in order and counts requests."""
+
+    def __init__(self, replies):
+        self.replies = list(replies)
+        self.requests = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **params):
+        self.requests += 1
+        return make_completion(self.replies.pop(0))
+
+def test_ttl():
+    with tempfile.TemporaryDirectory() as directory:
+        cache = LLMCache(os.path.join(directory, "cache.db"), ttl=60)
+        cache.set("a", "first")
+        cache.set("b", "second", ttl=0.05)
+        assert cache.get("a", "test") == "first"
+        assert cache.get("b", "test") == "second"
+        time.sleep(0.1)
+        # only the entry with the short ttl has expired
+        assert cache.get("a", "test") == "first"
+        assert cache.get("b", "test") is None
+        assert cache.stats()["by_model"]["test"] == {"hits": 3, "misses": 1}
+
+def test_validate():
+    with tempfile.TemporaryDirectory() as directory:
+        original = llm_cache_module.llm_cache
+        llm_cache_module.llm_cache = LLMCache(os.path.join(directory, "cache.db"))
+        try:
+            params = {"model": "gpt-4o", "messages": [{"role": "user", "content": "hello"}]}
+            client = FakeClient(["", "hi"])
+            # a rejected reply is raised and not cached, so the next call asks again
+            try:
+                cached_chat_completion(client, validate=require_text, **params)
+                assert False, "expected the empty reply to be rejected"
+            except ValueError:
+                pass
+            assert cached_chat_completion(client, validate=require_text, **params).choices[0].message.content == "hi"
+            assert cached_chat_completion(client, validate=require_text, **params).choices[0].message.content == "hi"
+            assert client.requests == 2
+
+            # a cached reply that no longer validates is dropped and fetched again
+            model = SimpleNamespace(model_name="gemini-test", generate_content=lambda contents, **params: SimpleNamespace(text="fresh"))
+            assert cached_generate_content(model, ["question"]).text == "fresh"
+            model.generate_content = lambda contents, **params: SimpleNamespace(text="better")
+
+            def reject_fresh(response):
+                if response.text == "fresh":
+                    raise ValueError("stale reply")
+
+            assert cached_generate_content(model, ["question"], validate=reject_fresh).text == "better"
+            assert cached_generate_content(model, ["question"]).text == "better"
+        finally:
+            llm_cache_module.llm_cache = original
+
+# Run the test
+if __name__ == "__main__":
+    test_ttl()
+    test_validate()
+    print("Successfully completed")
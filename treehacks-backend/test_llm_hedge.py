@@ -0,0 +1,69 @@
+import time
+import asyncio
+import threading
+import llm_hedge
+from llm_hedge import CallSiteStats, call_site_stats, hedged, hedged_sync
+
+def fast_deadline(call_site):
+    # hedge after 10ms instead of the call site's latency percentile
+    stats = call_site_stats[call_site] = CallSiteStats()
+    stats.deadline = lambda percentile: 0.01
+    return stats
+
+def test_hedged():
+    stats = fast_deadline("test-async")
+    cancelled = []
+
+    async def slow():
+        try:
+            await asyncio.sleep(1)
+            return "primary"
+        except asyncio.CancelledError:
+            cancelled.append("primary")
+            raise
+
+    async def fast():
+        return "hedge"
+
+    async def quick():
+        return "primary"
+
+    assert asyncio.run(hedged("test-async", quick, hedge=fast)) == "primary"
+    assert asyncio.run(hedged("test-async", slow, hedge=fast)) == "hedge"
+    # the losing primary is cancelled
+    assert cancelled == ["primary"]
+    assert stats.hedges == 1 and stats.hedge_wins == 1
+
+    # calls that may not hedge neither hedge nor record latencies
+    assert asyncio.run(hedged("test-async", quick, hedge=fast, enabled=False)) == "primary"
+    assert stats.calls == 2
+
+def test_hedged_sync():
+    stats = fast_deadline("test-sync")
+    assert hedged_sync("test-sync", lambda: (time.sleep(0.2), "primary")[1], hedge=lambda: "hedge") == "hedge"
+    assert stats.hedges == 1 and stats.hedge_wins == 1
+
+    # with every hedge thread held by an abandoned loser, the primary runs unhedged on the caller's thread
+    original = llm_hedge._hedge_slots
+    llm_hedge._hedge_slots = threading.BoundedSemaphore(1)
+    llm_hedge._hedge_slots.acquire()
+    try:
+        caller = threading.current_thread()
+        assert hedged_sync("test-sync", lambda: (time.sleep(0.05), threading.current_thread() is caller)[1], hedge=lambda: False)
+    finally:
+        llm_hedge._hedge_slots = original
+    assert stats.hedges == 1 and stats.calls == 2
+
+    # with one thread free, the primary gets it and the hedge is not sent
+    llm_hedge._hedge_slots = threading.BoundedSemaphore(1)
+    try:
+        assert hedged_sync("test-sync", lambda: (time.sleep(0.05), "primary")[1], hedge=lambda: "hedge") == "primary"
+    finally:
+        llm_hedge._hedge_slots = original
+    assert stats.hedges == 1 and stats.calls == 3
+
+# Run the test
+if __name__ == "__main__":
+    test_hedged()
+    test_hedged_sync()
+    print("Successfully completed")
@@ -0,0 +1,83 @@
+import asyncio
+from llm_scheduler import BATCH, INTERACTIVE, LLMScheduler, RateLimit, llm_priority
+
+def empty_scheduler(model_key, rpm):
+    # a scheduler whose only model has spent its request budget, so every request has to wait for a refill
+    scheduler = LLMScheduler()
+    limit = scheduler._limit(model_key)
+    limit.rpm = rpm
+    limit.requests = 0
+    return scheduler
+
+def test_token_refill():
+    limit = RateLimit(rpm=60, tpm=600)
+    limit.updated = 0
+    assert limit.try_acquire(500, now=0) == 0
+    # 100 tokens left; 300 more take 30s at 10 tokens a second
+    assert limit.try_acquire(400, now=0) == 30
+    assert limit.try_acquire(400, now=30) == 0
+    # the request bucket refilled back to its cap meanwhile
+    assert limit.tokens == 0 and limit.requests == 59
+    # a request larger than the whole budget goes once the bucket is full
+    assert limit.try_acquire(1000, now=30) == 60
+    assert limit.try_acquire(1000, now=90) == 0
+    # refills never exceed the budget
+    limit.refill(1000)
+    assert limit.requests == 60 and limit.tokens == 600
+
+def test_priority_ordering():
+    scheduler = empty_scheduler("test:model", rpm=600)
+    order = []
+
+    async def request(name, priority, delay):
+        await asyncio.sleep(delay)
+        with llm_priority(priority):
+            await scheduler.acall("test:model", lambda: record(name), 1)
+
+    async def record(name):
+        order.append(name)
+
+    async def main():
+        # the batch requests queue first, yet the interactive one is admitted ahead of them
+        await asyncio.gather(
+            request("batch-1", BATCH, 0),
+            request("batch-2", BATCH, 0.01),
+            request("interactive", INTERACTIVE, 0.02),
+        )
+
+    asyncio.run(main())
+    assert order == ["interactive", "batch-1", "batch-2"]
+    status = scheduler.status()["test:model"]
+    assert status["requests"] == 3
+    assert status["queued"] == {"interactive": 0, "batch": 0}
+
+def test_cancel_while_queued():
+    scheduler = empty_scheduler("test:model", rpm=60)
+    calls = []
+
+    async def call():
+        calls.append(1)
+
+    async def main():
+        waiting = asyncio.ensure_future(scheduler.acall("test:model", call, 1))
+        await asyncio.sleep(0.1)
+        assert scheduler.status()["test:model"]["queued"]["batch"] == 1
+        waiting.cancel()
+        try:
+            await waiting
+        except asyncio.CancelledError:
+            pass
+        # the cancelled request left the queue without running, so the next request is not stuck behind it
+        assert scheduler.status()["test:model"]["queued"]["batch"] == 0
+        scheduler._limit("test:model").requests = 1
+        await scheduler.acall("test:model", call, 1)
+
+    asyncio.run(main())
+    assert calls == [1]
+
+# Run the test
+if __name__ == "__main__":
+    test_token_refill()
+    test_priority_ordering()
+    test_cancel_while_queued()
+    print("Successfully completed")
@@ -0,0 +1,55 @@
+from prompt_budget import PromptSection, PromptTooLarge, budget_stats, check_prompt, count_tokens, fit_prompt, truncate_to_tokens
+
+def test_truncate_to_tokens():
+    text = "\n".join(f"line {i}" for i in range(200))
+    head = truncate_to_tokens(text, 50)
+    # cut on a line boundary, so no line is left partial
+    assert count_tokens(head) <= 50 and text.startswith(head) and head.splitlines()[-1] in text.splitlines()
+    tail = truncate_to_tokens(text, 50, keep="tail")
+    assert count_tokens(tail) <= 50 and text.endswith(tail) and tail.startswith("line")
+    assert truncate_to_tokens("short", 50) == "short"
+
+def test_fit_prompt():
+    instructions = "Summarize the transcript. " * 20
+    transcript = "\n".join(f"sentence number {i}." for i in range(1000))
+    slides = "\n".join(f"slide text {i}" for i in range(100))
+    fitted = fit_prompt("test_fit", [
+        PromptSection("instructions", instructions, trim=False),
+        PromptSection("slides", slides, priority=1),
+        PromptSection("transcript", transcript, keep="tail"),
+    ], budget=1000)
+
+    # the lowest priority section is trimmed first, and the prompt ends up within budget
+    assert fitted["instructions"] == instructions
+    assert fitted["slides"] == slides
+    assert fitted["transcript"].rstrip().endswith("sentence number 999.")
+    assert sum(count_tokens(text) for text in fitted.values()) <= 1000
+
+    fit_prompt("test_fit", [PromptSection("transcript", "short")], budget=1000)
+    stats = budget_stats.summary()["test_fit"]
+    assert stats["calls"] == 2 and stats["overruns"] == 1
+    assert stats["trimmed_sections"].keys() == {"transcript"}
+
+def test_fit_prompt_min_tokens():
+    sections = [PromptSection(f"group_{i}", "word " * 500, priority=-i, min_tokens=100) for i in range(3)]
+    fitted = fit_prompt("test_min_tokens", sections, budget=600)
+    assert all(count_tokens(text) >= 100 for text in fitted.values())
+    assert count_tokens(fitted["group_0"]) > count_tokens(fitted["group_2"])
+
+def test_check_prompt():
+    check_prompt("test_check", [PromptSection("document", "word " * 100)], budget=600)
+    try:
+        check_prompt("test_check", [PromptSection("document", "word " * 1000)], budget=600)
+        assert False, "an over-budget document must not pass"
+    except PromptTooLarge:
+        pass
+    stats = budget_stats.summary()["test_check"]
+    assert stats["calls"] == 2 and stats["rejected"] == 1 and stats["trimmed_tokens"] == 0
+
+# Run the test
+if __name__ == "__main__":
+    test_truncate_to_tokens()
+    test_fit_prompt()
+    test_fit_prompt_min_tokens()
+    test_check_prompt()
+    print("Successfully completed")
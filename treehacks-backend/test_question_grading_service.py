@@ -1,5 +1,5 @@
 import asyncio
-from services.questionGradingService import grade_student_answer
+from services.questionGradingService import grade_student_answer, grade_student_answers_batch
 
 async def test_question_grading():
     # Test assignment ID (you can change this as needed)
@@ -14,6 +14,22 @@ async def test_question_grading():
     except Exception as e:
         print(f"Error: {str(e)}")
 
+async def test_batch_question_grading():
+    question_id = 6
+    question_text = "In how many ways can a pack of fifty-two cards be dealt to thirteen players, four to each, so that every player has one card of each suit?"
+    answers = [
+        "Deal each suit one card per player: 13! ways per suit, so (13!)^4",
+        "52! / (4!)^13",
+        "(13!)^4",
+    ]
+    try:
+        grades = await grade_student_answers_batch(question_id, question_text, answers)
+        print(grades)
+
+    except Exception as e:
+        print(f"Error: {str(e)}")
+
 # Run the test
 if __name__ == "__main__":
-    asyncio.run(test_question_grading())
\ No newline at end of file
+    asyncio.run(test_question_grading())
+    asyncio.run(test_batch_question_grading())
\ No newline at end of file
@@ -0,0 +1,53 @@
+from timeline_index import LectureTimeline, TimelineCache
+
+def make_timeline():
+    segments = [
+        {"start": 4.0, "end": 8.0, "text": "second"},
+        {"start": 0.0, "end": 4.0, "text": "first"},
+        {"start": 8.0, "end": 12.0, "text": "third"},
+    ]
+    slide_timestamps = [{"timestamp": 0, "slide": 0}, {"timestamp": 5.5, "slide": 1}, {"timestamp": 10, "slide": 3}]
+    return LectureTimeline(segments, slide_timestamps, "https://example.com/slides.pdf")
+
+def test_transcript_until():
+    timeline = make_timeline()
+    assert timeline.transcript_until(-1) == ""
+    assert timeline.transcript_until(0) == "first"
+    assert timeline.transcript_until(7.9) == "first second"
+    assert timeline.transcript_until(100) == "first second third"
+
+def test_slide_at():
+    timeline = make_timeline()
+    assert [timeline.slide_at(t) for t in [-1, 0, 5.4, 5.5, 9, 10, 100]] == [0, 0, 0, 1, 1, 3, 3]
+
+def test_empty_timeline():
+    timeline = LectureTimeline([], [])
+    assert timeline.transcript_until(10) == ""
+    assert timeline.slide_at(10) == 0
+
+def test_timeline_cache():
+    cache = TimelineCache(max_size=2)
+    loads = []
+
+    def load(lecture_id):
+        loads.append(lecture_id)
+        return make_timeline()
+
+    first = cache.get("a", load)
+    assert cache.get("a", load) is first
+    cache.get("b", load)
+    cache.get("c", load)
+    # "a" was least recently used, so it was evicted
+    cache.get("a", load)
+    assert loads == ["a", "b", "c", "a"]
+    cache.invalidate("a")
+    cache.get("a", load)
+    assert loads[-1] == "a" and len(loads) == 5
+
+# Run the test
+if __name__ == "__main__":
+    test_transcript_until()
+    test_slide_at()
+    test_empty_timeline()
+    test_timeline_cache()
+    print("Successfully completed")
@@ -0,0 +1,60 @@
+import numpy as np
+from topic_classifier import TopicClassifier, topic_text
+
+VOCABULARY = ["graph", "tree", "sort", "hash"]
+
+def embed(texts):
+    # bag of words over a tiny vocabulary, enough to tell the topics apart
+    return np.array([[text.lower().count(word) for word in VOCABULARY] for text in texts], dtype=np.float64)
+
+TOPICS = [
+    {"id": "t1", "title": "Graph search", "description": "graph traversal"},
+    {"id": "t2", "title": "Trees", "description": None},
+    {"id": "t3", "title": "Hash tables"},
+]
+
+def test_topic_text():
+    assert topic_text(TOPICS[0]) == "Graph search: graph traversal"
+    assert topic_text(TOPICS[1]) == "Trees"
+
+def test_confident_match():
+    classifier = TopicClassifier(TOPICS, embed)
+    match = classifier.classify(["Run a BFS over this graph"])[0]
+    assert match["topic_ids"] == ["t1"]
+    assert match["topic_id"] == "t1"
+    assert match["confident"]
+    assert match["margin"] > 0.9
+
+def test_question_spanning_topics_gets_every_close_topic():
+    classifier = TopicClassifier(TOPICS, embed)
+    match = classifier.classify(["Is a tree a graph?"])[0]
+    assert sorted(match["topic_ids"]) == ["t1", "t2"]
+    assert match["confident"]
+
+def test_unclear_cut_and_unrelated_questions_are_not_confident():
+    # topics on the axes; the question is near t1, a bit less near t2 and just past the margin from t3
+    vectors = {"a": [1, 0, 0], "b": [0, 1, 0], "c": [0, 0, 1], "question": [0.9, 0.8, 0.72]}
+    axes = lambda texts: np.array([vectors[text] for text in texts], dtype=np.float64)
+    classifier = TopicClassifier([{"id": "a", "title": "a"}, {"id": "b", "title": "b"}, {"id": "c", "title": "c"}], axes, min_similarity=0.3, min_margin=0.1)
+    unclear = classifier.classify(["question"])[0]
+    assert unclear["topic_ids"] == ["a", "b"]
+    assert not unclear["confident"]
+    assert unclear["margin"] < 0.1
+
+    unrelated = TopicClassifier(TOPICS, embed).classify(["What is 2 + 2?"])[0]
+    assert unrelated["topic_ids"] == []
+    assert not unrelated["confident"]
+    assert unrelated["similarity"] == 0
+
+def test_no_topics():
+    classifier = TopicClassifier([], embed)
+    assert classifier.classify(["anything"]) == [{"topic_ids": [], "topic_id": None, "similarity": 0.0, "margin": 0.0, "confident": False}]
+
+# Run the test
+if __name__ == "__main__":
+    test_topic_text()
+    test_confident_match()
+    test_question_spanning_topics_gets_every_close_topic()
+    test_unclear_cut_and_unrelated_questions_are_not_confident()
+    test_no_topics()
+    print("Successfully completed")
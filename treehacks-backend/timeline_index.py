@@ -0,0 +1,95 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+import numpy as np
+
+# How many lectures' timelines are kept in memory, and how long before one is rebuilt from the database
+TIMELINE_CACHE_SIZE = int(os.environ.get("TIMELINE_CACHE_SIZE", "32"))
+TIMELINE_CACHE_TTL = float(os.environ.get("TIMELINE_CACHE_TTL", "3600"))
+
+class LectureTimeline:
+    """
+    Compact, query-ready index of a lecture's transcript and slide timings.
+
+    Transcript segments are sorted by start time and their text joined once,
+    with the cumulative end offset of each segment recorded, so the
+    transcript up to any time is one binary search and one slice. Slide
+    boundaries are kept as sorted (timestamp, slide) arrays for the same
+    kind of lookup.
+    """
+
+    def __init__(self, segments: List[Dict], slide_timestamps: List[Dict], slides_url: Optional[str] = None):
+        segments = sorted(segments, key=lambda segment: float(segment["start"]))
+        self.segment_starts = np.array([float(segment["start"]) for segment in segments], dtype=np.float64)
+        texts = [segment["text"] for segment in segments]
+        self.text = " ".join(texts)
+        # end of segment i's text in self.text, i.e. before the separator that follows it
+        lengths = np.array([len(text) for text in texts], dtype=np.int64)
+        self.text_ends = np.cumsum(lengths + 1) - 1 if len(texts) else np.zeros(0, dtype=np.int64)
+
+        slides = sorted(slide_timestamps, key=lambda mapping: float(mapping["timestamp"]))
+        self.slide_times = np.array([float(mapping["timestamp"]) for mapping in slides], dtype=np.float64)
+        self.slide_numbers = np.array([int(mapping["slide"]) for mapping in slides], dtype=np.int64)
+        self.slides_url = slides_url
+
+    @classmethod
+    def from_lecture(cls, lecture: Dict) -> "LectureTimeline":
+        """Build the index from a lectures row's audio_transcription and slide_mappings."""
+        if not lecture.get('slide_mappings'):
+            raise ValueError("No slide mappings found in lecture data")
+        if not lecture.get('audio_transcription'):
+            raise ValueError("No audio transcription found in lecture data")
+        return cls(
+            lecture['audio_transcription'].get('segments', []),
+            lecture['slide_mappings'].get('slide_timestamps', []),
+            lecture.get('slides')
+        )
+
+    def segments_until(self, timestamp: float) -> int:
+        """Number of transcript segments that start at or before `timestamp`."""
+        return int(np.searchsorted(self.segment_starts, timestamp, side="right"))
+
+    def transcript_until(self, timestamp: float) -> str:
+        """Text of every segment starting at or before `timestamp`, space-separated."""
+        count = self.segments_until(timestamp)
+        return self.text[:self.text_ends[count - 1]] if count else ""
+
+    def slide_at(self, timestamp: float) -> int:
+        """Slide shown at `timestamp`: the last boundary at or before it, or 0 before the first."""
+        index = int(np.searchsorted(self.slide_times, timestamp, side="right")) - 1
+        return int(self.slide_numbers[index]) if index >= 0 else 0
+
+class TimelineCache:
+    """In-process LRU of LectureTimeline per lecture, so repeated sessions skip fetching and parsing the lecture blobs."""
+
+    def __init__(self, max_size: int = TIMELINE_CACHE_SIZE, ttl: float = TIMELINE_CACHE_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple[float, LectureTimeline]]" = OrderedDict()
+
+    def get(self, lecture_id: str, load: Callable[[str], LectureTimeline]) -> LectureTimeline:
+        """The lecture's cached timeline, or `load(lecture_id)` stored for next time."""
+        key = str(lecture_id)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry and time.monotonic() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                return entry[1]
+
+        timeline = load(lecture_id)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), timeline)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+        return timeline
+
+    def invalidate(self, lecture_id: str):
+        """Drop a lecture's timeline, e.g. after its transcript or slide mappings change."""
+        with self.lock:
+            self.entries.pop(str(lecture_id), None)
+
+lecture_timelines = TimelineCache()
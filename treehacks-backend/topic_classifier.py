@@ -0,0 +1,68 @@
+import os
+from typing import Callable, Dict, List
+import numpy as np
+
+# A question is tagged locally only if its best topic is at least this similar...
+TOPIC_MIN_SIMILARITY = float(os.environ.get("TOPIC_MIN_SIMILARITY", "0.3"))
+# ...and beats the runner-up by at least this much; anything closer goes to the LLM
+TOPIC_MIN_MARGIN = float(os.environ.get("TOPIC_MIN_MARGIN", "0.05"))
+
+def topic_text(topic: Dict) -> str:
+    """What a topic is embedded as: its title, plus its description when it has one."""
+    description = (topic.get("description") or "").strip()
+    return f"{topic['title']}: {description}" if description else topic["title"]
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float64)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+class TopicClassifier:
+    """
+    Nearest-topic classifier over one class's topics.
+
+    Topic embeddings are computed once, row-normalized and kept as a matrix,
+    so scoring a batch of questions is one matrix product of cosine
+    similarities. A question is tagged with its best topic and every other
+    topic within `min_margin` of it, as long as each clears `min_similarity`,
+    since a question can cover several topics. The tagging counts as
+    confident only when the best topic clears `min_similarity` and the first
+    topic left out trails the last one tagged by at least `min_margin`;
+    otherwise where to cut is a guess, and the caller should ask the LLM.
+    """
+
+    def __init__(self, topics: List[Dict], embed: Callable[[List[str]], np.ndarray],
+                 min_similarity: float = TOPIC_MIN_SIMILARITY, min_margin: float = TOPIC_MIN_MARGIN):
+        self.topic_ids = [topic["id"] for topic in topics]
+        self.embed = embed
+        self.min_similarity = min_similarity
+        self.min_margin = min_margin
+        self.matrix = normalize_rows(embed([topic_text(topic) for topic in topics])) if topics else np.zeros((0, 0))
+
+    def classify(self, texts: List[str]) -> List[Dict]:
+        """
+        Topics per text as {"topic_ids", "topic_id", "similarity", "margin",
+        "confident"}: the tagged topics best first, the best topic and its
+        similarity, and the gap between the last tagged topic and the first
+        one left out (the last tagged topic's similarity when none is left out).
+        """
+        if not texts or not self.topic_ids:
+            return [{"topic_ids": [], "topic_id": None, "similarity": 0.0, "margin": 0.0, "confident": False} for _ in texts]
+
+        similarities = normalize_rows(self.embed(texts)) @ self.matrix.T
+        order = np.argsort(-similarities, axis=1)
+        matches = []
+        for row, ranked in zip(similarities, order):
+            scores = row[ranked]
+            best = float(scores[0])
+            tagged = int(np.sum((scores >= self.min_similarity) & (best - scores <= self.min_margin)))
+            last = float(scores[max(tagged, 1) - 1])
+            following = float(scores[tagged]) if 0 < tagged < len(scores) else 0.0
+            matches.append({
+                "topic_ids": [self.topic_ids[index] for index in ranked[:tagged]],
+                "topic_id": self.topic_ids[ranked[0]],
+                "similarity": best,
+                "margin": last - following if tagged else 0.0,
+                "confident": bool(tagged and last - following >= self.min_margin),
+            })
+        return matches
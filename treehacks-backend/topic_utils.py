@@ -1,22 +1,41 @@
-from typing import List, Dict, Set
+from typing import List, Dict, Tuple
 import os
+import json
+import functools
+import threading
 from supabase import create_client, Client
 from dotenv import load_dotenv
 import google.generativeai as genai
+from llm_cache import cached_generate_content
+from topic_classifier import TopicClassifier
+from services.insightClusteringService import embed_texts
 
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 supabase: Client = create_client(url, key)
 
-def setup_gemini():
-    """Initialize Gemini API with key"""
+# Gemini model topics are assigned with; it must support JSON schema output
+TOPIC_MODEL = os.environ.get("TOPIC_MODEL", "gemini-2.0-flash")
+
+# How many questions each categorization stage has settled since startup
+categorization_stats: Dict[str, int] = {"local": 0, "llm": 0, "nearest": 0, "unassigned": 0}
+# categorization runs on worker threads (e.g. question generation), so the counts are updated under a lock
+_categorization_stats_lock = threading.Lock()
+
+# Local classifier per class_id, with the topics it was built from
+_classifiers: Dict[str, Tuple[tuple, TopicClassifier]] = {}
+_classifiers_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def setup_gemini(model_name: str = TOPIC_MODEL):
+    """Initialize Gemini API with key (once per model)"""
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
         raise ValueError("API key not found")
     
     genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-pro')
+    return genai.GenerativeModel(model_name)
 
 def get_all_topics(class_id: str) -> List[Dict]:
     """Get all topics from the topics table."""
@@ -47,74 +66,189 @@ def get_topics_for_question_generation(class_id: str) -> List[Dict]:
     return [{"id": topic["id"], "title": topic["title"]} 
             for topic in topics]
 
+def normalize_topic_title(title: str) -> str:
+    """Case- and whitespace-insensitive form of a topic title, for matching model output to topics."""
+    return " ".join(title.split()).casefold()
+
+def build_topic_index(topics: List[Dict]) -> Dict[str, str]:
+    """Map each normalized topic title to its topic id."""
+    return {normalize_topic_title(topic["title"]): topic["id"] for topic in topics}
+
+def get_categorization_stats() -> Dict:
+    """Per-stage counts and hit rates of topic categorization since startup."""
+    with _categorization_stats_lock:
+        counts = dict(categorization_stats)
+    total = sum(counts.values())
+    return {
+        "total": total,
+        "counts": counts,
+        "hit_rates": {stage: (count / total if total else 0.0) for stage, count in counts.items()},
+    }
+
+def record_categorization(counts: Dict[str, int]):
+    with _categorization_stats_lock:
+        for stage, count in counts.items():
+            categorization_stats[stage] += count
+
+def get_topic_classifier(class_id: str, topics: List[Dict]) -> TopicClassifier:
+    """The class's local topic classifier, rebuilt only when its topics change."""
+    fingerprint = tuple((topic["id"], topic["title"], topic.get("description")) for topic in topics)
+    with _classifiers_lock:
+        entry = _classifiers.get(class_id)
+    if entry and entry[0] == fingerprint:
+        return entry[1]
+    classifier = TopicClassifier(topics, embed_texts)
+    with _classifiers_lock:
+        _classifiers[class_id] = (fingerprint, classifier)
+    return classifier
+
 def categorize_question(question_text: str, explanation: str, class_id: str) -> List[str]:
     """
-    Use LLM to categorize a question into one or more relevant topics.
+    Categorize a question into one or more relevant topics.
     Returns a list of topic IDs that the question belongs to.
     """
+    return categorize_questions([{"text": question_text, "explanation": explanation}], class_id)[0]
+
+def categorize_questions(questions: List[Dict[str, str]], class_id: str, topics: List[Dict] = None) -> List[List[str]]:
+    """
+    Categorize several questions, given as {"text", "explanation"} dicts, into topics.
+
+    Each question is first scored against the class's topic embeddings
+    locally, and tagged with every topic close to its best match when the
+    cut between those and the rest is clear (see TopicClassifier). The remaining questions go to the LLM together in one
+    request. A question the LLM cannot place keeps its nearest topic if that
+    is similar enough, and is otherwise left untagged rather than guessed.
+    Per-stage counts accumulate in categorization_stats.
+
+    Returns the topic ids of each question, in input order.
+    """
+    if not questions:
+        return []
+    topics = topics if topics is not None else get_all_topics(class_id)
+    if not topics:
+        print("Error in topic categorization: No topics available for categorization")
+        record_categorization({"unassigned": len(questions)})
+        return [[] for _ in questions]
+
+    texts = [f"{question['text']}\n{question.get('explanation') or ''}".strip() for question in questions]
     try:
-        # Get all available topics
-        topics = get_all_topics(class_id)
-        if not topics:
-            raise Exception("No topics available for categorization")
-        
-        # Create topic context
+        classifier = get_topic_classifier(class_id, topics)
+        matches = classifier.classify(texts)
+    except Exception as e:
+        print(f"Local topic classification failed, sending every question to the LLM: {str(e)}")
+        classifier = None
+        matches = [{"topic_ids": [], "topic_id": None, "similarity": 0.0, "margin": 0.0, "confident": False} for _ in questions]
+
+    topic_ids: List[List[str]] = [match["topic_ids"] if match["confident"] else [] for match in matches]
+    escalated = [i for i, match in enumerate(matches) if not match["confident"]]
+    counts = {"local": len(questions) - len(escalated), "llm": 0, "nearest": 0, "unassigned": 0}
+
+    if escalated:
+        llm_topic_ids = categorize_with_llm([questions[i] for i in escalated], topics)
+        for i, ids in zip(escalated, llm_topic_ids):
+            if ids:
+                topic_ids[i] = ids
+                counts["llm"] += 1
+            elif classifier and matches[i]["topic_id"] and matches[i]["similarity"] >= classifier.min_similarity:
+                topic_ids[i] = [matches[i]["topic_id"]]
+                counts["nearest"] += 1
+            else:
+                print(f"No topic found for question: {questions[i]['text'][:80]}")
+                counts["unassigned"] += 1
+
+    record_categorization(counts)
+    print(f"topic categorization: {counts['local']} local, {counts['llm']} llm, {counts['nearest']} nearest, {counts['unassigned']} unassigned")
+    return topic_ids
+
+def parse_categorization_reply(response_text: str, question_count: int, topic_index: Dict[str, str]) -> List[List[str]]:
+    """
+    Map a categorization reply's topic titles to ids through `topic_index`,
+    keeping each question's order and dropping repeats. Raises ValueError
+    unless the reply has exactly one entry per question.
+    """
+    entries = json.loads(response_text or "")["questions"]
+    if not isinstance(entries, list):
+        raise ValueError(f"Expected a list of questions, got {type(entries)}")
+    topic_ids: List[List[str]] = [[] for _ in range(question_count)]
+    numbers = set()
+    for entry in entries:
+        number = entry.get("question_number")
+        if not isinstance(number, int) or not 1 <= number <= question_count or number in numbers:
+            raise ValueError(f"Unexpected question_number {number!r} for {question_count} questions")
+        numbers.add(number)
+        for title in entry.get("topics", []):
+            topic_id = topic_index.get(normalize_topic_title(title))
+            if topic_id is not None and topic_id not in topic_ids[number - 1]:
+                topic_ids[number - 1].append(topic_id)
+    if len(numbers) != question_count:
+        raise ValueError(f"Expected {question_count} categorized questions, got {len(numbers)}")
+    return topic_ids
+
+def categorize_with_llm(questions: List[Dict[str, str]], topics: List[Dict]) -> List[List[str]]:
+    """
+    Categorize questions into `topics` with one structured LLM request. The
+    model may only answer with topic titles, which are still checked against
+    a title -> id index. Returns each question's topic ids, empty where the
+    model found none or the request failed.
+    """
+    topic_index = build_topic_index(topics)
+
+    try:
+        # Create topic and question context
         topic_context = "\n".join([
             f"- {topic['title']}"
             for topic in topics
         ])
+        question_context = "\n\n".join([
+            f"Question {i + 1}: {question['text']}\nExplanation: {question.get('explanation') or ''}"
+            for i, question in enumerate(questions)
+        ])
         
         # Setup prompt for topic categorization
         prompt = f"""You are an expert at categorizing educational content.
-        Given a question and its explanation, determine which topics from the list below are relevant.
+        For each question below, together with its explanation, determine which topics from the list below are relevant.
         A question can belong to multiple topics if it spans multiple concepts.
         
         Available Topics:
         {topic_context}
         
-        Question: {question_text}
-        Explanation: {explanation}
+        {question_context}
         
-        Return ONLY a JSON array of topic titles that are relevant to this question. Consider:
+        For each question, consider:
         1. The main concept being tested
         2. Related concepts needed to answer the question
         3. Concepts mentioned in the explanation
         
-        Return the array in this exact format (no other text):
-        ["Topic 1", "Topic 2"]"""
+        Return one entry per question with its question_number and the exact titles of its relevant topics."""
         
-        # Get model response
-        model = setup_gemini()
-        response = model.generate_content(prompt)
+        titles = sorted({topic["title"] for topic in topics})
+        # a reply missing any question is never cached, so the next request for the same questions asks again
+        response = cached_generate_content(setup_gemini(), prompt, validate=lambda response: parse_categorization_reply(response.text, len(questions), topic_index), generation_config={
+            "response_mime_type": "application/json",
+            "response_schema": {
+                "type": "object",
+                "properties": {
+                    "questions": {
+                        "type": "array",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "question_number": {"type": "integer"},
+                                "topics": {"type": "array", "items": {"type": "string", "enum": titles}}
+                            },
+                            "required": ["question_number", "topics"]
+                        }
+                    }
+                },
+                "required": ["questions"]
+            }
+        })
         if not response or not response.text:
             raise Exception("No response from model")
+        topic_ids = parse_categorization_reply(response.text, len(questions), topic_index)
         
-        # Parse response and clean it up
-        response_text = response.text.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-            
-        # Parse topic titles
-        import json
-        topic_titles = json.loads(response_text)
-        
-        # Map titles to IDs
-        topic_map = {topic["title"]: topic["id"] for topic in topics}
-        topic_ids = []
-        
-        for title in topic_titles:
-            if title in topic_map:
-                topic_ids.append(topic_map[title])
-        
-        # If no topics were matched, return the most relevant topic
-        if not topic_ids and topics:
-            topic_ids = [topics[0]["id"]]
-            
         return topic_ids
         
     except Exception as e:
-        # If anything fails, return the first topic as a fallback
         print(f"Error in topic categorization: {str(e)}")
-        return [topics[0]["id"]] if topics else []
+        return [[] for _ in questions]